@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Microbenchmark for dm-crypt key generation.
+
+Compares generating keys one by one with generating them in a single
+batch from one getrandom() buffer, for a range of key sizes::
+
+    python3 tools/keygen-benchmark.py --count 100 --repeat 20
+"""
+
+import argparse
+import timeit
+
+from vaultlocker import dmcrypt
+
+
+def main():
+    parser = argparse.ArgumentParser('keygen-benchmark')
+    parser.add_argument('--count', default=100, type=int,
+                        help="Number of keys generated per run")
+    parser.add_argument('--repeat', default=20, type=int,
+                        help="Number of timed runs; the best one is shown")
+    parser.add_argument('--key-size', type=int, action='append',
+                        help="Key size in bits (may be repeated; default: "
+                             "512, 2048 and {})".format(dmcrypt.KEY_SIZE))
+    args = parser.parse_args()
+    if args.key_size is None:
+        args.key_size = [512, 2048, dmcrypt.KEY_SIZE]
+
+    print('{:>9} {:>14} {:>14} {:>8}'.format(
+        'key bits', 'single (us)', 'batch (us)', 'speedup'))
+    for key_size in sorted(set(args.key_size)):
+        single = min(timeit.repeat(
+            lambda: [dmcrypt.generate_key(key_size)
+                     for _ in range(args.count)],
+            number=1, repeat=args.repeat,
+        ))
+        batch = min(timeit.repeat(
+            lambda: dmcrypt.generate_keys(args.count, key_size),
+            number=1, repeat=args.repeat,
+        ))
+        print('{:>9} {:>14.1f} {:>14.1f} {:>7.2f}x'.format(
+            key_size,
+            single / args.count * 1e6,
+            batch / args.count * 1e6,
+            single / batch,
+        ))
+
+
+if __name__ == '__main__':
+    main()
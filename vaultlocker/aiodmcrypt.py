@@ -0,0 +1,185 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Awaitable counterparts of the vaultlocker.dmcrypt operations.
+
+The commands are the same as those of vaultlocker.dmcrypt, run with
+asyncio.create_subprocess_exec so that one event loop can drive many of
+them at once. Failures raise the subprocess exceptions the blocking
+functions raise, with stdout and stderr captured:
+
+* subprocess.CalledProcessError if the command exits non-zero
+* subprocess.TimeoutExpired if it did not finish within the timeout
+
+A command that times out or whose task is cancelled is terminated,
+given GRACE_PERIOD seconds to clean up and then killed; it is always
+reaped before the exception propagates.
+"""
+
+import asyncio
+import logging
+import subprocess
+from typing import Optional, Sequence, Union
+
+from vaultlocker import dmcrypt
+from vaultlocker import tracing
+
+logger = logging.getLogger(__name__)
+
+# seconds a terminated cryptsetup gets to release its device
+GRACE_PERIOD = 5.0
+READ_SIZE = 64 * 1024
+
+Key = Union[str, bytearray]
+
+
+async def _read(stream: asyncio.StreamReader, chunks: list[bytes]) -> None:
+    while True:
+        chunk = await stream.read(READ_SIZE)
+        if not chunk:
+            return
+        chunks.append(chunk)
+
+
+async def _stop(
+    process: asyncio.subprocess.Process, communication: asyncio.Future
+) -> None:
+    """Terminate a process, kill it after the grace period, and reap it."""
+    if process.returncode is None:
+        process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.shield(communication),
+                                   GRACE_PERIOD)
+        except asyncio.TimeoutError:
+            process.kill()
+    await communication
+
+
+async def run(
+    command: Sequence[str],
+    timeout: Optional[float] = None,
+    pass_fds: Sequence[int] = (),
+) -> bytes:
+    """Run a command and return its output.
+
+    :param command: argument list of the command
+    :param timeout: seconds to wait for the command, or None
+    :param pass_fds: file descriptors the command inherits
+    :returns: bytes written to stdout
+    :raises subprocess.CalledProcessError: if the command failed
+    :raises subprocess.TimeoutExpired: if the command timed out
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=pass_fds,
+    )
+    output: list[bytes] = []
+    error: list[bytes] = []
+
+    async def _communicate():
+        await asyncio.gather(_read(process.stdout, output),
+                             _read(process.stderr, error))
+        await process.wait()
+
+    # output read before a timeout is kept for the exception
+    communication = asyncio.ensure_future(_communicate())
+    try:
+        await asyncio.wait_for(asyncio.shield(communication), timeout)
+    except asyncio.TimeoutError:
+        await asyncio.shield(_stop(process, communication))
+        logger.error('%s timed out after %ss', command[0], timeout)
+        raise subprocess.TimeoutExpired(list(command), timeout,
+                                        b''.join(output), b''.join(error))
+    except asyncio.CancelledError:
+        # shielded so that a second cancellation cannot leave a child
+        # process behind
+        await asyncio.shield(_stop(process, communication))
+        raise
+    if process.returncode:
+        logger.error('%s failed with exit status %s: %s', command[0],
+                     process.returncode,
+                     b''.join(error).decode('utf-8', 'replace').strip())
+        raise subprocess.CalledProcessError(process.returncode,
+                                            list(command), b''.join(output),
+                                            b''.join(error))
+    return b''.join(output)
+
+
+@tracing.traced('dmcrypt.luks_format', 'device', 'uuid', 'header')
+async def luks_format(
+    key: Key, device: str, uuid: str, header: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> None:
+    """LUKS format a block device, as dmcrypt.luks_format.
+
+    :param key: string or bytearray containing the encryption key
+    :param device: full path to block device to use
+    :param uuid: uuid to use for encrypted block device
+    :param header: file for a detached LUKS2 header
+    :param timeout: seconds to wait for cryptsetup, or None
+    """
+    logger.info('LUKS formatting {} using UUID:{}'.format(device, uuid))
+    with dmcrypt._key_file(key) as key_fd:
+        command = dmcrypt._luks_format_command(
+            dmcrypt._key_file_path(key_fd), device, uuid, header)
+        await run(command, timeout, pass_fds=(key_fd,))
+
+
+@tracing.traced('dmcrypt.luks_open', 'uuid', 'header', 'device')
+async def luks_open(
+    key: Key, uuid: str, header: Optional[str] = None,
+    device: Optional[str] = None, timeout: Optional[float] = None,
+) -> str:
+    """LUKS open a block device by UUID, as dmcrypt.luks_open.
+
+    :param key: string or bytearray containing the encryption key
+    :param uuid: uuid of the encrypted block device
+    :param header: detached LUKS header of the device
+    :param device: path of the data device; required with header
+    :param timeout: seconds to wait for cryptsetup, or None
+    :returns: dm-crypt mapping
+    """
+    logger.info('LUKS opening {}'.format(uuid))
+    with dmcrypt._key_file(key) as key_fd:
+        command = dmcrypt._luks_open_command(
+            dmcrypt._key_file_path(key_fd), uuid, header, device)
+        await run(command, timeout, pass_fds=(key_fd,))
+    return dmcrypt._luks_handle(uuid)
+
+
+@tracing.traced('dmcrypt.udevadm_rescan', 'device')
+async def udevadm_rescan(
+    device: str, timeout: Optional[float] = None
+) -> None:
+    """udevadm trigger for block device addition, as dmcrypt.udevadm_rescan.
+
+    :param device: full path to block device to use
+    :param timeout: seconds to wait for udevadm, or None
+    """
+    logger.info('udevadm trigger block/add for {}'.format(device))
+    await run(dmcrypt._udevadm_rescan_command(device), timeout)
+
+
+@tracing.traced('dmcrypt.udevadm_settle', 'uuid')
+async def udevadm_settle(
+    uuid: str, timeout: Optional[float] = None
+) -> None:
+    """udevadm settle an encrypted device, as dmcrypt.udevadm_settle.
+
+    :param uuid: uuid of the encrypted block device
+    :param timeout: seconds to wait for udevadm, or None
+    """
+    logger.info('udevadm settle /dev/disk/by-uuid/{}'.format(uuid))
+    await run(dmcrypt._udevadm_settle_command(uuid), timeout)
@@ -0,0 +1,247 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+import binascii
+import collections
+from concurrent import futures
+import json
+import logging
+import os
+from typing import Any, Callable, Optional, TextIO
+
+import hvac
+
+from vaultlocker import ratelimit
+from vaultlocker import vault
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = 'ok'
+STATUS_MISSING = 'missing'
+STATUS_UNREGISTERED = 'unregistered'
+STATUS_INVALID = 'invalid'
+STATUS_ERROR = 'error'
+
+
+def valid_record(record: Any) -> bool:
+    """Return whether a KV record holds a usable key.
+
+    :param record: KV record of a device
+    :returns: bool
+    """
+    if not isinstance(record, dict):
+        return False
+    wrapped = record.get('wrapped_key')
+    if wrapped is not None:
+        return isinstance(wrapped, str) and wrapped.startswith('vault:')
+    key = record.get('dmcrypt_key')
+    if not isinstance(key, str) or not key:
+        return False
+    try:
+        base64.b64decode(key, validate=True)
+    except binascii.Error:
+        return False
+    return True
+
+
+def read_checkpoint(path: str) -> Optional[str]:
+    """Return the last hostname completed by a previous audit.
+
+    :param path: checkpoint file
+    :returns: hostname, or None if there is no checkpoint
+    """
+    try:
+        with open(path) as checkpoint:
+            return json.load(checkpoint)['last_host']
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path: str, hostname: str) -> None:
+    """Atomically record the last hostname completed by an audit.
+
+    :param path: checkpoint file
+    :param hostname: last completed hostname
+    """
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as checkpoint:
+        json.dump({'last_host': hostname}, checkpoint)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.rename(tmp_path, path)
+
+
+class Auditor:
+    """Audit the keys of every host stored in a Vault KV mount.
+
+    Hosts are processed in sorted pages. Within a page host listings and
+    key reads run concurrently on a bounded pool, and every request to
+    Vault first takes a token from the optional rate limiter.
+    """
+
+    def __init__(
+        self,
+        store: vault.KVStoreBase,
+        workers: int = 16,
+        page_size: int = 100,
+        limiter: Optional[ratelimit.TokenBucket] = None,
+        inventory: Optional[dict[str, list[str]]] = None,
+    ) -> None:
+        self.store = store
+        self.workers = workers
+        self.page_size = page_size
+        self.limiter = limiter
+        self.inventory = inventory
+
+    def _request(self, func: Callable, *args) -> Any:
+        if self.limiter:
+            self.limiter.acquire()
+        return func(*args)
+
+    def hostnames(self) -> list[str]:
+        """Return the sorted hostnames stored in the mount.
+
+        Hosts of the inventory are included even if Vault has no keys
+        for them.
+        """
+        try:
+            entries = self._request(self.store.list, '')
+        except hvac.exceptions.InvalidPath:
+            entries = []
+        hostnames = {entry.rstrip('/') for entry in entries}
+        if self.inventory:
+            hostnames.update(self.inventory)
+        return sorted(hostnames)
+
+    def _host_records(self, hostname: str) -> dict[str, Any]:
+        """Return the KV records of a host, or its device UUIDs
+
+        Host key documents are read in full; per-device entries are
+        only listed here and returned with a None record.
+        """
+        records = {}
+        try:
+            document = self._request(self.store.read, hostname)
+        except hvac.exceptions.InvalidPath:
+            pass
+        else:
+            records.update(document.get('keys', {}))
+        try:
+            entries = self._request(self.store.list, hostname)
+        except hvac.exceptions.InvalidPath:
+            entries = []
+        for entry in entries:
+            if not entry.endswith('/'):
+                records.setdefault(entry, None)
+        return records
+
+    def _read(self, hostname: str, block_uuid: str) -> Any:
+        return self._request(
+            self.store.read, '{}/{}'.format(hostname, block_uuid)
+        )
+
+    def audit_page(self, hostnames: list[str]) -> list[dict[str, Any]]:
+        """Audit a page of hosts.
+
+        :param hostnames: hostnames to audit
+        :returns: list of result dicts, one per host key
+        """
+        results = []
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {
+                hostname: pool.submit(self._safe, self._host_records,
+                                      hostname)
+                for hostname in hostnames
+            }
+            listings = {
+                hostname: future.result()
+                for hostname, future in pending.items()
+            }
+            reads = {
+                (hostname, block_uuid): pool.submit(
+                    self._safe, self._read, hostname, block_uuid)
+                for hostname, records in listings.items()
+                if not isinstance(records, Exception)
+                for block_uuid, record in records.items()
+                if record is None
+            }
+            for hostname in hostnames:
+                records = listings[hostname]
+                if isinstance(records, Exception):
+                    results.append({'host': hostname, 'uuid': None,
+                                    'status': STATUS_ERROR,
+                                    'error': str(records)})
+                    continue
+                for block_uuid in sorted(records):
+                    record = records[block_uuid]
+                    if record is None:
+                        record = reads[(hostname, block_uuid)].result()
+                    results.append(
+                        self._result(hostname, block_uuid, record))
+                registered = (self.inventory or {}).get(hostname, [])
+                for block_uuid in sorted(set(registered) - set(records)):
+                    results.append({'host': hostname, 'uuid': block_uuid,
+                                    'status': STATUS_MISSING})
+        return results
+
+    @staticmethod
+    def _safe(func: Callable, *args) -> Any:
+        try:
+            return func(*args)
+        except hvac.exceptions.VaultError as vault_error:
+            return vault_error
+
+    def _result(
+        self, hostname: str, block_uuid: str, record: Any
+    ) -> dict[str, Any]:
+        result = {'host': hostname, 'uuid': block_uuid}
+        if isinstance(record, Exception):
+            result.update(status=STATUS_ERROR, error=str(record))
+        elif not valid_record(record):
+            result['status'] = STATUS_INVALID
+        elif (self.inventory is not None and
+                block_uuid not in self.inventory.get(hostname, [])):
+            result['status'] = STATUS_UNREGISTERED
+        else:
+            result['status'] = STATUS_OK
+        return result
+
+    def audit(
+        self,
+        output: TextIO,
+        start_after: Optional[str] = None,
+        checkpoint: Optional[str] = None,
+    ) -> collections.Counter:
+        """Audit all hosts, streaming results as NDJSON.
+
+        :param output: file receiving one JSON object per line
+        :param start_after: skip hostnames up to and including this one
+        :param checkpoint: file recording the last completed page
+        :returns: Counter of result statuses
+        """
+        hostnames = [
+            hostname for hostname in self.hostnames()
+            if start_after is None or hostname > start_after
+        ]
+        counts = collections.Counter()
+        for offset in range(0, len(hostnames), self.page_size):
+            page = hostnames[offset:offset + self.page_size]
+            for result in self.audit_page(page):
+                counts[result['status']] += 1
+                output.write(json.dumps(result) + '\n')
+            output.flush()
+            if checkpoint:
+                write_checkpoint(checkpoint, page[-1])
+            logger.info('Audited %d of %d hosts',
+                        offset + len(page), len(hostnames))
+        return counts
@@ -0,0 +1,196 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import configparser
+import json
+import os
+import tempfile
+import types
+from typing import Any, Optional
+
+DEFAULT_SECTION = configparser.DEFAULTSECT
+CACHE_FORMAT = 1
+
+_UNSET = object()
+
+
+def to_boolean(value: str) -> bool:
+    """Convert an option value to a bool as configparser does.
+
+    :raises ValueError: if the value is not a boolean
+    """
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError('Not a boolean: {}'.format(value))
+
+
+class Config:
+    """Immutable vaultlocker configuration.
+
+    Provides the read-only part of the configparser API used by
+    vaultlocker over a frozen copy of the parsed options.  As with
+    configparser, options of the DEFAULT section are visible in every
+    section.
+    """
+
+    def __init__(self, sections: dict[str, dict[str, str]]) -> None:
+        defaults = dict(sections.get(DEFAULT_SECTION, {}))
+        self._sections = types.MappingProxyType({
+            name: types.MappingProxyType(
+                values if name == DEFAULT_SECTION
+                else {**defaults, **values}
+            )
+            for name, values in {DEFAULT_SECTION: defaults,
+                                 **sections}.items()
+        })
+
+    @classmethod
+    def from_parser(cls, parser: configparser.ConfigParser) -> 'Config':
+        """Build a config from a populated ConfigParser."""
+        defaults = dict(parser.items(DEFAULT_SECTION))
+        sections = {DEFAULT_SECTION: defaults}
+        for name in parser.sections():
+            sections[name] = {
+                option: value for option, value in parser.items(name)
+                if defaults.get(option, _UNSET) != value
+            }
+        return cls(sections)
+
+    def get(self, section: str, option: str, *, fallback: Any = _UNSET
+            ) -> Any:
+        """Return an option value.
+
+        :param section: section name
+        :param option: option name
+        :param fallback: value returned if the option is not set
+        :raises configparser.NoSectionError: if the section does not
+            exist and no fallback is given.
+        :raises configparser.NoOptionError: if the option is not set and
+            no fallback is given.
+        """
+        values = self._sections.get(section)
+        if values is None:
+            if fallback is _UNSET:
+                raise configparser.NoSectionError(section)
+            return fallback
+        if option not in values:
+            if fallback is _UNSET:
+                raise configparser.NoOptionError(option, section)
+            return fallback
+        return values[option]
+
+    def has_option(self, section: str, option: str) -> bool:
+        return option in self._sections.get(section, {})
+
+    def sections(self) -> list[str]:
+        return [name for name in self._sections if name != DEFAULT_SECTION]
+
+    def to_dict(self) -> dict[str, dict[str, str]]:
+        """Return the options of every section, DEFAULT included."""
+        defaults = self._sections[DEFAULT_SECTION]
+        return {
+            name: {
+                option: value for option, value in values.items()
+                if name == DEFAULT_SECTION or
+                defaults.get(option, _UNSET) != value
+            }
+            for name, values in self._sections.items()
+        }
+
+    def replace(self, **sections: dict[str, str]) -> 'Config':
+        """Return a copy with options of the given sections replaced.
+
+        ``DEFAULT`` options are passed as the ``DEFAULT`` keyword.
+        """
+        merged = self.to_dict()
+        for name, values in sections.items():
+            merged.setdefault(name, {}).update(values)
+        return Config(merged)
+
+    def __eq__(self, other: object) -> bool:
+        return (isinstance(other, Config) and
+                self.to_dict() == other.to_dict())
+
+
+def read(path: str) -> Config:
+    """Parse a vaultlocker configuration file.
+
+    :param path: path to the configuration file
+    :returns: Config
+    :raises FileNotFoundError: if the file does not exist
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            "Configuration file not found: {}".format(path)
+        )
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    return Config.from_parser(parser)
+
+
+def _source_stamp(path: str) -> dict[str, Any]:
+    stat = os.stat(path)
+    return {
+        'path': os.path.abspath(path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+    }
+
+
+def read_cache(cache_path: str, path: str) -> Optional[Config]:
+    """Return a cached config if it was built from the current file.
+
+    :param cache_path: cache file written by :func:`write_cache`
+    :param path: path to the configuration file
+    :returns: Config, or None if the cache is missing or stale
+    """
+    try:
+        with open(cache_path) as cache:
+            cached = json.load(cache)
+        stamp = _source_stamp(path)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(cached, dict) or
+            cached.get('format') != CACHE_FORMAT or
+            cached.get('source') != stamp):
+        return None
+    return Config(cached['sections'])
+
+
+def write_cache(cache_path: str, path: str, config: Config) -> None:
+    """Atomically store a validated config for later processes.
+
+    The cache holds the same secrets as the configuration file and is
+    only readable by its owner.
+
+    :param cache_path: cache file to write
+    :param path: path to the configuration file the config was read from
+    :param config: validated Config
+    """
+    cache_dir = os.path.dirname(cache_path) or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    # a private temporary file per writer, as the decrypt units of a
+    # host all refresh the cache at once during boot
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir,
+                                    prefix='.config-cache-')
+    try:
+        with os.fdopen(fd, 'w') as cache:
+            json.dump({
+                'format': CACHE_FORMAT,
+                'source': _source_stamp(path),
+                'sections': config.to_dict(),
+            }, cache)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,227 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fnmatch
+import logging
+import os
+import re
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+SYS_CLASS_BLOCK = '/sys/class/block'
+UDEV_DATA = '/run/udev/data'
+MOUNTINFO = '/proc/self/mountinfo'
+DEV = '/dev'
+SECTOR_SIZE = 512
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30,
+              'T': 1 << 40, 'P': 1 << 50}
+_SIZE = re.compile(r'^(\d+(?:\.\d+)?)([KMGTP]?)(?:i?B)?$', re.IGNORECASE)
+
+TYPE_DISK = 'disk'
+TYPE_PARTITION = 'part'
+
+
+def parse_size(value: str) -> int:
+    """Parse a size such as 512, 100G or 1.5TiB into bytes.
+
+    Units are binary.
+    """
+    match = _SIZE.match(value.strip())
+    if match is None:
+        raise ValueError("Invalid size '{}'".format(value))
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def _read(path: str, default: Optional[str] = None) -> Optional[str]:
+    try:
+        with open(path) as attribute:
+            return attribute.read().strip()
+    except OSError:
+        return default
+
+
+def _listdir(path: str) -> list[str]:
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+def _udev_record(
+    dev: str, udev_dir: str
+) -> tuple[dict[str, str], list[str]]:
+    """Return the properties and symlinks udev recorded for a device."""
+    properties, links = {}, []
+    try:
+        with open(os.path.join(udev_dir, 'b{}'.format(dev))) as record:
+            for line in record:
+                kind, _, value = line.rstrip('\n').partition(':')
+                if kind == 'E':
+                    name, _, value = value.partition('=')
+                    properties[name] = value
+                elif kind == 'S':
+                    links.append(os.path.join(DEV, value))
+    except OSError:
+        pass
+    return properties, links
+
+
+def _mounted_devices(mountinfo: str) -> set[str]:
+    """Return the major:minor numbers of mounted block devices."""
+    mounted = set()
+    try:
+        with open(mountinfo) as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) > 2:
+                    mounted.add(fields[2])
+    except OSError:
+        pass
+    return mounted
+
+
+def scan(
+    sys_dir: str = SYS_CLASS_BLOCK,
+    udev_dir: str = UDEV_DATA,
+    mountinfo: str = MOUNTINFO,
+) -> list[dict[str, Any]]:
+    """Describe every block device of the host.
+
+    All attributes come from one pass over sysfs and the udev database;
+    no process is run per device.
+
+    :param sys_dir: sysfs directory of block devices
+    :param udev_dir: udev database directory
+    :param mountinfo: mount table of the process
+    :returns: list of dicts, one per device, sorted by name
+    """
+    mounted = _mounted_devices(mountinfo)
+    devices = []
+    for name in _listdir(sys_dir):
+        path = os.path.join(sys_dir, name)
+        dev = _read(os.path.join(path, 'dev'))
+        if dev is None:
+            continue
+        partition = os.path.exists(os.path.join(path, 'partition'))
+        # attributes of the whole disk, for partitions its parent
+        disk = (os.path.dirname(os.path.realpath(path)) if partition
+                else path)
+        properties, links = _udev_record(dev, udev_dir)
+        model = (_read(os.path.join(disk, 'device', 'model')) or
+                 properties.get('ID_MODEL', ''))
+        devices.append({
+            'name': name,
+            'path': os.path.join(DEV, name),
+            'dev': dev,
+            'type': TYPE_PARTITION if partition else TYPE_DISK,
+            'size': int(_read(os.path.join(path, 'size'), '0')) *
+            SECTOR_SIZE,
+            'rotational': _read(os.path.join(disk, 'queue',
+                                             'rotational')) == '1',
+            'model': model,
+            'physical': os.path.exists(os.path.join(disk, 'device')),
+            'readonly': _read(os.path.join(path, 'ro')) == '1',
+            'links': links,
+            'holders': _listdir(os.path.join(path, 'holders')),
+            'partitions': [
+                child for child in _listdir(path)
+                if os.path.exists(os.path.join(path, child, 'partition'))
+            ],
+            'signature': (properties.get('ID_FS_TYPE') or
+                          properties.get('ID_PART_TABLE_TYPE')),
+            'mounted': dev in mounted,
+        })
+    return devices
+
+
+def in_use(device: dict[str, Any], contents: bool = True) -> list[str]:
+    """Return why a device cannot be encrypted, empty if it can be.
+
+    :param device: device as returned by scan
+    :param contents: also refuse devices holding partitions or a
+                     filesystem or partition table signature
+    :returns: list of reasons
+    """
+    reasons = []
+    if device['mounted']:
+        reasons.append('mounted')
+    if device['holders']:
+        reasons.append('held by {}'.format(', '.join(device['holders'])))
+    if contents and device['partitions']:
+        reasons.append('has partitions {}'.format(
+            ', '.join(device['partitions'])))
+    if contents and device['signature']:
+        reasons.append('has a {} signature'.format(device['signature']))
+    if device['readonly']:
+        reasons.append('read-only')
+    return reasons
+
+
+def find(devices: Iterable[dict[str, Any]], path: str) -> dict[str, Any]:
+    """Return the scanned device behind a device path or symlink.
+
+    :raises ValueError: if the path is not a scanned block device
+    """
+    real_path = os.path.realpath(path)
+    for device in devices:
+        if real_path == device['path'] or path in device['links']:
+            return device
+    raise ValueError('{} is not a block device'.format(path))
+
+
+def select(
+    devices: Iterable[dict[str, Any]],
+    patterns: Optional[list[str]] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    rotational: Optional[bool] = None,
+    model: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    """Select the unused physical devices matching every given filter.
+
+    :param devices: devices as returned by scan
+    :param patterns: globs matched against the device path and its
+                     udev symlinks, e.g. /dev/disk/by-id/nvme-*
+    :param min_size: smallest size in bytes
+    :param max_size: largest size in bytes
+    :param rotational: only spinning (True) or solid-state (False) disks
+    :param model: glob matched against the device model
+    :returns: list of devices
+    """
+    selected = []
+    for device in devices:
+        if not device['physical'] or not device['size']:
+            continue
+        if patterns and not any(
+            fnmatch.fnmatchcase(path, pattern)
+            for path in [device['path']] + device['links']
+            for pattern in patterns
+        ):
+            continue
+        if min_size is not None and device['size'] < min_size:
+            continue
+        if max_size is not None and device['size'] > max_size:
+            continue
+        if rotational is not None and device['rotational'] != rotational:
+            continue
+        if model is not None and not fnmatch.fnmatchcase(device['model'],
+                                                         model):
+            continue
+        reasons = in_use(device)
+        if reasons:
+            logger.info('Skipping %s: %s', device['path'],
+                        '; '.join(reasons))
+            continue
+        selected.append(device)
+    return selected
@@ -13,79 +13,454 @@
 # under the License.
 
 import base64
+import contextlib
 import logging
 import os
+import re
 import subprocess
 
+from vaultlocker import tracing
+
 logger = logging.getLogger(__name__)
 
 
 KEY_SIZE = 4096
+# 'Key slot 1 unlocked.' from a verbose passphrase test
+_UNLOCKED_SLOT = re.compile(r'^Key slot (\d+) unlocked', re.MULTILINE)
+# active keyslots in luksDump output of LUKS2 and LUKS1 headers
+_LUKS2_SLOT = re.compile(r'^\s+(\d+): luks2', re.MULTILINE)
+_LUKS1_SLOT = re.compile(r'^Key Slot (\d+): ENABLED', re.MULTILINE)
 
 
-def generate_key():
-    """Generate a 4096 bit random key for use with dm-crypt
+def generate_key(key_size=KEY_SIZE):
+    """Generate a random key for use with dm-crypt
 
-    :returns: str.  Base64 encoded 4096 bit key
+    :param: key_size: size of the key in bits, 4096 by default.
+    :returns: str.  Base64 encoded key
     """
-    data = os.urandom(int(KEY_SIZE / 8))
+    data = os.urandom(int(key_size / 8))
     key = base64.b64encode(data).decode('utf-8')
     return key
 
 
-def luks_format(key, device, uuid):
+def generate_keys(count, key_size=KEY_SIZE):
+    """Generate several random keys for use with dm-crypt
+
+    All keys are cut from a single buffer filled by one getrandom()
+    call instead of reading the kernel RNG once per key.
+
+    :param: count: number of keys to generate.
+    :param: key_size: size of each key in bits, 4096 by default.
+    :returns: list.  Base64 encoded keys
+    """
+    return split_keys(os.urandom(count * int(key_size / 8)), key_size)
+
+
+def split_keys(data, key_size=KEY_SIZE):
+    """Split a buffer of random bytes into base64 encoded keys
+
+    :param: data: random bytes, a multiple of the key size long.
+    :param: key_size: size of each key in bits.
+    :returns: list.  Base64 encoded keys
+    """
+    length = int(key_size / 8)
+    return [
+        base64.b64encode(data[offset:offset + length]).decode('utf-8')
+        for offset in range(0, len(data), length)
+    ]
+
+
+def wipe(buffer):
+    """Zero a mutable key buffer in place
+
+    :param: buffer: bytearray to zero.
+    """
+    buffer[:] = bytes(len(buffer))
+
+
+@contextlib.contextmanager
+def _key_file(key):
+    """Hand a key to cryptsetup through an inherited file descriptor
+
+    The key is written into an anonymous memfd (or a pre-filled pipe if
+    memfd_create is not available) rather than passed through the
+    communicate() buffers of subprocess. A str key is copied into a
+    temporary buffer that is zeroed as soon as it has been written; a
+    bytearray key is left for the caller to wipe.
+
+    :param: key: str or bytearray containing the encryption key.
+    :returns: int. file descriptor to pass to the child process
+    """
+    data = key if isinstance(key, bytearray) else bytearray(key, 'UTF-8')
+    try:
+        fd = os.memfd_create('vaultlocker-key', os.MFD_CLOEXEC)
+        write_fd = fd
+    except (AttributeError, OSError):
+        fd, write_fd = os.pipe()
+    try:
+        try:
+            with memoryview(data) as view:
+                while view:
+                    view = view[os.write(write_fd, view):]
+        finally:
+            if data is not key:
+                wipe(data)
+            if write_fd != fd:
+                os.close(write_fd)
+        if write_fd == fd:
+            os.lseek(fd, 0, os.SEEK_SET)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def _key_file_path(fd):
+    """Path under which a child process can read an inherited fd"""
+    return '/proc/self/fd/{}'.format(fd)
+
+
+def _luks_format_command(key_path, device, uuid, header=None):
+    command = [
+        'cryptsetup',
+        '--batch-mode',
+        '--uuid',
+        uuid,
+        '--key-file',
+        key_path,
+    ]
+    if header:
+        command.extend(['--type', 'luks2', '--header', header])
+    command.extend(['luksFormat', device])
+    return command
+
+
+@tracing.traced('dmcrypt.luks_format', 'device', 'uuid', 'header')
+def luks_format(key, device, uuid, header=None):
     """LUKS format a block device
 
     Format a block device using dm-crypt/LUKS with the
     provided key and uuid
 
-    :param: key: string containing the encryption key to use.
+    :param: key: string or bytearray containing the encryption key to use.
     :param: device: full path to block device to use.
     :param: uuid: uuid to use for encrypted block device.
+    :param: header: file for a detached LUKS2 header; the header is then
+                    not written to the device itself.
     """
     logger.info('LUKS formatting {} using UUID:{}'.format(device, uuid))
+    with _key_file(key) as key_fd:
+        command = _luks_format_command(_key_file_path(key_fd), device, uuid,
+                                       header)
+        subprocess.check_output(command, pass_fds=(key_fd,))
+
+
+def _luks_handle(uuid):
+    return 'crypt-{}'.format(uuid)
+
+
+def _luks_open_command(key_path, uuid, header=None, device=None):
     command = [
         'cryptsetup',
         '--batch-mode',
-        '--uuid',
-        uuid,
         '--key-file',
-        '-',
-        'luksFormat',
-        device,
+        key_path,
     ]
-    subprocess.check_output(command,
-                            input=key.encode('UTF-8'))
+    if header:
+        command.extend(['--header', header, 'open', device])
+    else:
+        command.extend(['open', 'UUID={}'.format(uuid)])
+    command.extend([
+        _luks_handle(uuid),
+        '--type',
+        'luks',
+    ])
+    return command
 
 
-def luks_open(key, uuid):
+@tracing.traced('dmcrypt.luks_open', 'uuid', 'header', 'device')
+def luks_open(key, uuid, header=None, device=None):
     """LUKS open a block device by UUID
 
     Open a block device using dm-crypt/LUKS with the
     provided key and uuid
 
-    :param: key: string containing the encryption key to use.
+    :param: key: string or bytearray containing the encryption key to use.
     :param: uuid: uuid to use for encrypted block device.
+    :param: header: detached LUKS header of the device.
+    :param: device: path of the data device; required with header, as
+                    such a device carries no UUID.
     :returns: str. dm-crypt mapping
     """
     logger.info('LUKS opening {}'.format(uuid))
-    handle = 'crypt-{}'.format(uuid)
+    with _key_file(key) as key_fd:
+        command = _luks_open_command(_key_file_path(key_fd), uuid, header,
+                                     device)
+        subprocess.check_output(command, pass_fds=(key_fd,))
+    return _luks_handle(uuid)
+
+
+@tracing.traced('dmcrypt.luks_reencrypt', 'uuid')
+def luks_reencrypt(key, uuid, resilience=None, hotzone_size=None,
+                   ionice=True):
+    """Replace the volume key of a LUKS2 device online
+
+    The device stays open while its data is reencrypted; an interrupted
+    reencryption is resumed by running this again with the same key.
+
+    :param: key: string or bytearray containing the device's key.
+    :param: uuid: uuid of the encrypted block device.
+    :param: resilience: cryptsetup resilience mode, e.g. 'checksum'.
+    :param: hotzone_size: size of the area reencrypted at once, e.g. '4M'.
+    :param: ionice: run cryptsetup in the idle IO scheduling class.
+    """
+    logger.info('LUKS reencrypting {}'.format(uuid))
+    with _key_file(key) as key_fd:
+        command = [
+            'cryptsetup',
+            '--batch-mode',
+            '--key-file',
+            _key_file_path(key_fd),
+        ]
+        if resilience:
+            command.extend(['--resilience', resilience])
+        if hotzone_size:
+            command.extend(['--hotzone-size', hotzone_size])
+        command.extend(['reencrypt', 'UUID={}'.format(uuid)])
+        if ionice:
+            command = ['ionice', '-c', '3'] + command
+        subprocess.check_output(command, pass_fds=(key_fd,))
+
+
+@tracing.traced('dmcrypt.luks_change_key', 'uuid')
+def luks_change_key(key, new_key, uuid):
+    """Replace the key of a LUKS keyslot
+
+    :param: key: string or bytearray containing the current key.
+    :param: new_key: string or bytearray containing the new key.
+    :param: uuid: uuid of the encrypted block device.
+    """
+    logger.info('LUKS changing key of {}'.format(uuid))
+    with _key_file(key) as key_fd, _key_file(new_key) as new_key_fd:
+        command = [
+            'cryptsetup',
+            '--batch-mode',
+            '--key-file',
+            _key_file_path(key_fd),
+            'luksChangeKey',
+            'UUID={}'.format(uuid),
+            _key_file_path(new_key_fd),
+        ]
+        subprocess.check_output(command, pass_fds=(key_fd, new_key_fd))
+
+
+@tracing.traced('dmcrypt.luks_test_key', 'uuid')
+def luks_test_key(key, uuid):
+    """Return whether a key unlocks a LUKS device
+
+    :param: key: string or bytearray containing the key to test.
+    :param: uuid: uuid of the encrypted block device.
+    :returns: bool
+    """
+    with _key_file(key) as key_fd:
+        command = [
+            'cryptsetup',
+            '--batch-mode',
+            '--key-file',
+            _key_file_path(key_fd),
+            'open',
+            '--test-passphrase',
+            'UUID={}'.format(uuid),
+        ]
+        try:
+            subprocess.check_output(command, pass_fds=(key_fd,))
+        except subprocess.CalledProcessError:
+            return False
+    return True
+
+
+@tracing.traced('dmcrypt.luks_add_key', 'uuid')
+def luks_add_key(key, new_key, uuid):
+    """Add a key to a free LUKS keyslot
+
+    :param: key: string or bytearray containing a current key.
+    :param: new_key: string or bytearray containing the key to add.
+    :param: uuid: uuid of the encrypted block device.
+    """
+    logger.info('LUKS adding key to {}'.format(uuid))
+    with _key_file(key) as key_fd, _key_file(new_key) as new_key_fd:
+        command = [
+            'cryptsetup',
+            '--batch-mode',
+            '--key-file',
+            _key_file_path(key_fd),
+            'luksAddKey',
+            'UUID={}'.format(uuid),
+            _key_file_path(new_key_fd),
+        ]
+        subprocess.check_output(command, pass_fds=(key_fd, new_key_fd))
+
+
+@tracing.traced('dmcrypt.luks_key_slot', 'uuid')
+def luks_key_slot(key, uuid):
+    """Return the LUKS keyslot a key unlocks
+
+    :param: key: string or bytearray containing the key to test.
+    :param: uuid: uuid of the encrypted block device.
+    :returns: int. keyslot number, or None if the key unlocks no slot
+    """
+    with _key_file(key) as key_fd:
+        command = [
+            'cryptsetup',
+            '--batch-mode',
+            '--verbose',
+            '--key-file',
+            _key_file_path(key_fd),
+            'open',
+            '--test-passphrase',
+            'UUID={}'.format(uuid),
+        ]
+        try:
+            output = subprocess.check_output(command, pass_fds=(key_fd,))
+        except subprocess.CalledProcessError:
+            return None
+    match = _UNLOCKED_SLOT.search(output.decode('utf-8'))
+    if match is None:
+        raise ValueError(
+            'Unable to tell the keyslot unlocked on {}'.format(uuid)
+        )
+    return int(match.group(1))
+
+
+@tracing.traced('dmcrypt.luks_key_slots', 'uuid')
+def luks_key_slots(uuid):
+    """Return the active LUKS keyslots of a block device
+
+    :param: uuid: uuid of the encrypted block device.
+    :returns: set of int keyslot numbers
+    """
     command = [
         'cryptsetup',
-        '--batch-mode',
-        '--key-file',
-        '-',
-        'open',
+        'luksDump',
         'UUID={}'.format(uuid),
-        handle,
-        '--type',
-        'luks',
     ]
-    subprocess.check_output(command,
-                            input=key.encode('UTF-8'))
-    return handle
+    output = subprocess.check_output(command).decode('utf-8')
+    return {
+        int(slot)
+        for pattern in (_LUKS2_SLOT, _LUKS1_SLOT)
+        for slot in pattern.findall(output)
+    }
+
+
+@tracing.traced('dmcrypt.luks_kill_slot', 'uuid', 'slot')
+def luks_kill_slot(key, uuid, slot):
+    """Wipe a LUKS keyslot
+
+    :param: key: string or bytearray containing a key of another slot.
+    :param: uuid: uuid of the encrypted block device.
+    :param: slot: number of the keyslot to wipe.
+    """
+    logger.info('LUKS killing keyslot {} of {}'.format(slot, uuid))
+    with _key_file(key) as key_fd:
+        command = [
+            'cryptsetup',
+            '--batch-mode',
+            '--key-file',
+            _key_file_path(key_fd),
+            'luksKillSlot',
+            'UUID={}'.format(uuid),
+            str(slot),
+        ]
+        subprocess.check_output(command, pass_fds=(key_fd,))
+
+
+def _luks_device(uuid, header=None):
+    """Device argument addressing a LUKS header by UUID or file"""
+    return header or 'UUID={}'.format(uuid)
+
+
+@tracing.traced('dmcrypt.luks_header_backup', 'uuid', 'header')
+def luks_header_backup(uuid, backup_file, header=None):
+    """Save the LUKS header and keyslots of a device to a file
+
+    :param: uuid: uuid of the encrypted block device.
+    :param: backup_file: file to create; it must not exist.
+    :param: header: detached LUKS header of the device.
+    """
+    logger.info('LUKS backing up header of {}'.format(uuid))
+    command = [
+        'cryptsetup',
+        '--batch-mode',
+        'luksHeaderBackup',
+        _luks_device(uuid, header),
+        '--header-backup-file',
+        backup_file,
+    ]
+    subprocess.check_output(command)
+
+
+@tracing.traced('dmcrypt.luks_header_restore', 'device')
+def luks_header_restore(device, backup_file):
+    """Overwrite the LUKS header and keyslots of a device from a file
+
+    :param: device: path of the block device or detached header.
+    :param: backup_file: file created by luks_header_backup.
+    """
+    logger.info('LUKS restoring header of {}'.format(device))
+    command = [
+        'cryptsetup',
+        '--batch-mode',
+        'luksHeaderRestore',
+        device,
+        '--header-backup-file',
+        backup_file,
+    ]
+    subprocess.check_output(command)
+
+
+@tracing.traced('dmcrypt.luks_uuid', 'device')
+def luks_uuid(device):
+    """Return the UUID in the LUKS header of a device
+
+    :param: device: path of the block device or detached header.
+    :returns: str. UUID, or None if the device has no valid LUKS header
+    """
+    command = [
+        'cryptsetup',
+        'luksUUID',
+        device,
+    ]
+    try:
+        output = subprocess.check_output(command)
+    except subprocess.CalledProcessError:
+        return None
+    return output.decode('utf-8').strip() or None
+
+
+@tracing.traced('dmcrypt.luks_close', 'uuid')
+def luks_close(uuid):
+    """Close the dm-crypt mapping of a block device
 
+    :param: uuid: uuid of the encrypted block device.
+    """
+    logger.info('LUKS closing {}'.format(uuid))
+    command = [
+        'cryptsetup',
+        'close',
+        'crypt-{}'.format(uuid),
+    ]
+    subprocess.check_output(command)
+
+
+def _udevadm_rescan_command(device):
+    return [
+        'udevadm',
+        'trigger',
+        '--name-match={}'.format(device),
+        '--action=add'
+    ]
 
+
+@tracing.traced('dmcrypt.udevadm_rescan', 'device')
 def udevadm_rescan(device):
     """udevadm trigger for block device addition
 
@@ -95,15 +470,18 @@ def udevadm_rescan(device):
     :param: device: full path to block device to use.
     """
     logger.info('udevadm trigger block/add for {}'.format(device))
-    command = [
+    subprocess.check_output(_udevadm_rescan_command(device))
+
+
+def _udevadm_settle_command(uuid):
+    return [
         'udevadm',
-        'trigger',
-        '--name-match={}'.format(device),
-        '--action=add'
+        'settle',
+        '--exit-if-exists=/dev/disk/by-uuid/{}'.format(uuid),
     ]
-    subprocess.check_output(command)
 
 
+@tracing.traced('dmcrypt.udevadm_settle', 'uuid')
 def udevadm_settle(uuid):
     """udevadm settle the newly created encrypted device
 
@@ -113,9 +491,4 @@ def udevadm_settle(uuid):
     :param: uuid: uuid to use for encrypted block device.
     """
     logger.info('udevadm settle /dev/disk/by-uuid/{}'.format(uuid))
-    command = [
-        'udevadm',
-        'settle',
-        '--exit-if-exists=/dev/disk/by-uuid/{}'.format(uuid),
-    ]
-    subprocess.check_output(command)
+    subprocess.check_output(_udevadm_settle_command(uuid))
@@ -59,3 +59,27 @@ class LUKSFailure(VaultlockerException):
     def __init__(self, block_device, error):
         super().__init__("Can't operate on {}. Error: {}".format(
             block_device, error))
+
+
+class ConfigError(VaultlockerException):
+
+    def __init__(self, config_path, errors):
+        self.errors = errors
+        super().__init__("Invalid configuration {}:\n  {}".format(
+            config_path, '\n  '.join(errors)))
+
+
+class LockTimeout(VaultlockerException):
+
+    def __init__(self, name, timeout):
+        super().__init__("Timed out after {}s waiting for lock {}".format(
+            timeout, name))
+
+
+class DeviceInUse(VaultlockerException):
+
+    def __init__(self, reasons):
+        self.reasons = reasons
+        super().__init__("Refusing to encrypt devices in use:\n  {}".format(
+            '\n  '.join('{}: {}'.format(path, '; '.join(why))
+                        for path, why in sorted(reasons.items()))))
@@ -0,0 +1,245 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process stand-in for the parts of the Vault API used by vaultlocker.
+
+Only AppRole logins and one KV secrets engine are served. Latency, a
+limit on concurrently served requests and an initial outage can be set
+so that load tests against it are repeatable.
+"""
+
+import http.server
+import json
+import secrets
+import threading
+import time
+from typing import Any, Optional
+
+from vaultlocker import vault
+
+API_PREFIX = '/v1/'
+DEFAULT_MOUNT = 'secret'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+    server: 'FakeVault'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: Optional[dict[str, Any]] = None
+               ) -> None:
+        payload = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status: int, message: str) -> None:
+        self._reply(status, {'errors': [message]})
+
+    def _body(self) -> dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _handle(self) -> None:
+        body = self._body()
+        status, reply = self.server.serve(
+            self.command, self.path.split('?', 1)[0],
+            self.headers.get('X-Vault-Token'), body,
+        )
+        if status >= 400:
+            self._error(status, reply)
+        else:
+            self._reply(status, reply)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_LIST = _handle
+
+
+class FakeVault(http.server.ThreadingHTTPServer):
+    """Fake Vault server on a local port.
+
+    :param kv_version: version of the KV engine at the mount
+    :param mount_point: mount of the KV engine
+    :param latency: seconds each request takes to serve
+    :param capacity: requests served at once; others wait for a slot
+    :param outage: seconds after start during which every request fails
+                   with 503, as a sealed or starting Vault does
+    """
+
+    daemon_threads = True
+    # simultaneous connects of a boot storm must not be refused
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        kv_version: str = vault.KV_VERSION_1,
+        mount_point: str = DEFAULT_MOUNT,
+        latency: float = 0.0,
+        capacity: Optional[int] = None,
+        outage: float = 0.0,
+        address: tuple[str, int] = ('127.0.0.1', 0),
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.kv_version = kv_version
+        self.mount_point = mount_point
+        self.latency = latency
+        self.outage = outage
+        self._slots = (threading.BoundedSemaphore(capacity)
+                       if capacity else None)
+        self._lock = threading.Lock()
+        self._secrets: dict[str, tuple[dict[str, Any], int]] = {}
+        self._tokens: set[str] = set()
+        self._started = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def restart_clock(self) -> None:
+        """Start the outage period again from now."""
+        self._started = time.monotonic()
+
+    def start(self) -> 'FakeVault':
+        """Serve requests from a background thread."""
+        self.restart_clock()
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05},
+            name='fake-vault', daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'FakeVault':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def serve(
+        self, method: str, path: str, token: Optional[str],
+        body: dict[str, Any]
+    ) -> tuple[int, Any]:
+        """Serve one API request.
+
+        :returns: tuple of the HTTP status and the JSON reply, or the
+                  error message for statuses of 400 and above
+        """
+        with self._lock:
+            self.requests += 1
+        if time.monotonic() - self._started < self.outage:
+            return 503, 'Vault is sealed'
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            return self._route(method, path, token, body)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def _route(
+        self, method: str, path: str, token: Optional[str],
+        body: dict[str, Any]
+    ) -> tuple[int, Any]:
+        if not path.startswith(API_PREFIX):
+            return 404, 'no handler for route'
+        path = path[len(API_PREFIX):]
+        if path.startswith('auth/') and path.endswith('/login'):
+            return self._login(body)
+        if token not in self._tokens:
+            return 403, 'permission denied'
+        mount, _, path = path.partition('/')
+        if mount != self.mount_point:
+            return 404, 'no handler for route'
+        if self.kv_version == vault.KV_VERSION_2:
+            kind, _, path = path.partition('/')
+            if kind not in ('data', 'metadata'):
+                return 404, 'no handler for route'
+        if method == 'LIST' or (method == 'GET' and path.endswith('/')):
+            return self._list(path)
+        if method == 'GET':
+            return self._read(path)
+        if method in ('POST', 'PUT'):
+            return self._write(path, body)
+        if method == 'DELETE':
+            with self._lock:
+                self._secrets.pop(path, None)
+            return 204, None
+        return 405, 'unsupported operation'
+
+    def _login(self, body: dict[str, Any]) -> tuple[int, Any]:
+        if not body.get('role_id'):
+            return 400, 'missing role_id'
+        token = 'hvs.' + secrets.token_hex(12)
+        with self._lock:
+            self._tokens.add(token)
+        return 200, {'auth': {'client_token': token, 'accessor': token,
+                              'policies': ['default'],
+                              'lease_duration': 3600, 'renewable': True}}
+
+    def _read(self, path: str) -> tuple[int, Any]:
+        with self._lock:
+            stored = self._secrets.get(path)
+        if stored is None:
+            return 404, 'secret not found'
+        data, version = stored
+        if self.kv_version == vault.KV_VERSION_2:
+            return 200, {'data': {'data': data, 'metadata': {
+                'version': version, 'deletion_time': '',
+                'destroyed': False,
+            }}}
+        return 200, {'data': data}
+
+    def _write(self, path: str, body: dict[str, Any]) -> tuple[int, Any]:
+        if self.kv_version == vault.KV_VERSION_1:
+            with self._lock:
+                self._secrets[path] = (body, 1)
+            return 204, None
+        cas = body.get('options', {}).get('cas')
+        with self._lock:
+            version = self._secrets.get(path, ({}, 0))[1]
+            if cas is not None and cas != version:
+                return 400, ('check-and-set parameter did not match the '
+                             'current version')
+            self._secrets[path] = (body.get('data', {}), version + 1)
+        return 200, {'data': {'version': version + 1, 'deletion_time': '',
+                              'destroyed': False}}
+
+    def _list(self, path: str) -> tuple[int, Any]:
+        prefix = path.rstrip('/') + '/' if path.strip('/') else ''
+        keys = set()
+        with self._lock:
+            for stored in self._secrets:
+                if stored.startswith(prefix):
+                    name, slash, _ = stored[len(prefix):].partition('/')
+                    keys.add(name + slash)
+        if not keys:
+            return 404, 'no secrets'
+        return 200, {'data': {'keys': sorted(keys)}}
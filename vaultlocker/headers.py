@@ -0,0 +1,193 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import zlib
+from typing import Any, Optional
+
+from vaultlocker import vault
+
+logger = logging.getLogger(__name__)
+
+HEADER_DIR = '/var/lib/vaultlocker/headers'
+HEADER_SUFFIX = '.luks'
+METADATA_SUFFIX = '.json'
+
+BACKUP_FORMAT = 1
+COMPRESSION = 'zlib'
+# compressed bytes per KV secret, well below Vault's request size limit
+CHUNK_SIZE = 512 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def header_path(block_uuid: str, header_dir: str = HEADER_DIR) -> str:
+    """Return the path of the detached LUKS header of a device."""
+    return os.path.join(header_dir, block_uuid + HEADER_SUFFIX)
+
+
+def _metadata_path(block_uuid: str, header_dir: str) -> str:
+    return os.path.join(header_dir, block_uuid + METADATA_SUFFIX)
+
+
+def register(
+    block_uuid: str, block_device: str, header_dir: str = HEADER_DIR
+) -> str:
+    """Record the data device of a detached header.
+
+    :param block_uuid: UUID of the encrypted device
+    :param block_device: stable path of the data device, e.g. a
+                         /dev/disk/by-id symlink
+    :param header_dir: directory of the detached headers
+    :returns: path for the detached header
+    """
+    os.makedirs(header_dir, mode=0o700, exist_ok=True)
+    path = _metadata_path(block_uuid, header_dir)
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as metadata:
+        json.dump({'uuid': block_uuid, 'device': block_device}, metadata)
+        metadata.flush()
+        os.fsync(metadata.fileno())
+    os.rename(tmp_path, path)
+    return header_path(block_uuid, header_dir)
+
+
+def lookup(
+    block_uuid: str, header_dir: str = HEADER_DIR
+) -> Optional[dict[str, Any]]:
+    """Return the detached header and data device of a device.
+
+    :returns: dict with 'header' and 'device' paths, or None if the
+              device keeps its header on the data device
+    """
+    try:
+        with open(_metadata_path(block_uuid, header_dir)) as metadata:
+            detached = json.load(metadata)
+    except FileNotFoundError:
+        return None
+    detached['header'] = header_path(block_uuid, header_dir)
+    return detached
+
+
+def unregister(block_uuid: str, header_dir: str = HEADER_DIR) -> None:
+    """Remove the detached header of a device and its metadata."""
+    for path in (header_path(block_uuid, header_dir),
+                 _metadata_path(block_uuid, header_dir)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def present_devices(header_dir: str = HEADER_DIR) -> set[str]:
+    """Return the UUIDs of detached-header devices present on this host.
+
+    Such devices have no by-uuid symlink, so presence is checked on the
+    recorded data device instead.
+    """
+    try:
+        names = os.listdir(header_dir)
+    except FileNotFoundError:
+        return set()
+    present = set()
+    for name in names:
+        if not name.endswith(METADATA_SUFFIX):
+            continue
+        detached = lookup(name[:-len(METADATA_SUFFIX)], header_dir)
+        if detached is not None and os.path.exists(detached['device']):
+            present.add(detached['uuid'])
+    return present
+
+
+def _chunk_path(path: str, index: int) -> str:
+    return '{}/{}'.format(path, index)
+
+
+def store_backup(
+    store: vault.KVStoreBase, path: str, backup_file: str,
+    **metadata: Any
+) -> dict[str, Any]:
+    """Compress a header backup into a KV store.
+
+    The file is compressed while it is read and written out in chunks
+    below path; the description of the backup is written to path last,
+    so a backup is only visible once all its chunks are stored.
+
+    :param store: KVStoreBase for the configured mount
+    :param path: KV path of the backup
+    :param backup_file: header backup, e.g. from luksHeaderBackup
+    :param metadata: extra values to keep, e.g. the device path
+    :returns: dict describing the stored backup
+    """
+    compressor = zlib.compressobj(9)
+    digest = hashlib.sha256()
+    size = chunks = 0
+    pending = b''
+    with open(backup_file, 'rb') as backup:
+        while True:
+            block = backup.read(READ_SIZE)
+            if block:
+                size += len(block)
+                digest.update(block)
+                pending += compressor.compress(block)
+            else:
+                pending += compressor.flush()
+            while len(pending) >= CHUNK_SIZE or (not block and pending):
+                chunk, pending = pending[:CHUNK_SIZE], pending[CHUNK_SIZE:]
+                store.write(_chunk_path(path, chunks), {
+                    'data': base64.b64encode(chunk).decode('ascii'),
+                })
+                chunks += 1
+            if not block:
+                break
+    description = dict(metadata, format=BACKUP_FORMAT,
+                       compression=COMPRESSION, chunks=chunks, size=size,
+                       sha256=digest.hexdigest())
+    store.write(path, description)
+    return description
+
+
+def load_backup(
+    store: vault.KVStoreBase, path: str, backup_file: str
+) -> dict[str, Any]:
+    """Decompress a header backup from a KV store into a file.
+
+    :param store: KVStoreBase for the configured mount
+    :param path: KV path of the backup
+    :param backup_file: file to write the header backup to
+    :returns: dict describing the backup
+    :raises ValueError: if the backup is incomplete or corrupted
+    """
+    description = store.read(path)
+    if description.get('format') != BACKUP_FORMAT:
+        raise ValueError('Unsupported header backup format {!r} at '
+                         '{}'.format(description.get('format'), path))
+    decompressor = zlib.decompressobj()
+    digest = hashlib.sha256()
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    with open(os.open(backup_file, flags, 0o600), 'wb') as backup:
+        for index in range(description['chunks']):
+            chunk = store.read(_chunk_path(path, index))['data']
+            block = decompressor.decompress(base64.b64decode(chunk))
+            digest.update(block)
+            backup.write(block)
+        block = decompressor.flush()
+        digest.update(block)
+        backup.write(block)
+        backup.flush()
+        os.fsync(backup.fileno())
+    if digest.hexdigest() != description['sha256']:
+        raise ValueError('Header backup at {} is corrupted'.format(path))
+    return description
@@ -0,0 +1,114 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = '/var/lib/vaultlocker/journal'
+
+OPERATION_ENCRYPT = 'encrypt'
+OPERATION_ROTATE = 'rotate'
+OPERATION_REKEY = 'rekey'
+
+# phases of an encryption, in order
+PHASE_STARTED = 'started'
+PHASE_KEY_STORED = 'key-stored'
+PHASE_FORMATTED = 'formatted'
+PHASE_OPENED = 'opened'
+# phases of a key rotation, in order
+PHASE_KEY_STAGED = 'key-staged'
+PHASE_REENCRYPTED = 'reencrypted'
+# phases of a keyslot rotation, in order: key-staged, slot-added, key-stored
+PHASE_SLOT_ADDED = 'slot-added'
+PHASES = (PHASE_STARTED, PHASE_KEY_STORED, PHASE_FORMATTED, PHASE_OPENED,
+          PHASE_KEY_STAGED, PHASE_REENCRYPTED, PHASE_SLOT_ADDED)
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """Write-ahead journal of device operations in progress.
+
+    Each device has one JSON entry recording the last phase it reached.
+    Entries are replaced atomically and synced to disk before the next
+    phase starts, so after a crash the entry tells which work is left.
+    """
+
+    def __init__(self, directory: str = JOURNAL_DIR) -> None:
+        self.directory = directory
+
+    def _path(self, block_uuid: str) -> str:
+        return os.path.join(self.directory, '{}.json'.format(block_uuid))
+
+    def get(self, block_uuid: str) -> Optional[dict[str, Any]]:
+        """Return the entry of a device, or None if it has none."""
+        try:
+            with open(self._path(block_uuid)) as entry:
+                return json.load(entry)
+        except FileNotFoundError:
+            return None
+
+    def record(self, block_uuid: str, phase: str, **details) -> None:
+        """Durably record the phase reached by a device.
+
+        :param block_uuid: UUID of the device
+        :param phase: one of PHASES
+        :param details: values to keep in the entry, e.g. the device path
+        """
+        if phase not in PHASES:
+            raise ValueError("Unknown journal phase '{}'".format(phase))
+        entry = self.get(block_uuid) or {'uuid': block_uuid}
+        entry.update(details, phase=phase, updated=time.time())
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        path = self._path(block_uuid)
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as tmp:
+            json.dump(entry, tmp)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.rename(tmp_path, path)
+        _fsync_dir(self.directory)
+        logger.debug('Journal: %s reached %s', block_uuid, phase)
+
+    def remove(self, block_uuid: str) -> None:
+        """Drop the entry of a device once its operation is finished."""
+        try:
+            os.unlink(self._path(block_uuid))
+        except FileNotFoundError:
+            return
+        _fsync_dir(self.directory)
+
+    def entries(self) -> list[dict[str, Any]]:
+        """Return the entries of all unfinished devices."""
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            entry = self.get(name[:-len('.json')])
+            if entry is not None:
+                entries.append(entry)
+        return entries
@@ -0,0 +1,136 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import abc
+import base64
+
+import hvac
+
+from vaultlocker import dmcrypt
+
+KEY_SOURCE_LOCAL = 'local'
+KEY_SOURCE_VAULT = 'vault'
+KEY_SOURCE_HWRNG = 'hwrng'
+
+HWRNG_DEVICE = '/dev/hwrng'
+# Upper bound of a single sys/tools/random request
+VAULT_RANDOM_MAX_BYTES = 128 * 1024
+
+
+class KeySourceBase(abc.ABC):
+    """Base class for alternative sources of dm-crypt key material."""
+
+    def __init__(
+        self, client: hvac.Client, key_size: int = dmcrypt.KEY_SIZE
+    ) -> None:
+        self.client = client
+        self.key_size = key_size
+
+    def generate(self) -> str:
+        """Return a single base64 encoded key."""
+        return self.generate_many(1)[0]
+
+    def generate_many(self, count: int) -> list[str]:
+        """Return base64 encoded keys.
+
+        :param count: number of keys to generate
+        :return: list of base64 encoded keys
+        """
+        return dmcrypt.split_keys(
+            self.random_bytes(count * self.key_size // 8),
+            self.key_size,
+        )
+
+    @abc.abstractmethod
+    def random_bytes(self, length: int) -> bytes:
+        """Return random bytes.
+
+        :param length: number of bytes
+        :return: bytes
+        """
+
+
+class VaultKeySource(KeySourceBase):
+    """Key material from Vault's sys/tools/random endpoint."""
+
+    def random_bytes(self, length: int) -> bytes:
+        data = b''
+        while len(data) < length:
+            chunk = min(length - len(data), VAULT_RANDOM_MAX_BYTES)
+            response = self.client.adapter.post(
+                '/v1/sys/tools/random/{}'.format(chunk),
+                json={'format': 'base64'},
+            )
+            data += base64.b64decode(response['data']['random_bytes'])
+        return data
+
+
+class DeviceKeySource(KeySourceBase):
+    """Key material from a local hardware RNG such as a TPM2 or HSM.
+
+    The kernel exposes hardware RNGs, including the TPM2 RNG, as a
+    character device (``/dev/hwrng`` by default).
+    """
+
+    def __init__(
+        self,
+        client: hvac.Client,
+        key_size: int = dmcrypt.KEY_SIZE,
+        device: str = HWRNG_DEVICE,
+    ) -> None:
+        super().__init__(client, key_size)
+        self.device = device
+
+    def random_bytes(self, length: int) -> bytes:
+        data = b''
+        with open(self.device, 'rb', buffering=0) as rng:
+            while len(data) < length:
+                chunk = rng.read(length - len(data))
+                if not chunk:
+                    raise OSError(
+                        'Short read from {}'.format(self.device)
+                    )
+                data += chunk
+        return data
+
+
+class KeySource:
+    """Factory for key source plug-ins."""
+
+    _registry = {
+        KEY_SOURCE_VAULT: VaultKeySource,
+        KEY_SOURCE_HWRNG: DeviceKeySource,
+    }
+
+    @classmethod
+    def get_source(
+        cls,
+        source: str,
+        client: hvac.Client,
+        key_size: int = dmcrypt.KEY_SIZE,
+        **options,
+    ) -> KeySourceBase:
+        """Return a key source plug-in.
+
+        :param source: name of the key source
+        :param client: Authenticated hvac.Client.
+        :param key_size: size of each key in bits
+        :param options: plug-in specific options
+        :returns: KeySourceBase: configured key source
+        :raises ValueError: if source is not a supported plug-in.
+        """
+        source_class = cls._registry.get(source)
+        if source_class is None:
+            raise ValueError(
+                "Unsupported key_source '{}'".format(source)
+            )
+        return source_class(client, key_size, **options)
@@ -0,0 +1,409 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Boot storm load generator.
+
+Simulates many hosts unlocking their devices at once, as after a
+site-wide power restore. Every unlock runs the decrypt flow of
+``vaultlocker decrypt`` (client creation and login, retries, key read
+and unwrap) against a Vault dev server or an in-process fake, with the
+opening of the LUKS device replaced by a sleep.
+"""
+
+import argparse
+import collections
+from concurrent import futures
+import contextlib
+import functools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional, TextIO
+
+from vaultlocker import conf
+from vaultlocker import fakevault
+from vaultlocker import shell
+from vaultlocker import vault
+
+logger = logging.getLogger(__name__)
+
+ARRIVAL_BURST = 'burst'
+ARRIVAL_UNIFORM = 'uniform'
+ARRIVAL_POISSON = 'poisson'
+ARRIVAL_JITTER = 'jitter'
+ARRIVALS = (ARRIVAL_BURST, ARRIVAL_UNIFORM, ARRIVAL_POISSON, ARRIVAL_JITTER)
+
+HOST_PREFIX = 'loadgen-'
+PERCENTILES = (50, 90, 99)
+# stable device UUIDs, so runs against a dev server reuse seeded keys
+_NAMESPACE = uuid.UUID('0b7ab1a4-53c4-4d8e-9a0b-6f1d7c0a4d21')
+
+
+def percentile(samples: list[float], percent: float) -> float:
+    """Return the nearest-rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    rank = max(int(-(-len(samples) * percent // 100)), 1)
+    return samples[rank - 1]
+
+
+class Recorder:
+    """Thread-safe collector of latency samples and event counts."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: dict[str, list[float]] = collections.defaultdict(
+            list)
+        self.counts: collections.Counter = collections.Counter()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def count(self, name: str, number: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += number
+
+    def summary(self, wall: float) -> dict[str, dict[str, float]]:
+        """Return count, rate and latency percentiles of each operation.
+
+        :param wall: duration of the run in seconds
+        """
+        with self._lock:
+            samples = {name: sorted(values)
+                       for name, values in self._samples.items()}
+        summary = {}
+        for name, values in sorted(samples.items()):
+            stats = {'count': len(values),
+                     'rate': len(values) / wall if wall else 0.0}
+            for percent in PERCENTILES:
+                stats['p{}'.format(percent)] = percentile(values, percent)
+            stats['max'] = values[-1] if values else 0.0
+            summary[name] = stats
+        return summary
+
+
+def device_uuids(hostname: str, devices: int) -> list[str]:
+    """Return the UUIDs of the simulated devices of a host."""
+    return [str(uuid.uuid5(_NAMESPACE, '{}/{}'.format(hostname, index)))
+            for index in range(devices)]
+
+
+def fake_config(
+    server: fakevault.FakeVault, layout: str = vault.LAYOUT_DEVICE
+) -> conf.Config:
+    """Return a configuration for a host using a fake Vault server."""
+    return conf.Config({
+        'vault': {
+            'url': server.url,
+            'approle': 'loadgen',
+            'secret_id': 'loadgen',
+            'backend': server.mount_point,
+            'kv_version': server.kv_version,
+            'layout': layout,
+        },
+    })
+
+
+def host_configs(config: conf.Config, hosts: int) -> list[conf.Config]:
+    """Return a configuration per simulated host."""
+    return [config.replace(DEFAULT={'hostname': '{}{}'.format(HOST_PREFIX,
+                                                              index)})
+            for index in range(hosts)]
+
+
+def seed(configs: list[conf.Config], devices: int, workers: int) -> None:
+    """Store keys for the devices of every host.
+
+    Keys are generated and stored as ``vaultlocker encrypt`` does.
+    """
+    def _seed(config):
+        client = shell._vault_client(config)
+        block_uuids = device_uuids(shell.get_hostname(config), devices)
+        keys = shell._generate_keys(len(block_uuids), client, config)
+        records = shell._key_records(dict(zip(block_uuids, keys)), client,
+                                     config)
+        shell._store_key_records(shell._vault_store(client, config),
+                                 records, config)
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # consume the results so that the first failure is raised
+        list(executor.map(_seed, configs))
+
+
+def arrivals(
+    configs: list[conf.Config], pattern: str, ramp: float,
+    rng: random.Random
+) -> list[float]:
+    """Return the second at which each host starts unlocking.
+
+    :param configs: configuration of each host
+    :param pattern: 'burst' starts all hosts at once, 'uniform' spreads
+                    them evenly over ramp seconds, 'poisson' makes them
+                    arrive at random at the same average rate, and
+                    'jitter' uses each host's boot_jitter and
+                    priority_delay configuration as vaultlocker-decrypt
+                    units do
+    :param ramp: seconds over which hosts arrive
+    :param rng: random number generator
+    """
+    hosts = len(configs)
+    if pattern == ARRIVAL_BURST:
+        return [0.0] * hosts
+    if pattern == ARRIVAL_UNIFORM:
+        return [ramp * index / hosts for index in range(hosts)]
+    if pattern == ARRIVAL_POISSON:
+        offsets, offset = [], 0.0
+        for _ in range(hosts):
+            offsets.append(offset)
+            offset += rng.expovariate(hosts / ramp) if ramp else 0.0
+        return offsets
+    if pattern == ARRIVAL_JITTER:
+        return [shell._start_delay(config, shell.DEFAULT_PRIORITY)
+                for config in configs]
+    raise ValueError("Invalid arrival pattern '{}'".format(pattern))
+
+
+def recording_adapter(recorder: Recorder, logins: Any) -> type:
+    """Return an hvac adapter class measuring the Vault requests of a run.
+
+    :param recorder: Recorder for request latencies and errors
+    :param logins: thread-local counting the logins of an unlock
+    :returns: subclass of :class:`vault.GovernedAdapter`
+    """
+
+    class RecordingAdapter(vault.GovernedAdapter):
+
+        def request(self, method, url, *args, **kwargs):
+            if '/auth/' in url:
+                name = 'vault.login'
+                logins.count = getattr(logins, 'count', 0) + 1
+            else:
+                name = 'vault.kv'
+            start = time.monotonic()
+            try:
+                return super().request(method, url, *args, **kwargs)
+            except Exception as request_error:
+                recorder.count(
+                    'error.{}'.format(type(request_error).__name__))
+                raise
+            finally:
+                recorder.record(name, time.monotonic() - start)
+
+    return RecordingAdapter
+
+
+def simulated_open(open_time: float) -> Callable[..., None]:
+    """Return a LUKS open function standing in for cryptsetup.
+
+    :param open_time: seconds the simulated LUKS open takes
+    """
+
+    def _luks_open(key, block_uuid, detached=None):
+        if open_time:
+            time.sleep(open_time)
+
+    return _luks_open
+
+
+def _unlock(
+    config: conf.Config, block_uuid: str, retry: int, stagger: bool,
+    recorder: Recorder, adapter: type, luks_open: Callable[..., None],
+    logins: Any
+) -> None:
+    args = argparse.Namespace(uuid=[block_uuid], retry=retry,
+                              stagger=stagger)
+    logins.count = 0
+    start = time.monotonic()
+    try:
+        shell._do_it_with_persistence(
+            functools.partial(shell._decrypt_block_device,
+                              luks_open=luks_open),
+            args, config, adapter=adapter)
+    except Exception as unlock_error:
+        logger.debug('Unlocking %s failed: %s', block_uuid, unlock_error)
+        recorder.count('unlock.failed')
+    else:
+        recorder.record('unlock', time.monotonic() - start)
+    recorder.count('retries', max(logins.count - 1, 0))
+
+
+def run(
+    configs: list[conf.Config], devices: int, offsets: list[float],
+    concurrency: int, retry: int = -1, stagger: bool = False,
+    open_time: float = 0.0
+) -> tuple[Recorder, float]:
+    """Unlock the devices of every host, starting each host at its offset.
+
+    :param configs: configuration of each host
+    :param devices: devices per host
+    :param offsets: second at which each host starts
+    :param concurrency: unlocks running at once, i.e. client threads
+    :param retry: seconds to retry unavailable Vault, as ``--retry``
+    :param stagger: back off randomly between retries, as ``--stagger``
+    :param open_time: seconds the simulated LUKS open takes
+    :returns: tuple of the Recorder and the duration of the run
+    """
+    recorder = Recorder()
+    schedule = sorted(zip(offsets, range(len(configs))))
+    logins = threading.local()
+    adapter = recording_adapter(recorder, logins)
+    luks_open = simulated_open(open_time)
+    start = time.monotonic()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, host in schedule:
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            config = configs[host]
+            for block_uuid in device_uuids(shell.get_hostname(config),
+                                           devices):
+                pool.submit(_unlock, config, block_uuid, retry, stagger,
+                            recorder, adapter, luks_open, logins)
+    wall = time.monotonic() - start
+    return recorder, wall
+
+
+def report(
+    recorder: Recorder, wall: float, stream: TextIO,
+    requests: Optional[int] = None
+) -> None:
+    """Write a table of throughput, latencies, retries and errors."""
+    summary = recorder.summary(wall)
+    stream.write('{:<12} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9}\n'.format(
+        'OPERATION', 'COUNT', 'RATE(/s)', 'P50(ms)', 'P90(ms)', 'P99(ms)',
+        'MAX(ms)'))
+    for name, stats in summary.items():
+        stream.write(
+            '{:<12} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'
+            '\n'.format(name, stats['count'], stats['rate'],
+                        stats['p50'] * 1000, stats['p90'] * 1000,
+                        stats['p99'] * 1000, stats['max'] * 1000))
+    stream.write('wall {:.3f}s, retries {}, failed unlocks {}\n'.format(
+        wall, recorder.counts['retries'], recorder.counts['unlock.failed']))
+    if requests is not None:
+        stream.write('server requests {} ({:.1f}/s)\n'.format(
+            requests, requests / wall if wall else 0.0))
+    for name, count in sorted(recorder.counts.items()):
+        if name.startswith('error.'):
+            stream.write('{:<24} {:>8}\n'.format(name, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        'vaultlocker-loadgen',
+        description='Simulate hosts unlocking their devices at once '
+                    'against Vault',
+    )
+    parser.add_argument('--hosts', type=int, default=100,
+                        help="Number of simulated hosts")
+    parser.add_argument('--devices', type=int, default=12,
+                        help="Encrypted devices per host")
+    parser.add_argument('--arrival', choices=ARRIVALS,
+                        default=ARRIVAL_BURST,
+                        help="How host start times are spread "
+                             "(default: %(default)s)")
+    parser.add_argument('--ramp', type=float, default=60.0,
+                        help="Seconds over which uniform and poisson "
+                             "arrivals are spread")
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="Unlocks in flight at once")
+    parser.add_argument('--open-time', type=float, default=0.0,
+                        help="Seconds a simulated LUKS open takes")
+    parser.add_argument('--retry', type=int, default=60,
+                        help="Seconds each unlock retries unavailable "
+                             "Vault, as decrypt --retry")
+    parser.add_argument('--stagger', action='store_true',
+                        help="Back off randomly between retries, as "
+                             "decrypt --stagger")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the random arrivals")
+    parser.add_argument('--workers', type=int, default=shell.DEFAULT_WORKERS,
+                        help="Hosts whose keys are stored concurrently "
+                             "before the run")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON")
+    parser.add_argument('--debug', action='store_true',
+                        help="Log every unlock")
+    target = parser.add_argument_group(
+        'target',
+        'Without --config an in-process fake Vault is used.',
+    )
+    target.add_argument('--config',
+                        help="vaultlocker configuration of a Vault dev "
+                             "server; hostnames are replaced by "
+                             "{}<n>".format(HOST_PREFIX))
+    target.add_argument('--kv-version', choices=(vault.KV_VERSION_1,
+                                                 vault.KV_VERSION_2),
+                        default=vault.KV_VERSION_1,
+                        help="KV version of the fake Vault")
+    target.add_argument('--layout', choices=(vault.LAYOUT_DEVICE,
+                                             vault.LAYOUT_HOST),
+                        default=vault.LAYOUT_DEVICE,
+                        help="Key layout used with the fake Vault")
+    target.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds the fake Vault takes per request")
+    target.add_argument('--capacity', type=int,
+                        help="Requests the fake Vault serves at once")
+    target.add_argument('--outage', type=float, default=0.0,
+                        help="Seconds after the run starts during which "
+                             "the fake Vault answers 503")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug
+                        else logging.WARNING)
+
+    with contextlib.ExitStack() as stack:
+        server = None
+        if args.config:
+            config = shell.get_config(args.config)
+        else:
+            server = stack.enter_context(fakevault.FakeVault(
+                kv_version=args.kv_version, latency=args.latency,
+                capacity=args.capacity,
+            ))
+            config = fake_config(server, args.layout)
+        try:
+            configs = host_configs(config, args.hosts)
+            seed(configs, args.devices, args.workers)
+            offsets = arrivals(configs, args.arrival, args.ramp,
+                               random.Random(args.seed))
+            requests = None
+            if server is not None:
+                # the outage starts with the run, not with the seeding
+                server.outage = args.outage
+                server.restart_clock()
+                requests = server.requests
+            recorder, wall = run(configs, args.devices, offsets,
+                                 args.concurrency, args.retry,
+                                 args.stagger, args.open_time)
+            if server is not None:
+                requests = server.requests - requests
+        except Exception as e:
+            raise SystemExit('{prog}: {msg}'.format(prog=parser.prog,
+                                                    msg=e))
+
+    if args.json:
+        json.dump({
+            'hosts': args.hosts, 'devices': args.devices, 'wall': wall,
+            'operations': recorder.summary(wall),
+            'counts': dict(recorder.counts), 'server_requests': requests,
+        }, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        sys.stdout.write('{} hosts x {} devices, {} arrival\n'.format(
+            args.hosts, args.devices, args.arrival))
+        report(recorder, wall, sys.stdout, requests)
@@ -0,0 +1,136 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import contextlib
+import fcntl
+import logging
+import os
+import time
+from typing import Iterator, Optional
+
+from vaultlocker import exceptions
+
+logger = logging.getLogger(__name__)
+
+LOCK_DIR = '/run/vaultlocker/locks'
+CRYPTSETUP_SLOT = 'cryptsetup-{}'
+# longest sleep between attempts to take a busy lock
+MAX_POLL_INTERVAL = 0.5
+
+
+def _lock_path(name: str, lock_dir: str) -> str:
+    os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+    return os.path.join(lock_dir, '{}.lock'.format(name))
+
+
+def _try_lock(path: str) -> Optional[int]:
+    """Take an exclusive flock without blocking.
+
+    :returns: fd holding the lock, or None if it is held elsewhere
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _unlock(fd: int) -> None:
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _acquire(paths: list[str], name: str, timeout: Optional[float]) -> int:
+    """Take the first free lock of several, waiting up to timeout."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = 0.01
+    while True:
+        for path in paths:
+            fd = _try_lock(path)
+            if fd is not None:
+                return fd
+        if deadline is not None and time.monotonic() >= deadline:
+            raise exceptions.LockTimeout(name, timeout)
+        logger.debug('Waiting for lock %s', name)
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+
+def uuid_lock_name(block_uuid: str) -> str:
+    return 'uuid-{}'.format(block_uuid)
+
+
+def device_lock_name(block_device: str) -> str:
+    """Return the lock name of a block device.
+
+    Symlinks are resolved so every path to a device takes the same lock.
+    """
+    return 'device-{}'.format(
+        os.path.realpath(block_device).strip('/').replace('/', '_')
+    )
+
+
+@contextlib.contextmanager
+def lock(
+    name: str, timeout: Optional[float] = None, lock_dir: str = LOCK_DIR
+) -> Iterator[None]:
+    """Context manager holding an exclusive lock shared by all processes.
+
+    :param name: name of the lock
+    :param timeout: seconds to wait for the lock, forever if None
+    :param lock_dir: directory of the lock files
+    :raises exceptions.LockTimeout: if the lock is not free in time
+    """
+    fd = _acquire([_lock_path(name, lock_dir)], name, timeout)
+    try:
+        yield
+    finally:
+        _unlock(fd)
+
+
+@contextlib.contextmanager
+def locks(
+    names: list[str], timeout: Optional[float] = None,
+    lock_dir: str = LOCK_DIR,
+) -> Iterator[None]:
+    """Context manager holding several locks.
+
+    Locks are taken in sorted order so that processes needing
+    overlapping sets of locks cannot deadlock.
+    """
+    with contextlib.ExitStack() as stack:
+        for name in sorted(set(names)):
+            stack.enter_context(lock(name, timeout, lock_dir))
+        yield
+
+
+@contextlib.contextmanager
+def semaphore(
+    name: str, limit: int, timeout: Optional[float] = None,
+    lock_dir: str = LOCK_DIR,
+) -> Iterator[None]:
+    """Context manager holding one of limit host-wide slots.
+
+    :param name: name of the semaphore, a format string taking the slot
+    :param limit: number of slots
+    :param timeout: seconds to wait for a slot, forever if None
+    :param lock_dir: directory of the lock files
+    :raises exceptions.LockTimeout: if no slot is free in time
+    """
+    paths = [_lock_path(name.format(slot), lock_dir) for slot in range(limit)]
+    fd = _acquire(paths, name.format('*'), timeout)
+    try:
+        yield
+    finally:
+        _unlock(fd)
@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import contextlib
+import cProfile
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Iterator, Optional, TextIO
+
+FORMAT_PSTATS = 'pstats'
+FORMAT_COLLAPSED = 'collapsed'
+FORMATS = (FORMAT_PSTATS, FORMAT_COLLAPSED)
+DEFAULT_INTERVAL = 0.005
+
+
+def default_path(profile_format: str) -> str:
+    """Return the profile file used when no path is given."""
+    return os.path.abspath('vaultlocker-{}.{}'.format(os.getpid(),
+                                                      profile_format))
+
+
+def process_age() -> Optional[float]:
+    """Return the seconds since this process started, if known.
+
+    Taken at the start of the profile, this is the time spent starting
+    the interpreter, importing modules and parsing arguments.
+    """
+    try:
+        with open('/proc/self/stat') as stat:
+            # the command name may contain spaces, fields follow its ')'
+            fields = stat.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as uptime:
+            now = float(uptime.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return now - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return '{}:{}'.format(os.path.basename(code.co_filename),
+                          code.co_qualname)
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler writing collapsed stacks.
+
+    Every interval the stacks of all other threads are recorded, so
+    time blocked on Vault or waiting for cryptsetup and systemctl shows
+    up as well as time on the CPU. The output is one ``frame;frame
+    count`` line per stack, as read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name
+                 for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-{}'.format(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='vaultlocker-profiler')
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write('{} {}\n'.format(stack, count))
+
+
+@contextlib.contextmanager
+def profile(
+    path: str,
+    profile_format: str = FORMAT_PSTATS,
+    stream: TextIO = sys.stderr,
+    interval: float = DEFAULT_INTERVAL,
+) -> Iterator[None]:
+    """Context manager profiling its body.
+
+    pstats profiles are deterministic and measure wall-clock time, so
+    waits on subprocesses appear under subprocess.Popen.communicate.
+    A summary of wall, CPU and child process time is written to stream.
+
+    :param path: file to write the profile to
+    :param profile_format: 'pstats' or 'collapsed'
+    :param stream: file to write the summary to
+    :param interval: seconds between samples of the collapsed format
+    """
+    if profile_format not in FORMATS:
+        raise ValueError("Invalid profile format '{}'".format(
+            profile_format))
+    startup = process_age()
+    if profile_format == FORMAT_PSTATS:
+        profiler = cProfile.Profile()
+        start_profiler, stop_profiler = profiler.enable, profiler.disable
+    else:
+        profiler = SamplingProfiler(interval)
+        start_profiler, stop_profiler = profiler.start, profiler.stop
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    start_profiler()
+    try:
+        yield
+    finally:
+        stop_profiler()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        child_cpu = (after.ru_utime - children.ru_utime +
+                     after.ru_stime - children.ru_stime)
+        if profile_format == FORMAT_PSTATS:
+            profiler.dump_stats(path)
+        else:
+            profiler.write(path)
+        if startup is not None:
+            stream.write('profile: startup {:.3f}s before profiling '
+                         '(interpreter, imports, arguments)\n'.format(
+                             startup))
+        stream.write('profile: wall {:.3f}s, cpu {:.3f}s, child process '
+                     'cpu {:.3f}s\n'.format(wall, cpu, child_cpu))
+        stream.write('profile: {} profile written to {}\n'.format(
+            profile_format, path))
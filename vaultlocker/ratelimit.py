@@ -0,0 +1,132 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import contextlib
+import functools
+import threading
+import time
+from typing import Iterator, Optional
+
+from vaultlocker import timing
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Callers that find the bucket empty reserve a future token and sleep
+    until it is due, so waiting callers are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        """
+        :param rate: tokens added per second
+        :param burst: bucket capacity, defaults to one second of tokens
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available.
+
+        :returns: seconds spent waiting
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate,
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class Governor:
+    """Bound the rate and concurrency of requests to a shared service.
+
+    A request first waits for one of ``max_in_flight`` slots and then
+    for a token of the rate limiter; the time spent waiting for both is
+    recorded as queueing delay.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+        timings: Optional[timing.Timings] = None,
+        name: str = 'vault',
+    ) -> None:
+        """
+        :param rate: requests per second, unlimited if unset
+        :param burst: requests allowed at once before limiting
+        :param max_in_flight: concurrent requests, unlimited if unset
+        :param timings: registry receiving queueing and request times
+        :param name: prefix of the recorded timings
+        """
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.slots = (
+            threading.BoundedSemaphore(max_in_flight)
+            if max_in_flight else None
+        )
+        self.timings = timings if timings is not None else timing.TIMINGS
+        self.name = name
+
+    @contextlib.contextmanager
+    def request(self) -> Iterator[float]:
+        """Context manager holding a request slot for its body.
+
+        :returns: seconds spent queueing
+        """
+        start = time.monotonic()
+        if self.slots:
+            self.slots.acquire()
+        try:
+            if self.bucket:
+                self.bucket.acquire()
+            queued = time.monotonic() - start
+            self.timings.record('{}.queue'.format(self.name), queued)
+            with self.timings.measure('{}.request'.format(self.name)):
+                yield queued
+        finally:
+            if self.slots:
+                self.slots.release()
+
+
+@functools.lru_cache(maxsize=None)
+def shared_governor(
+    rate: Optional[float] = None,
+    burst: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+) -> Governor:
+    """Return the process-wide governor for a set of limits.
+
+    Every Vault client of the process, including those created for
+    retries, shares its bucket and slots, so the limits hold for the
+    process as a whole.
+
+    :param rate: requests per second, unlimited if unset
+    :param burst: requests allowed at once before limiting
+    :param max_in_flight: concurrent requests, unlimited if unset
+    :returns: Governor
+    """
+    return Governor(rate=rate, burst=burst, max_in_flight=max_in_flight)
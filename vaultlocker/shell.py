@@ -13,44 +13,245 @@
 # under the License.
 
 import argparse
-import configparser
+from concurrent import futures
+import contextlib
+import copy
+import functools
+import hashlib
+import json
 import logging
 import os
 import platform
+import shutil
 import socket
 import subprocess
+import sys
+import tempfile
+import time
 import uuid
 
 import hvac
 import tenacity
 
+from vaultlocker import audit
+from vaultlocker import conf
+from vaultlocker import discovery
 from vaultlocker import dmcrypt
 from vaultlocker import exceptions
+from vaultlocker import headers
+from vaultlocker import journal
+from vaultlocker import keysource
+from vaultlocker import locking
+from vaultlocker import profiling
+from vaultlocker import ratelimit
+from vaultlocker import status
 from vaultlocker import systemd
+from vaultlocker import timing
+from vaultlocker import tls
+from vaultlocker import tracing
 from vaultlocker import vault
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_CONF_FILE = '/etc/vaultlocker/vaultlocker.conf'
+DEFAULT_WORKERS = 8
+DEFAULT_WRAP_TTL = '1h'
+EXPORT_FORMAT_VERSION = 1
+HOST_DOCUMENT_FORMAT = 1
+CAS_RETRIES = 5
+MIN_KEY_SIZE = 256
+DEFAULT_STATUS_CACHE = '/run/vaultlocker/status.json'
+DEFAULT_CONFIG_CACHE = '/run/vaultlocker/config.json'
+DECRYPT_UNIT = 'vaultlocker-decrypt@{}.service'
+# unlock order at boot, earliest first
+PRIORITIES = ('os', 'journal', 'data')
+DEFAULT_PRIORITY = 'data'
+MAX_RETRY_WAIT = 60
+DEFAULT_LOCK_TIMEOUT = 300
+NEXT_SUFFIX = '_next'
+REENCRYPT_SLOT = 'reencrypt-{}'
+KEY_CHANGE_LOCK = 'rotate-{}'
+RESILIENCE_MODES = ('checksum', 'journal', 'none')
+
+
+def _governor(config):
+    """Return the governor bounding requests to Vault, if configured.
+
+    The governor is shared by all clients of the process.
 
+    :param config: configparser object of vaultlocker config
+    :returns: ratelimit.Governor, or None if Vault requests are unbounded
+    :raises ValueError: If a limit is not a positive number.
+    """
+    limits = {}
+    for option, convert in (('rate_limit', float),
+                            ('burst', int),
+                            ('max_in_flight', int)):
+        value = config.get('vault', option, fallback=None)
+        if value is None:
+            continue
+        try:
+            limits[option] = convert(value)
+        except ValueError:
+            limits[option] = 0
+        if limits[option] <= 0:
+            raise ValueError(
+                "Invalid {} '{}' in vaultlocker config; must be a "
+                "positive number".format(option, value)
+            )
+    rate = limits.get('rate_limit')
+    burst = limits.get('burst')
+    max_in_flight = limits.get('max_in_flight')
+    if not rate and not max_in_flight:
+        return None
+    return ratelimit.shared_governor(rate, burst, max_in_flight)
+
+
+def _get_timeout(config):
+    """Return the configured Vault request timeout.
+
+    :param config: configparser object of vaultlocker config
+    :returns: float: timeout in seconds, or None if unset
+    :raises ValueError: If the timeout is not a positive number.
+    """
+    value = config.get('vault', 'timeout', fallback=None)
+    if value is None:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        timeout = 0
+    if timeout <= 0:
+        raise ValueError(
+            "Invalid timeout '{}' in vaultlocker config; must be a "
+            "positive number of seconds".format(value)
+        )
+    return timeout
+
+
+def _get_preload_tls(config):
+    """Return whether Vault connections use a preloaded TLS context.
+
+    :param config: configparser object of vaultlocker config
+    :returns: bool
+    :raises ValueError: If the value is not a boolean.
+    """
+    value = config.get('vault', 'preload_tls', fallback=None)
+    if value is None:
+        return False
+    try:
+        return conf.to_boolean(value)
+    except ValueError:
+        raise ValueError(
+            "Invalid preload_tls '{}' in vaultlocker config; must be a "
+            "boolean".format(value)
+        )
+
+
+def _vault_auth(config):
+    """Return the configured Vault authentication method.
+
+    :param config: configparser object of vaultlocker config
+    :returns: vault.AuthBase
+    :raises ValueError: If the method is not supported or one of its
+                        required options is missing.
+    """
+    method = config.get('vault', 'auth_method', fallback=vault.AUTH_APPROLE)
+    if method not in vault.Auth.methods():
+        raise ValueError(
+            "Invalid auth_method '{}' in vaultlocker config; must be one "
+            "of {}".format(method, ', '.join(vault.Auth.methods()))
+        )
+    required, optional = {
+        vault.AUTH_APPROLE: ({'approle': 'role_id',
+                              'secret_id': 'secret_id'}, {}),
+        vault.AUTH_CERT: ({}, {'cert_role': 'name'}),
+        vault.AUTH_TOKEN_FILE: ({'token_file': 'path'}, {}),
+        vault.AUTH_JWT: ({'jwt_role': 'role', 'jwt_file': 'path'}, {}),
+    }[method]
+    options = {}
+    for option, name in required.items():
+        value = config.get('vault', option, fallback=None)
+        if not value:
+            raise ValueError(
+                "auth_method '{}' requires option '{}' in section "
+                "[vault]".format(method, option)
+            )
+        options[name] = value
+    for option, name in dict(optional, auth_mount='mount_point').items():
+        value = config.get('vault', option, fallback=None)
+        if value:
+            options[name] = value
+    return vault.Auth.get_auth(method, **options)
 
-def _vault_client(config):
+
+def _vault_client(config, adapter=None):
     """Helper wrapper to create Vault Client
 
     :param: config: configparser object of vaultlocker config
+    :param: adapter: hvac adapter class to use instead of the default;
+                     it is passed the governor when one is configured
     :returns: hvac.Client. configured Vault Client object
     """
-    client = hvac.Client(
-        url=config.get('vault', 'url'),
-        verify=config.get('vault', 'ca_bundle', fallback=True)
-    )
-    client.auth.approle.login(
-        role_id=config.get('vault', 'approle'),
-        secret_id=config.get('vault', 'secret_id')
-    )
+    client_args = {}
+    client_cert = config.get('vault', 'client_cert', fallback=None)
+    client_key = config.get('vault', 'client_key', fallback=None)
+    if _get_preload_tls(config):
+        context = tls.client_context(
+            config.get('vault', 'ca_bundle', fallback=None),
+            client_cert,
+            client_key,
+        )
+        client_args['session'] = tls.session(context)
+    elif client_cert:
+        client_args['cert'] = (client_cert, client_key)
+    timeout = _get_timeout(config)
+    if timeout:
+        client_args['timeout'] = timeout
+    governor = _governor(config)
+    if governor:
+        client_args.update(adapter=adapter or vault.GovernedAdapter,
+                           governor=governor)
+    else:
+        client_args['adapter'] = adapter or vault.TracedAdapter
+    with tracing.span('vault.login'):
+        client = hvac.Client(
+            url=config.get('vault', 'url'),
+            verify=config.get('vault', 'ca_bundle', fallback=True),
+            **client_args
+        )
+        _vault_auth(config).login(client)
     return client
 
 
+def _get_tracing(config):
+    """Return the configured trace exporter and its target.
+
+    :param config: configparser object of vaultlocker config
+    :returns: tuple of the exporter and the collector endpoint or file,
+              or None if tracing is off
+    :raises ValueError: If the exporter is unknown or OpenTelemetry is
+                        not installed.
+    """
+    exporter = config.get('tracing', 'exporter', fallback=None)
+    if not exporter:
+        return None
+    if exporter not in tracing.EXPORTERS:
+        raise ValueError(
+            "Invalid exporter '{}' in [tracing]; must be one of {}".format(
+                exporter, ', '.join(tracing.EXPORTERS))
+        )
+    if not tracing.available():
+        raise ValueError('[tracing] requires the opentelemetry-sdk package')
+    if exporter == tracing.EXPORTER_FILE:
+        target = config.get('tracing', 'path', fallback=None)
+        if not target:
+            raise ValueError("Missing option 'path' in section [tracing]")
+    else:
+        target = config.get('tracing', 'endpoint', fallback=None)
+    return exporter, target
+
+
 def _get_kv_version(config):
     """Return the configured Vault KV version.
 
@@ -69,6 +270,122 @@ def _get_kv_version(config):
     return version
 
 
+def _get_delay(config, option):
+    """Return a delay in seconds from the [DEFAULT] section.
+
+    :param config: configparser object of vaultlocker config
+    :param option: name of the option
+    :returns: float: delay in seconds, 0 if unset
+    :raises ValueError: If the value is not a non-negative number.
+    """
+    value = config.get('DEFAULT', option, fallback=None)
+    if value is None:
+        return 0.0
+    try:
+        delay = float(value)
+    except ValueError:
+        delay = -1
+    if delay < 0:
+        raise ValueError(
+            "Invalid {} '{}' in vaultlocker config; must be a "
+            "non-negative number of seconds".format(option, value)
+        )
+    return delay
+
+
+def _start_delay(config, priority):
+    """Return how long to wait before unlocking a device at boot.
+
+    Devices of later priority tiers wait priority_delay seconds per
+    tier; within a tier hosts are spread over boot_jitter seconds by a
+    hash of the hostname, so each host keeps its slot across reboots.
+
+    :param config: configparser object of vaultlocker config
+    :param priority: priority tier of the device, one of PRIORITIES
+    :returns: float: delay in seconds
+    """
+    jitter = _get_delay(config, 'boot_jitter')
+    tier_delay = _get_delay(config, 'priority_delay')
+    delay = PRIORITIES.index(priority) * tier_delay
+    if jitter:
+        digest = hashlib.sha256(get_hostname(config).encode()).digest()
+        delay += jitter * int.from_bytes(digest[:8], 'big') / 2 ** 64
+    return delay
+
+
+def _get_lock_timeout(config):
+    """Return how long to wait for a device lock.
+
+    :param config: configparser object of vaultlocker config
+    :returns: float: timeout in seconds
+    :raises ValueError: If the value is not a non-negative number.
+    """
+    if config.get('DEFAULT', 'lock_timeout', fallback=None) is None:
+        return DEFAULT_LOCK_TIMEOUT
+    return _get_delay(config, 'lock_timeout')
+
+
+def _get_cryptsetup_slots(config):
+    """Return how many cryptsetup runs may execute at once on this host.
+
+    :param config: configparser object of vaultlocker config
+    :returns: int: number of slots, or None if unlimited
+    :raises ValueError: If the value is not a positive integer.
+    """
+    value = config.get('DEFAULT', 'cryptsetup_slots', fallback=None)
+    if value is None:
+        return None
+    try:
+        slots = int(value)
+    except ValueError:
+        slots = 0
+    if slots < 1:
+        raise ValueError(
+            "Invalid cryptsetup_slots '{}' in vaultlocker config; must be "
+            "a positive integer".format(value)
+        )
+    return slots
+
+
+def _device_locks(config, block_uuid=None, block_device=None):
+    """Return a context manager locking a device against other processes.
+
+    :param config: configparser object of vaultlocker config
+    :param block_uuid: UUID of the device, if known
+    :param block_device: path of the block device, if known
+    :returns: context manager holding the locks
+    """
+    names = []
+    if block_device:
+        names.append(locking.device_lock_name(block_device))
+    if block_uuid:
+        names.append(locking.uuid_lock_name(block_uuid))
+    return locking.locks(
+        names,
+        timeout=_get_lock_timeout(config),
+        lock_dir=config.get('DEFAULT', 'lock_dir',
+                            fallback=locking.LOCK_DIR),
+    )
+
+
+def _cryptsetup_slot(config):
+    """Return a context manager holding a host-wide cryptsetup slot.
+
+    :param config: configparser object of vaultlocker config
+    :returns: context manager, a no-op if cryptsetup runs are unlimited
+    """
+    slots = _get_cryptsetup_slots(config)
+    if slots is None:
+        return contextlib.nullcontext()
+    return locking.semaphore(
+        locking.CRYPTSETUP_SLOT,
+        slots,
+        timeout=_get_lock_timeout(config),
+        lock_dir=config.get('DEFAULT', 'lock_dir',
+                            fallback=locking.LOCK_DIR),
+    )
+
+
 def get_hostname(config):
     """Determine the hostname to use in Vault paths.
 
@@ -92,6 +409,216 @@ def get_hostname(config):
         )
 
 
+def _get_key_size(config):
+    """Return the configured dm-crypt key size in bits.
+
+    :param config: configparser object of vaultlocker config
+    :returns: int: key size in bits
+    :raises ValueError: If the key size is not a multiple of 8 bits of
+                        at least MIN_KEY_SIZE bits.
+    """
+    value = config.get('DEFAULT', 'key_size', fallback=None)
+    if value is None:
+        return dmcrypt.KEY_SIZE
+    try:
+        key_size = int(value)
+    except ValueError:
+        key_size = 0
+    if key_size < MIN_KEY_SIZE or key_size % 8:
+        raise ValueError(
+            "Invalid key_size '{}' in vaultlocker config; must be a "
+            "multiple of 8 of at least {}".format(value, MIN_KEY_SIZE)
+        )
+    return key_size
+
+
+def _get_key_source(config):
+    """Return the name of the configured key source.
+
+    :param config: configparser object of vaultlocker config
+    :returns: str: key source name
+    :raises ValueError: If the key source is not supported.
+    """
+    source = config.get('DEFAULT', 'key_source',
+                        fallback=keysource.KEY_SOURCE_LOCAL)
+    sources = (keysource.KEY_SOURCE_LOCAL,
+               keysource.KEY_SOURCE_VAULT,
+               keysource.KEY_SOURCE_HWRNG)
+    if source not in sources:
+        raise ValueError(
+            "Invalid key_source '{}' in vaultlocker config; "
+            "must be one of {}".format(source, ', '.join(sources))
+        )
+    return source
+
+
+def _key_source(client, config):
+    """Return the configured key source plug-in.
+
+    :param client: Authenticated Vault client.
+    :param config: configparser object of vaultlocker config
+    :returns: keysource.KeySourceBase, or None for the local kernel RNG
+    """
+    source = _get_key_source(config)
+    if source == keysource.KEY_SOURCE_LOCAL:
+        return None
+    options = {}
+    if source == keysource.KEY_SOURCE_HWRNG:
+        options['device'] = config.get('DEFAULT', 'key_device',
+                                       fallback=keysource.HWRNG_DEVICE)
+    return keysource.KeySource.get_source(
+        source, client, _get_key_size(config), **options
+    )
+
+
+def _generate_key(client, config):
+    """Generate a dm-crypt key from the configured key source.
+
+    :param client: Authenticated Vault client.
+    :param config: configparser object of vaultlocker config
+    :returns: str: base64 encoded key
+    """
+    source = _key_source(client, config)
+    if source is None:
+        return dmcrypt.generate_key(_get_key_size(config))
+    return source.generate()
+
+
+def _generate_keys(count, client, config):
+    """Generate several dm-crypt keys with a single read of the key source.
+
+    :param count: number of keys to generate
+    :param client: Authenticated Vault client.
+    :param config: configparser object of vaultlocker config
+    :returns: list of base64 encoded keys
+    """
+    source = _key_source(client, config)
+    if source is None:
+        return dmcrypt.generate_keys(count, _get_key_size(config))
+    return source.generate_many(count)
+
+
+def _generate_device_keys(args, client, config):
+    """Generate the keys of the devices to encrypt in a single read.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :returns: list of base64 encoded keys, one per args.block_device
+    """
+    return _generate_keys(len(args.block_device), client, config)
+
+
+def _get_key_wrapping(config):
+    """Return the configured key wrapping mode.
+
+    :param config: configparser object of vaultlocker config
+    :returns: str: key wrapping mode ('none' or 'transit')
+    :raises ValueError: If the configured value is not supported.
+    """
+    mode = config.get('vault', 'key_wrapping',
+                      fallback=vault.KEY_WRAPPING_NONE)
+    if mode not in (vault.KEY_WRAPPING_NONE, vault.KEY_WRAPPING_TRANSIT):
+        raise ValueError(
+            "Invalid key_wrapping '{}' in vaultlocker config; "
+            "must be '{}' or '{}'".format(
+                mode, vault.KEY_WRAPPING_NONE, vault.KEY_WRAPPING_TRANSIT
+            )
+        )
+    return mode
+
+
+def _transit_wrapper(client, config):
+    """Create the transit key wrapper for this host.
+
+    :param client: Authenticated Vault client.
+    :param config: configparser object of vaultlocker config
+    :returns: vault.TransitKeyWrapper using the per-host transit key
+    """
+    return vault.TransitKeyWrapper(
+        client=client,
+        mount_point=config.get('vault', 'transit_backend',
+                               fallback='transit'),
+        key_name=config.get(
+            'vault', 'transit_key',
+            fallback='vaultlocker-{}'.format(get_hostname(config)),
+        ),
+    )
+
+
+def _key_records(keys, client, config):
+    """Return the KV records to store for dm-crypt keys.
+
+    All keys are transit wrapped with a single request if enabled.
+
+    :param keys: dict mapping device UUID to dm-crypt key
+    :param client: Authenticated Vault client.
+    :param config: configparser object of vaultlocker config
+    :returns: dict mapping device UUID to a record holding either the
+              key or its transit ciphertext
+    """
+    if _get_key_wrapping(config) == vault.KEY_WRAPPING_TRANSIT:
+        wrapper = _transit_wrapper(client, config)
+        ciphertexts = wrapper.wrap(list(keys.values()))
+        return {
+            block_uuid: {'wrapped_key': ciphertext}
+            for block_uuid, ciphertext in zip(keys, ciphertexts)
+        }
+    return {
+        block_uuid: {'dmcrypt_key': key}
+        for block_uuid, key in keys.items()
+    }
+
+
+def _unwrap_keys(records, client, config):
+    """Return the dm-crypt keys held by KV records.
+
+    All transit wrapped records are unwrapped with a single request.
+
+    :param records: dict mapping device UUID to KV record
+    :param client: Authenticated Vault client.
+    :param config: configparser object of vaultlocker config
+    :returns: dict mapping device UUID to dm-crypt key
+    """
+    keys = {}
+    wrapped = {}
+    for block_uuid, record in records.items():
+        if 'wrapped_key' in record:
+            wrapped[block_uuid] = record['wrapped_key']
+        else:
+            keys[block_uuid] = record['dmcrypt_key']
+    if wrapped:
+        wrapper = _transit_wrapper(client, config)
+        keys.update(zip(wrapped, wrapper.unwrap(list(wrapped.values()))))
+    return keys
+
+
+def _get_layout(config):
+    """Return the configured Vault storage layout.
+
+    :param config: configparser object of vaultlocker config
+    :returns: str: storage layout ('device' or 'host')
+    :raises ValueError: If the layout is not supported or the host
+                        layout is used without KV version 2.
+    """
+    layout = config.get('vault', 'layout', fallback=vault.LAYOUT_DEVICE)
+    if layout not in (vault.LAYOUT_DEVICE, vault.LAYOUT_HOST):
+        raise ValueError(
+            "Invalid layout '{}' in vaultlocker config; "
+            "must be '{}' or '{}'".format(
+                layout, vault.LAYOUT_DEVICE, vault.LAYOUT_HOST
+            )
+        )
+    if (layout == vault.LAYOUT_HOST and
+            _get_kv_version(config) != vault.KV_VERSION_2):
+        raise ValueError(
+            "layout '{}' requires kv_version '{}'".format(
+                vault.LAYOUT_HOST, vault.KV_VERSION_2
+            )
+        )
+    return layout
+
+
 def _vault_mount_point(config):
     """Return the configured Vault secrets-engine mount.
 
@@ -114,6 +641,15 @@ def _vault_secret_path(device_uuid, config):
     )
 
 
+def _vault_host_path(config):
+    """Return the host key document path relative to the Vault mount.
+
+    :param config: configparser object of vaultlocker config
+    :returns: Path in ``<hostname>`` form
+    """
+    return get_hostname(config)
+
+
 def _get_vault_path(device_uuid, config):
     """Return the complete Vault path.
 
@@ -141,7 +677,102 @@ def _vault_store(client, config):
     )
 
 
-def _encrypt_block_device(args, client, config):
+def _header_dir(config):
+    """Return the directory of detached LUKS headers.
+
+    :param config: configparser object of vaultlocker config
+    """
+    return config.get('DEFAULT', 'header_dir', fallback=headers.HEADER_DIR)
+
+
+def _vault_header_path(device_uuid, config):
+    """Return the header backup path relative to the Vault mount.
+
+    :param device_uuid: String of the device UUID
+    :param config: configparser object of vaultlocker config
+    :returns: Path in ``<hostname>/headers/<uuid>`` form
+    """
+    return '{}/headers/{}'.format(get_hostname(config), device_uuid)
+
+
+def _backup_header(store, block_uuid, config, detached=None):
+    """Store a compressed copy of the LUKS header of a device in Vault.
+
+    :param store: KVStoreBase for the configured mount
+    :param block_uuid: UUID of the block device
+    :param config: configparser object of vaultlocker config
+    :param detached: dict with the 'header' and data 'device' paths of
+                     a detached header, or None
+    :returns: dict describing the stored backup
+    """
+    if detached:
+        device = detached['device']
+    else:
+        try:
+            device = _stable_device_path(
+                os.path.join(status.BY_UUID, block_uuid))
+        except ValueError:
+            device = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backup_file = os.path.join(tmp_dir, 'header')
+        dmcrypt.luks_header_backup(
+            block_uuid, backup_file,
+            header=detached['header'] if detached else None,
+        )
+        return headers.store_backup(
+            store, _vault_header_path(block_uuid, config), backup_file,
+            device=device, detached=bool(detached),
+        )
+
+
+def _stable_device_path(block_device):
+    """Return a path of a block device which is stable across boots.
+
+    A detached header is matched to its data device by path, as the
+    device itself carries no UUID.
+
+    :param block_device: path of the block device
+    :returns: its /dev/disk/by-id or by-path symlink, if it has one
+    """
+    try:
+        links = discovery.find(discovery.scan(), block_device)['links']
+    except ValueError:
+        links = []
+    for prefix in ('/dev/disk/by-id/', '/dev/disk/by-path/'):
+        for link in links:
+            if link.startswith(prefix):
+                return link
+    logger.warning('%s has no stable path; it may not be found by the '
+                   'same path after a reboot', block_device)
+    return block_device
+
+
+def _luks_open(key, block_uuid, detached=None):
+    """Open a device, with its detached header if it has one.
+
+    :param key: the device's dm-crypt key
+    :param block_uuid: UUID of the block device
+    :param detached: dict as returned by headers.lookup, or None
+    """
+    if detached:
+        return dmcrypt.luks_open(key, block_uuid,
+                                 header=detached['header'],
+                                 device=detached['device'])
+    return dmcrypt.luks_open(key, block_uuid)
+
+
+def _journal(config):
+    """Return the journal of device operations in progress.
+
+    :param config: configparser object of vaultlocker config
+    :returns: journal.Journal
+    """
+    return journal.Journal(
+        config.get('DEFAULT', 'journal_dir', fallback=journal.JOURNAL_DIR)
+    )
+
+
+def _encrypt_block_device(args, client, config, key=None):
     """Encrypt and open a block device
 
     Stores the dm-crypt key direct in vault
@@ -149,61 +780,91 @@ def _encrypt_block_device(args, client, config):
     :param: args: argparser generated cli arguments
     :param: client: hvac.Client for Vault access
     :param: config: configparser object of vaultlocker config
+    :param: key: dm-crypt key to use, generated if not given
     """
     block_device = args.block_device[0]
-    key = dmcrypt.generate_key()
+    key = key or _generate_key(client, config)
     block_uuid = str(uuid.uuid4()) if not args.uuid else args.uuid
 
-    path = _vault_secret_path(block_uuid, config)
-    vault_path = '{}/{}'.format(
-        _vault_mount_point(config),
-        path,
-    )
     store = _vault_store(client, config)
-
-    # NOTE: store and validate key before trying to encrypt disk
+    device_journal = _journal(config)
+
+    # NOTE: /dev/sdX names can change across the reboot that a resume
+    # follows, so the device is journalled by a stable path
+    stable_device = _stable_device_path(block_device)
+    details = {}
+    if args.detached_header:
+        details = {
+            'header': headers.header_path(block_uuid, _header_dir(config)),
+            'data_device': stable_device,
+            'backup_header': args.backup_header,
+        }
+
+    # NOTE: the journal entry is written ahead of the key so that a
+    # crash at any later point leaves a record for 'vaultlocker resume'
+    device_journal.record(block_uuid, journal.PHASE_STARTED,
+                          operation=journal.OPERATION_ENCRYPT,
+                          block_device=stable_device,
+                          priority=args.priority, **details)
+
+    # NOTE: store and validate key before trying to encrypt disk; with
+    # KV v2 this also guarantees no existing key for the UUID is replaced
     try:
-        store.write(
-            path,
-            {'dmcrypt_key': key},
-        )
-    except hvac.exceptions.VaultError as write_error:
-        logger.error(
-            'Vault write to path %s failed with error: %s',
-            vault_path,
-            write_error,
-        )
-        raise exceptions.VaultWriteError(
-            vault_path,
-            write_error,
-        )
+        _write_verified_key(store, block_uuid, key, config,
+                            create_only=True)
+    except Exception:
+        device_journal.remove(block_uuid)
+        raise
+    device_journal.record(block_uuid, journal.PHASE_KEY_STORED)
 
-    try:
-        stored_data = store.read(path)
-    except hvac.exceptions.VaultError as read_error:
-        logger.error(
-            'Vault access to path %s failed with error: %s',
-            vault_path,
-            read_error,
-        )
-        raise exceptions.VaultReadError(
-            vault_path,
-            read_error,
-        )
+    _complete_encryption(key, device_journal.get(block_uuid), store,
+                         device_journal, config)
 
-    if not key == stored_data['dmcrypt_key']:
-        raise exceptions.VaultKeyMismatch(vault_path)
+
+def _complete_encryption(key, entry, store, device_journal, config):
+    """Run the phases of an encryption left after its journalled phase.
+
+    :param key: the device's dm-crypt key
+    :param entry: journal entry of the device
+    :param store: KVStoreBase for the configured mount
+    :param device_journal: journal.Journal
+    :param config: configparser object of vaultlocker config
+    """
+    block_uuid = entry['uuid']
+    block_device = entry['block_device']
+    phase = entry['phase']
+    header = entry.get('header')
 
     # All function calls within try/catch raise a CalledProcessError
     # if return code is non-zero
     # This way if any of the calls fail, the key can be removed from vault
     try:
-        dmcrypt.luks_format(key, block_device, block_uuid)
-        # Ensure sym link for new encrypted device is created
-        # LP Bug #1780332
-        dmcrypt.udevadm_rescan(block_device)
-        dmcrypt.udevadm_settle(block_uuid)
-        dmcrypt.luks_open(key, block_uuid)
+        if phase == journal.PHASE_KEY_STORED:
+            if header:
+                headers.register(block_uuid, entry['data_device'],
+                                 os.path.dirname(header))
+            with _cryptsetup_slot(config):
+                dmcrypt.luks_format(key, block_device, block_uuid,
+                                    header=header)
+            device_journal.record(block_uuid, journal.PHASE_FORMATTED)
+            phase = journal.PHASE_FORMATTED
+        if phase == journal.PHASE_FORMATTED:
+            if header:
+                if entry.get('backup_header'):
+                    _backup_header(store, block_uuid, config, {
+                        'header': header, 'device': entry['data_device'],
+                    })
+                detached = {'header': header, 'device': block_device}
+            else:
+                # Ensure sym link for new encrypted device is created
+                # LP Bug #1780332
+                dmcrypt.udevadm_rescan(block_device)
+                dmcrypt.udevadm_settle(block_uuid)
+                detached = None
+            if not _device_exists(block_uuid):
+                with _cryptsetup_slot(config):
+                    _luks_open(key, block_uuid, detached)
+            device_journal.record(block_uuid, journal.PHASE_OPENED)
     except subprocess.CalledProcessError as luks_error:
         logger.error(
             'LUKS formatting %s failed with error code: %s\n'
@@ -213,47 +874,1047 @@ def _encrypt_block_device(args, client, config):
             luks_error.output,
         )
 
-        try:
-            store.delete(path)
-        except hvac.exceptions.VaultError as del_error:
-            raise exceptions.VaultDeleteError(vault_path, del_error)
+        _rollback_encryption(entry, store, device_journal, config)
 
         raise exceptions.LUKSFailure(block_device, luks_error.output)
 
-    systemd.enable('vaultlocker-decrypt@{}.service'.format(block_uuid))
+    unit = DECRYPT_UNIT.format(block_uuid)
+    if entry.get('priority'):
+        systemd.set_environment(unit,
+                                {'VAULTLOCKER_PRIORITY': entry['priority']})
+    systemd.enable(unit)
+    device_journal.remove(block_uuid)
 
 
-def _decrypt_block_device(args, client, config):
-    """Open a LUKS/dm-crypt encrypted block device
+def _check_format_target(entry):
+    """Check that a journalled device can still be formatted on resume.
 
-    The device's dm-crypt key is retrieved from Vault
+    The device must be unused and blank, unless it already carries the
+    LUKS header of the interrupted encryption.
 
-    :param: args: argparser generated cli arguments
-    :param: client: hvac.Client for Vault access
-    :param: config: configparser object of vaultlocker config
+    :param entry: journal entry of the device
+    :raises exceptions.VaultlockerException: if the device has gone
+    :raises exceptions.DeviceInUse: if the device is in use
     """
-    block_uuid = args.uuid[0]
-
-    if _device_exists(block_uuid):
-        logger.info(
-            'Skipping setup of %s because it already exists.',
-            block_uuid,
-        )
+    block_device = entry['block_device']
+    if dmcrypt.luks_uuid(entry.get('header') or block_device) == \
+            entry['uuid']:
         return
-
-    path = _vault_secret_path(block_uuid, config)
-    store = _vault_store(client, config)
-
     try:
-        stored_data = store.read(path)
-    except hvac.exceptions.InvalidPath:
-        raise ValueError(
-            'Unable to locate key for {}'.format(block_uuid)
+        device = discovery.find(discovery.scan(), block_device)
+    except ValueError:
+        raise exceptions.VaultlockerException(
+            '{} of {} has gone'.format(block_device, entry['uuid'])
         )
+    reasons = discovery.in_use(device)
+    if reasons:
+        raise exceptions.DeviceInUse({block_device: reasons})
 
-    key = stored_data['dmcrypt_key']
 
-    dmcrypt.luks_open(key, block_uuid)
+def _rollback_encryption(entry, store, device_journal, config):
+    """Undo an unfinished encryption.
+
+    The key is removed from Vault, which leaves any LUKS header written
+    to the device unusable. Open devices are refused rather than closed,
+    as they may already be in use.
+
+    :param entry: journal entry of the device
+    :param store: KVStoreBase for the configured mount
+    :param device_journal: journal.Journal
+    :param config: configparser object of vaultlocker config
+    :raises exceptions.VaultlockerException: if the device is open
+    """
+    block_uuid = entry['uuid']
+    if entry['phase'] == journal.PHASE_STARTED:
+        # NOTE: the key may not have been written, and a key already
+        # stored under the UUID is not known to belong to this device
+        logger.warning('Leaving any key stored at %s in place',
+                       _get_vault_path(block_uuid, config))
+        device_journal.remove(block_uuid)
+        return
+    if _device_exists(block_uuid):
+        raise exceptions.VaultlockerException(
+            '{} is open; close it before rolling back its '
+            'encryption'.format(block_uuid)
+        )
+    if entry.get('header'):
+        headers.unregister(block_uuid, os.path.dirname(entry['header']))
+    try:
+        _delete_key_record(store, block_uuid, config)
+    except hvac.exceptions.InvalidPath:
+        pass
+    except hvac.exceptions.VaultError as del_error:
+        raise exceptions.VaultDeleteError(
+            _get_vault_path(block_uuid, config), del_error
+        )
+    device_journal.remove(block_uuid)
+
+
+def _resume(args, client, config):
+    """Complete or roll back the encryptions left unfinished by a crash.
+
+    Devices that did not get their key stored are dropped from the
+    journal; the others are completed from the phase they reached,
+    unless a rollback is requested.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :raises exceptions.VaultlockerException: if any device failed
+    """
+    store = _vault_store(client, config)
+    device_journal = _journal(config)
+    failed = []
+    for entry in device_journal.entries():
+        block_uuid = entry['uuid']
+        if (entry.get('operation', journal.OPERATION_ENCRYPT) !=
+                journal.OPERATION_ENCRYPT):
+            logger.info("Run 'vaultlocker %s %s' to finish its %s",
+                        entry['operation'], block_uuid, entry['operation'])
+            continue
+        with _device_locks(config, block_uuid, entry['block_device']):
+            try:
+                if (args.rollback or
+                        entry['phase'] == journal.PHASE_STARTED):
+                    logger.info('Rolling back encryption of %s (%s)',
+                                entry['block_device'], block_uuid)
+                    _rollback_encryption(entry, store, device_journal,
+                                         config)
+                    continue
+                logger.info('Resuming encryption of %s (%s) after %s',
+                            entry['block_device'], block_uuid,
+                            entry['phase'])
+                if entry['phase'] == journal.PHASE_KEY_STORED:
+                    _check_format_target(entry)
+                record = _read_key_record(store, block_uuid, config)
+                key = _unwrap_keys({block_uuid: record}, client,
+                                   config)[block_uuid]
+                _complete_encryption(key, entry, store, device_journal,
+                                     config)
+            except (exceptions.VaultlockerException,
+                    hvac.exceptions.VaultError,
+                    subprocess.CalledProcessError) as error:
+                logger.error('Unable to resume %s: %s', block_uuid, error)
+                failed.append(block_uuid)
+    if failed:
+        raise exceptions.VaultlockerException(
+            'Unable to resume {}'.format(', '.join(failed))
+        )
+
+
+def _decrypt_block_device(args, client, config, luks_open=None):
+    """Open a LUKS/dm-crypt encrypted block device
+
+    The device's dm-crypt key is retrieved from Vault
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :param: luks_open: function opening the device, if not cryptsetup
+    """
+    luks_open = luks_open or _luks_open
+    block_uuid = args.uuid[0]
+
+    if _device_exists(block_uuid):
+        logger.info(
+            'Skipping setup of %s because it already exists.',
+            block_uuid,
+        )
+        return
+
+    store = _vault_store(client, config)
+
+    try:
+        stored_data = _read_key_record(store, block_uuid, config)
+    except hvac.exceptions.InvalidPath:
+        raise ValueError(
+            'Unable to locate key for {}'.format(block_uuid)
+        )
+
+    key = _unwrap_keys({block_uuid: stored_data}, client, config)[block_uuid]
+    detached = headers.lookup(block_uuid, _header_dir(config))
+
+    try:
+        with _cryptsetup_slot(config):
+            luks_open(key, block_uuid, detached)
+    except subprocess.CalledProcessError:
+        # a rotation interrupted after changing the LUKS key leaves the
+        # new key staged next to the old one
+        staged = _staged_record(stored_data)
+        if staged is None:
+            raise
+        logger.info('Opening %s with its staged key', block_uuid)
+        key = _unwrap_keys({block_uuid: staged}, client, config)[block_uuid]
+        with _cryptsetup_slot(config):
+            luks_open(key, block_uuid, detached)
+
+
+def _staged_record(record):
+    """Return the record of a key staged for rotation, if any.
+
+    :param record: KV record of a device
+    :returns: record holding the staged key, or None
+    """
+    staged = {
+        field[:-len(NEXT_SUFFIX)]: value
+        for field, value in record.items()
+        if field.endswith(NEXT_SUFFIX)
+    }
+    return staged or None
+
+
+def _finishing_command(entry):
+    """Return the subcommand finishing the operation of a journal entry"""
+    operation = entry.get('operation', journal.OPERATION_ENCRYPT)
+    if operation == journal.OPERATION_ENCRYPT:
+        return 'resume'
+    return '{} {}'.format(operation, entry['uuid'])
+
+
+def _stage_key(block_uuid, client, store, config, new_key=None):
+    """Stage a new key in Vault next to the current key of a device.
+
+    A key staged earlier is kept, so staging can be repeated.
+
+    :param block_uuid: UUID of the block device
+    :param client: Authenticated Vault client.
+    :param store: KVStoreBase for the configured mount
+    :param config: configparser object of vaultlocker config
+    :param new_key: key to stage, generated if not given
+    :returns: tuple of the device's KV record and the staged record
+    """
+    record = _read_key_record(store, block_uuid, config)
+    staged = _staged_record(record)
+    if staged is None:
+        new_key = new_key or _generate_key(client, config)
+        staged = _key_records({block_uuid: new_key}, client,
+                              config)[block_uuid]
+        record = dict(record, **{
+            field + NEXT_SUFFIX: value
+            for field, value in staged.items()
+        })
+        _store_key_records(store, {block_uuid: record}, config)
+    return record, staged
+
+
+def _rotate_device(block_uuid, client, store, device_journal, args,
+                   config, new_key=None):
+    """Rotate the key of a single device.
+
+    Every step can be repeated, so an interrupted rotation is completed
+    by rotating the device again:
+
+    1. a new key is staged in Vault next to the current one
+    2. the volume key is replaced by online LUKS2 reencryption
+    3. the LUKS passphrase is changed to the staged key
+    4. the staged key replaces the current key in Vault
+
+    :param block_uuid: UUID of the block device
+    :param client: Authenticated Vault client.
+    :param store: KVStoreBase for the configured mount
+    :param device_journal: journal.Journal
+    :param args: argparser generated cli arguments
+    :param config: configparser object of vaultlocker config
+    :param new_key: key to stage, generated if not given
+    """
+    entry = device_journal.get(block_uuid)
+    if entry and entry.get('operation') != journal.OPERATION_ROTATE:
+        raise exceptions.VaultlockerException(
+            "Unfinished {0} of {1}; run 'vaultlocker {2}' first".format(
+                entry.get('operation', journal.OPERATION_ENCRYPT),
+                block_uuid, _finishing_command(entry))
+        )
+    lock_dir = config.get('DEFAULT', 'lock_dir', fallback=locking.LOCK_DIR)
+
+    # the device lock is only held for short steps so that the device
+    # can still be opened while its data is reencrypted
+    with locking.lock(KEY_CHANGE_LOCK.format(block_uuid), timeout=0,
+                      lock_dir=lock_dir):
+        with _device_locks(config, block_uuid):
+            record, staged = _stage_key(block_uuid, client, store, config,
+                                        new_key)
+            if entry is None:
+                entry = {'phase': journal.PHASE_KEY_STAGED}
+                device_journal.record(block_uuid, journal.PHASE_KEY_STAGED,
+                                      operation=journal.OPERATION_ROTATE)
+        keys = _unwrap_keys({'current': record, 'staged': staged},
+                            client, config)
+
+        if not dmcrypt.luks_test_key(keys['staged'], block_uuid):
+            if entry['phase'] != journal.PHASE_REENCRYPTED:
+                with locking.semaphore(REENCRYPT_SLOT, args.parallel,
+                                       lock_dir=lock_dir):
+                    dmcrypt.luks_reencrypt(keys['current'], block_uuid,
+                                           resilience=args.resilience,
+                                           hotzone_size=args.hotzone_size,
+                                           ionice=args.ionice)
+                device_journal.record(block_uuid,
+                                      journal.PHASE_REENCRYPTED)
+            with _device_locks(config, block_uuid), \
+                    _cryptsetup_slot(config):
+                dmcrypt.luks_change_key(keys['current'], keys['staged'],
+                                        block_uuid)
+
+        with _device_locks(config, block_uuid):
+            _store_key_records(store, {block_uuid: staged}, config)
+        device_journal.remove(block_uuid)
+    logger.info('Rotated key of %s', block_uuid)
+
+
+def _rotate(args, client, config):
+    """Rotate the keys of this host's devices.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :raises exceptions.VaultlockerException: if any device failed
+    """
+    if args.parallel < 1:
+        raise ValueError('--parallel must be at least 1')
+    _for_each_device(_rotate_device, 'rotate key of', args, client,
+                     config, attached_only=True, new_keys=True)
+
+
+def _for_each_device(func, action, args, client, config, list_uuids=None,
+                     attached_only=False, new_keys=False):
+    """Run an operation on several devices of this host in parallel.
+
+    :param func: callable taking the UUID, client, store, journal, args
+                 and config of a device
+    :param action: verb naming the operation in error messages
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :param list_uuids: callable taking the store and config and returning
+                       the devices to use when args.uuid is empty; the
+                       devices with a key by default
+    :param attached_only: skip devices with a detached LUKS header, and
+                          refuse them when named in args.uuid
+    :param new_keys: generate a key per device with a single read of the
+                     key source and pass it to func as new_key
+    :raises exceptions.VaultlockerException: if any device failed
+    """
+    store = _vault_store(client, config)
+    device_journal = _journal(config)
+    block_uuids = args.uuid or sorted(
+        (list_uuids or _list_device_uuids)(store, config))
+    if attached_only:
+        detached = [block_uuid for block_uuid in block_uuids
+                    if headers.lookup(block_uuid, _header_dir(config))]
+        if detached and args.uuid:
+            raise exceptions.VaultlockerException(
+                'Unable to {} {}: LUKS header is detached'.format(
+                    action, ', '.join(detached))
+            )
+        for block_uuid in detached:
+            logger.info('Skipping %s: LUKS header is detached', block_uuid)
+        block_uuids = [block_uuid for block_uuid in block_uuids
+                       if block_uuid not in detached]
+    extra = {block_uuid: {} for block_uuid in block_uuids}
+    if new_keys and block_uuids:
+        keys = _generate_keys(len(block_uuids), client, config)
+        for block_uuid, key in zip(block_uuids, keys):
+            extra[block_uuid]['new_key'] = key
+    failed = []
+    with futures.ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        pending = {
+            executor.submit(
+                func, block_uuid, client, store, device_journal, args,
+                config, **extra[block_uuid]
+            ): block_uuid
+            for block_uuid in block_uuids
+        }
+        for future in futures.as_completed(pending):
+            try:
+                future.result()
+            except (exceptions.VaultlockerException,
+                    hvac.exceptions.VaultError,
+                    subprocess.CalledProcessError,
+                    ValueError) as error:
+                logger.error('Unable to %s %s: %s', action,
+                             pending[future], error)
+                failed.append(pending[future])
+    if failed:
+        raise exceptions.VaultlockerException(
+            'Unable to {} {}'.format(action, ', '.join(sorted(failed)))
+        )
+
+
+def _rekey_device(block_uuid, client, store, device_journal, args,
+                  config, new_key=None):
+    """Replace the keyslot of a single device without reencryption.
+
+    The device holds a valid key in Vault at every step, so an
+    interrupted rekey is completed by rekeying the device again:
+
+    1. a new key is staged in Vault next to the current one
+    2. the staged key is added to a free LUKS keyslot
+    3. the staged key replaces the current key in Vault and is verified
+    4. the keyslot of the old key is wiped
+
+    :param block_uuid: UUID of the block device
+    :param client: Authenticated Vault client.
+    :param store: KVStoreBase for the configured mount
+    :param device_journal: journal.Journal
+    :param args: argparser generated cli arguments
+    :param config: configparser object of vaultlocker config
+    :param new_key: key to stage, generated if not given
+    """
+    entry = device_journal.get(block_uuid)
+    if entry and entry.get('operation') != journal.OPERATION_REKEY:
+        raise exceptions.VaultlockerException(
+            "Unfinished {0} of {1}; run 'vaultlocker {2}' first".format(
+                entry.get('operation', journal.OPERATION_ENCRYPT),
+                block_uuid, _finishing_command(entry))
+        )
+    lock_dir = config.get('DEFAULT', 'lock_dir', fallback=locking.LOCK_DIR)
+
+    with locking.lock(KEY_CHANGE_LOCK.format(block_uuid), timeout=0,
+                      lock_dir=lock_dir), \
+            _device_locks(config, block_uuid):
+        if entry is None or entry['phase'] == journal.PHASE_KEY_STAGED:
+            record, staged = _stage_key(block_uuid, client, store, config,
+                                        new_key)
+            keys = _unwrap_keys({'current': record, 'staged': staged},
+                                client, config)
+            if entry is None:
+                with _cryptsetup_slot(config):
+                    old_slot = dmcrypt.luks_key_slot(keys['current'],
+                                                     block_uuid)
+                if old_slot is None:
+                    raise exceptions.VaultlockerException(
+                        'Key in Vault does not unlock {}'.format(block_uuid)
+                    )
+                entry = {'phase': journal.PHASE_KEY_STAGED,
+                         'old_slot': old_slot}
+                device_journal.record(block_uuid, journal.PHASE_KEY_STAGED,
+                                      operation=journal.OPERATION_REKEY,
+                                      old_slot=old_slot)
+            with _cryptsetup_slot(config):
+                new_slot = dmcrypt.luks_key_slot(keys['staged'], block_uuid)
+                if new_slot is None:
+                    dmcrypt.luks_add_key(keys['current'], keys['staged'],
+                                         block_uuid)
+                    new_slot = dmcrypt.luks_key_slot(keys['staged'],
+                                                     block_uuid)
+            entry.update(phase=journal.PHASE_SLOT_ADDED, new_slot=new_slot)
+            device_journal.record(block_uuid, journal.PHASE_SLOT_ADDED,
+                                  new_slot=new_slot)
+
+        if entry['phase'] == journal.PHASE_SLOT_ADDED:
+            record = _read_key_record(store, block_uuid, config)
+            staged = _staged_record(record)
+            if staged is not None:
+                _store_key_records(store, {block_uuid: staged}, config)
+            device_journal.record(block_uuid, journal.PHASE_KEY_STORED)
+
+        old_slot, new_slot = entry['old_slot'], entry['new_slot']
+        if old_slot == new_slot:
+            raise exceptions.VaultlockerException(
+                'New key of {} took over keyslot {}'.format(block_uuid,
+                                                            old_slot)
+            )
+        if old_slot in dmcrypt.luks_key_slots(block_uuid):
+            record = _read_key_record(store, block_uuid, config)
+            key = _unwrap_keys({block_uuid: record}, client,
+                               config)[block_uuid]
+            with _cryptsetup_slot(config):
+                dmcrypt.luks_kill_slot(key, block_uuid, old_slot)
+        device_journal.remove(block_uuid)
+    logger.info('Replaced keyslot %s of %s with %s', old_slot, block_uuid,
+                new_slot)
+
+
+def _rekey(args, client, config):
+    """Replace the keyslots of this host's devices.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :raises exceptions.VaultlockerException: if any device failed
+    """
+    if args.parallel < 1:
+        raise ValueError('--parallel must be at least 1')
+    _for_each_device(_rekey_device, 'rekey', args, client, config,
+                     attached_only=True, new_keys=True)
+
+
+def _backup_device_header(block_uuid, client, store, device_journal,
+                          args, config):
+    """Back up the LUKS header of a single device to Vault."""
+    detached = headers.lookup(block_uuid, _header_dir(config))
+    description = _backup_header(store, block_uuid, config, detached)
+    logger.info('Backed up header of %s (%d bytes in %d chunks)',
+                block_uuid, description['size'], description['chunks'])
+
+
+def _restore_device_header(block_uuid, client, store, device_journal,
+                           args, config):
+    """Restore the LUKS header of a single device from Vault.
+
+    A device whose header still carries its UUID is left alone unless
+    args.force is set; a device with the header of another device is
+    never overwritten without it.
+    """
+    header_dir = _header_dir(config)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backup_file = os.path.join(tmp_dir, 'header')
+        description = headers.load_backup(
+            store, _vault_header_path(block_uuid, config), backup_file)
+        # a detached header is useless without the data device it is
+        # registered for
+        device = args.device or description.get('device')
+        if not device:
+            raise exceptions.VaultlockerException(
+                'No device recorded for {}; use --device'.format(block_uuid)
+            )
+        if description.get('detached'):
+            target = headers.header_path(block_uuid, header_dir)
+        else:
+            target = device
+
+        with _device_locks(config, block_uuid, device):
+            found_uuid = (dmcrypt.luks_uuid(target)
+                          if os.path.exists(target) else None)
+            if found_uuid == block_uuid and not args.force:
+                logger.info('Header of %s is intact, not restoring',
+                            block_uuid)
+                return
+            if found_uuid not in (None, block_uuid) and not args.force:
+                raise exceptions.VaultlockerException(
+                    '{} holds the header of {}, not of {}'.format(
+                        target, found_uuid, block_uuid)
+                )
+
+            if description.get('detached'):
+                headers.register(block_uuid, device, header_dir)
+                with open(backup_file, 'rb') as backup, \
+                        open('{}.tmp'.format(target), 'wb') as restored:
+                    shutil.copyfileobj(backup, restored)
+                    restored.flush()
+                    os.fsync(restored.fileno())
+                os.rename('{}.tmp'.format(target), target)
+            else:
+                dmcrypt.luks_header_restore(target, backup_file)
+    logger.info('Restored header of %s to %s', block_uuid, target)
+
+
+def _list_header_backups(store, config):
+    """Return the UUIDs with a header backup for this host."""
+    try:
+        keys = store.list('{}/headers'.format(get_hostname(config)))
+    except hvac.exceptions.InvalidPath:
+        return []
+    return [key for key in keys if not key.endswith('/')]
+
+
+def _header_backup(args, client, config):
+    """Back up the LUKS headers of this host's devices to Vault."""
+    if args.parallel < 1:
+        raise ValueError('--parallel must be at least 1')
+    _for_each_device(_backup_device_header, 'back up header of', args,
+                     client, config)
+
+
+def _header_restore(args, client, config):
+    """Restore the LUKS headers of this host's devices from Vault."""
+    if args.parallel < 1:
+        raise ValueError('--parallel must be at least 1')
+    if args.device and len(args.uuid) != 1:
+        raise ValueError('--device can only be used with a single UUID')
+    _for_each_device(_restore_device_header, 'restore header of', args,
+                     client, config, list_uuids=_list_header_backups)
+
+
+def _list_device_entries(store, config):
+    """Return the UUIDs with a per-device key entry for this host.
+
+    :param store: KVStoreBase for the configured mount
+    :param config: configparser object of vaultlocker config
+    :returns: list of device UUIDs
+    """
+    try:
+        keys = store.list(get_hostname(config))
+    except hvac.exceptions.InvalidPath:
+        return []
+    return [key for key in keys if not key.endswith('/')]
+
+
+def _list_device_uuids(store, config):
+    """Return the UUIDs which have a key stored for this host.
+
+    :param store: KVStoreBase for the configured mount
+    :param config: configparser object of vaultlocker config
+    :returns: list of device UUIDs
+    """
+    if _get_layout(config) == vault.LAYOUT_HOST:
+        document, _ = _read_host_document(store, config)
+        return list(document['keys'])
+    return _list_device_entries(store, config)
+
+
+def _read_device_records(store, config, workers=DEFAULT_WORKERS):
+    """Read every per-device key entry of this host concurrently.
+
+    :param store: KVStoreBase for the configured mount
+    :param config: configparser object of vaultlocker config
+    :param workers: number of concurrent Vault reads
+    :returns: dict mapping device UUID to KV record
+    """
+    def _read(block_uuid):
+        return store.read(_vault_secret_path(block_uuid, config))
+
+    uuids = _list_device_entries(store, config)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(uuids, executor.map(_read, uuids)))
+
+
+def _read_host_records(store, config, workers=DEFAULT_WORKERS):
+    """Read every KV record stored for this host.
+
+    :param store: KVStoreBase for the configured mount
+    :param config: configparser object of vaultlocker config
+    :param workers: number of concurrent Vault reads
+    :returns: dict mapping device UUID to KV record
+    """
+    if _get_layout(config) == vault.LAYOUT_HOST:
+        document, _ = _read_host_document(store, config)
+        return document['keys']
+    return _read_device_records(store, config, workers)
+
+
+def _read_host_keys(store, config, workers=DEFAULT_WORKERS):
+    """Read every dm-crypt key stored for this host.
+
+    :param store: KVStoreBase for the configured mount
+    :param config: configparser object of vaultlocker config
+    :param workers: number of concurrent Vault reads
+    :returns: dict mapping device UUID to dm-crypt key
+    """
+    records = _read_host_records(store, config, workers)
+    return _unwrap_keys(records, store.client, config)
+
+
+def _read_key_record(store, block_uuid, config):
+    """Read the KV record holding the key of a single device.
+
+    :param store: KVStoreBase for the configured mount
+    :param block_uuid: UUID of the block device
+    :param config: configparser object of vaultlocker config
+    :returns: dict KV record
+    :raises hvac.exceptions.InvalidPath: if no key is stored for the device
+    """
+    if _get_layout(config) == vault.LAYOUT_HOST:
+        document, _ = _read_host_document(store, config)
+        try:
+            return document['keys'][block_uuid]
+        except KeyError:
+            raise hvac.exceptions.InvalidPath(
+                'No key for {} in {}'.format(
+                    block_uuid, _vault_host_path(config))
+            )
+    return store.read(_vault_secret_path(block_uuid, config))
+
+
+def _read_host_document(store, config):
+    """Read the host key document and its KV version.
+
+    :param store: KVStoreV2 for the configured mount
+    :param config: configparser object of vaultlocker config
+    :returns: tuple of the document and its version (0 if it is missing)
+    """
+    try:
+        document, version = store.read_version(_vault_host_path(config))
+    except hvac.exceptions.InvalidPath:
+        return {'format': HOST_DOCUMENT_FORMAT, 'keys': {}}, 0
+    if document.get('format') != HOST_DOCUMENT_FORMAT:
+        raise ValueError(
+            'Unsupported host key document format {} at {}'.format(
+                document.get('format'), _vault_host_path(config))
+        )
+    return document, version
+
+
+def _update_host_document(store, config, update):
+    """Update the host key document using check-and-set writes.
+
+    The document is re-read and ``update`` re-applied if another writer
+    changed it concurrently.
+
+    :param store: KVStoreV2 for the configured mount
+    :param config: configparser object of vaultlocker config
+    :param update: callable modifying the dict of KV records in place
+    :returns: dict: metadata of the written document version
+    """
+    path = _vault_host_path(config)
+    for attempt in range(1, CAS_RETRIES + 1):
+        document, version = _read_host_document(store, config)
+        update(document['keys'])
+        try:
+            return store.write(path, document, cas=version)
+        except hvac.exceptions.InvalidRequest as write_error:
+            if (not vault.is_cas_conflict(write_error) or
+                    attempt == CAS_RETRIES):
+                raise
+            logger.info('Concurrent update of %s, retrying', path)
+
+
+def _store_device_record(store, block_uuid, record, config,
+                         create_only=False):
+    """Write a per-device KV record and verify it
+
+    KV version 2 writes are verified by the version returned from the
+    write itself; KV version 1 records are read back.
+
+    :param store: KVStoreBase for the configured mount
+    :param block_uuid: UUID of the block device
+    :param record: KV record to store
+    :param config: configparser object of vaultlocker config
+    :param create_only: with KV version 2, refuse to overwrite an
+                        existing record (check-and-set version 0)
+    :raises VaultWriteError, VaultReadError, VaultKeyMismatch
+    """
+    path = _vault_secret_path(block_uuid, config)
+    vault_path = _get_vault_path(block_uuid, config)
+    versioned = _get_kv_version(config) == vault.KV_VERSION_2
+    try:
+        if versioned and create_only:
+            metadata = store.write(path, record, cas=0)
+        else:
+            metadata = store.write(path, record)
+    except hvac.exceptions.VaultError as write_error:
+        logger.error(
+            'Vault write to path %s failed with error: %s',
+            vault_path,
+            write_error,
+        )
+        raise exceptions.VaultWriteError(vault_path, write_error)
+
+    if versioned and metadata.get('version'):
+        logger.debug('Stored %s as version %s', vault_path,
+                     metadata['version'])
+        return
+
+    try:
+        stored_data = store.read(path)
+    except hvac.exceptions.VaultError as read_error:
+        logger.error(
+            'Vault access to path %s failed with error: %s',
+            vault_path,
+            read_error,
+        )
+        raise exceptions.VaultReadError(vault_path, read_error)
+
+    if not record == stored_data:
+        raise exceptions.VaultKeyMismatch(vault_path)
+
+
+def _store_device_records(store, records, config, workers=DEFAULT_WORKERS,
+                          create_only=False):
+    """Write per-device KV records concurrently and verify them
+
+    :param store: KVStoreBase for the configured mount
+    :param records: dict mapping device UUID to KV record
+    :param config: configparser object of vaultlocker config
+    :param workers: number of concurrent Vault requests
+    :param create_only: refuse to overwrite existing records (KV v2)
+    :raises VaultWriteError, VaultReadError, VaultKeyMismatch
+    """
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(
+                _store_device_record, store, block_uuid, record, config,
+                create_only,
+            ): block_uuid
+            for block_uuid, record in records.items()
+        }
+        failures = []
+        for future in futures.as_completed(pending):
+            try:
+                future.result()
+            except exceptions.VaultlockerException as store_error:
+                logger.error('Storing key of %s failed: %s',
+                             pending[future], store_error)
+                failures.append(store_error)
+    if failures:
+        raise failures[0]
+
+
+def _store_host_records(store, records, config, create_only=False):
+    """Merge KV records into the host key document
+
+    The check-and-set write of the whole document succeeds only if no
+    other writer changed it since it was read, so no read back is
+    needed to verify the records.
+
+    :param store: KVStoreV2 for the configured mount
+    :param records: dict mapping device UUID to KV record
+    :param config: configparser object of vaultlocker config
+    :param create_only: refuse to replace records of existing UUIDs
+    :raises VaultWriteError
+    """
+    vault_path = '{}/{}'.format(
+        _vault_mount_point(config),
+        _vault_host_path(config),
+    )
+
+    def _merge(keys):
+        if create_only:
+            existing = sorted(set(keys).intersection(records))
+            if existing:
+                raise exceptions.VaultWriteError(
+                    vault_path,
+                    'keys already exist for {}'.format(', '.join(existing)),
+                )
+        keys.update(records)
+
+    try:
+        metadata = _update_host_document(store, config, _merge)
+    except hvac.exceptions.VaultError as write_error:
+        logger.error(
+            'Vault write to path %s failed with error: %s',
+            vault_path,
+            write_error,
+        )
+        raise exceptions.VaultWriteError(vault_path, write_error)
+    logger.debug('Stored %s as version %s', vault_path,
+                 metadata.get('version'))
+
+
+def _store_key_records(store, records, config, workers=DEFAULT_WORKERS,
+                       create_only=False):
+    """Write KV records in the configured layout and verify them
+
+    :param store: KVStoreBase for the configured mount
+    :param records: dict mapping device UUID to KV record
+    :param config: configparser object of vaultlocker config
+    :param workers: number of concurrent Vault requests
+    :param create_only: refuse to overwrite existing records (KV v2)
+    :raises VaultWriteError, VaultReadError, VaultKeyMismatch
+    """
+    if _get_layout(config) == vault.LAYOUT_HOST:
+        _store_host_records(store, records, config, create_only)
+    else:
+        _store_device_records(store, records, config, workers, create_only)
+
+
+def _delete_key_record(store, block_uuid, config):
+    """Remove the key of a single device in the configured layout
+
+    :param store: KVStoreBase for the configured mount
+    :param block_uuid: UUID of the block device
+    :param config: configparser object of vaultlocker config
+    """
+    if _get_layout(config) == vault.LAYOUT_HOST:
+        _update_host_document(store, config,
+                              lambda keys: keys.pop(block_uuid, None))
+    else:
+        store.delete(_vault_secret_path(block_uuid, config))
+
+
+def _write_verified_key(store, block_uuid, key, config, create_only=False):
+    """Write a dm-crypt key to Vault and verify it
+
+    :param store: KVStoreBase for the configured mount
+    :param block_uuid: UUID of the block device
+    :param key: dm-crypt key to store
+    :param config: configparser object of vaultlocker config
+    :param create_only: refuse to overwrite an existing key (KV v2)
+    :raises VaultWriteError, VaultReadError, VaultKeyMismatch
+    """
+    records = _key_records({block_uuid: key}, store.client, config)
+    _store_key_records(store, records, config, create_only=create_only)
+
+
+def _open_output(path, append=False):
+    """Open an output file readable only by its owner, or stdout for -"""
+    if path == '-':
+        return os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    flags = os.O_WRONLY | os.O_CREAT
+    flags |= os.O_APPEND if append else os.O_TRUNC
+    fd = os.open(path, flags, 0o600)
+    return os.fdopen(fd, 'a' if append else 'w')
+
+
+def _open_input(path):
+    """Open an input file, or stdin for -"""
+    if path == '-':
+        return os.fdopen(os.dup(sys.stdin.fileno()), 'r')
+    return open(path, 'r')
+
+
+def _export_keys(args, client, config):
+    """Export all keys of this host as one response-wrapped payload
+
+    The keys never leave Vault in the clear; only the single-use
+    wrapping token is written to the output.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    """
+    store = _vault_store(client, config)
+    keys = _read_host_keys(store, config, args.workers)
+    hostname = get_hostname(config)
+    token = vault.wrap(
+        client,
+        {
+            'version': EXPORT_FORMAT_VERSION,
+            'hostname': hostname,
+            'keys': keys,
+        },
+        args.wrap_ttl,
+    )
+    logger.info('Exported %d keys for %s', len(keys), hostname)
+    with _open_output(args.output) as output:
+        json.dump(
+            {
+                'hostname': hostname,
+                'count': len(keys),
+                'wrap_ttl': args.wrap_ttl,
+                'wrap_token': token,
+            },
+            output,
+        )
+        output.write('\n')
+
+
+def _unwrap_export(args, client):
+    """Unwrap the payload of a key export
+
+    The wrapping token can only be used once, so this is not retried.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :returns: dict: the exported payload
+    """
+    with _open_input(args.input) as source:
+        token = json.load(source)['wrap_token']
+    payload = vault.unwrap(client, token)
+    if payload.get('version') != EXPORT_FORMAT_VERSION:
+        raise ValueError(
+            'Unsupported key export version {}'.format(payload.get('version'))
+        )
+    return payload
+
+
+def _import_keys(payload, args, client, config):
+    """Import keys from an unwrapped export into this host
+
+    Keys are written concurrently, or as a single update of the host key
+    document, and read back to verify they were stored intact. Keys
+    already stored are skipped, so an interrupted import can be
+    repeated; a different key stored for the same UUID is only replaced
+    with args.force.
+
+    :param: payload: dict returned by _unwrap_export
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :raises exceptions.VaultlockerException: if keys would be replaced
+    """
+    store = _vault_store(client, config)
+    existing = _read_host_keys(store, config, args.workers)
+    keys = {
+        block_uuid: key for block_uuid, key in payload['keys'].items()
+        if existing.get(block_uuid) != key
+    }
+    conflicts = sorted(set(keys).intersection(existing))
+    if conflicts and not args.force:
+        raise exceptions.VaultlockerException(
+            'Different keys are already stored for {}; use --force to '
+            'replace them'.format(', '.join(conflicts))
+        )
+    _store_key_records(store, _key_records(keys, client, config),
+                       config, args.workers, create_only=not args.force)
+    logger.info('Imported %d keys exported from %s into %s (%d already '
+                'present)', len(keys), payload.get('hostname'),
+                get_hostname(config), len(payload['keys']) - len(keys))
+
+
+def _migrate_layout(args, client, config):
+    """Migrate per-device key entries into the host key document
+
+    Existing entries of the host key document are kept; per-device
+    entries are only removed (with --prune) once the host key document
+    has been verified.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    """
+    if _get_kv_version(config) != vault.KV_VERSION_2:
+        raise ValueError(
+            "layout '{}' requires kv_version '{}'".format(
+                vault.LAYOUT_HOST, vault.KV_VERSION_2
+            )
+        )
+    if args.prune and _get_layout(config) != vault.LAYOUT_HOST:
+        # decrypt reads keys in the configured layout only
+        raise ValueError(
+            "--prune requires layout '{}'".format(vault.LAYOUT_HOST)
+        )
+    store = _vault_store(client, config)
+    records = _read_device_records(store, config, args.workers)
+    if not records:
+        logger.info('No per-device keys to migrate')
+        return
+    _store_host_records(store, records, config)
+    logger.info('Migrated %d keys into %s/%s', len(records),
+                _vault_mount_point(config), _vault_host_path(config))
+
+    if args.prune:
+        def _delete(block_uuid):
+            store.delete(_vault_secret_path(block_uuid, config))
+
+        with futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(_delete, records))
+        logger.info('Removed %d per-device keys', len(records))
+
+
+def _audit(args, client, config):
+    """Audit the keys of all hosts in the configured mount
+
+    Results are streamed to args.output as NDJSON; with --checkpoint the
+    last completed page of hosts is recorded so that --resume can pick
+    up an interrupted audit.
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    """
+    inventory = None
+    if args.inventory:
+        with _open_input(args.inventory) as source:
+            inventory = json.load(source)
+    start_after = None
+    if args.resume:
+        if not args.checkpoint:
+            raise ValueError('--resume requires --checkpoint')
+        start_after = audit.read_checkpoint(args.checkpoint)
+    auditor = audit.Auditor(
+        _vault_store(client, config),
+        workers=args.workers,
+        page_size=args.page_size,
+        limiter=ratelimit.TokenBucket(args.rate) if args.rate > 0 else None,
+        inventory=inventory,
+    )
+    with _open_output(args.output, append=args.resume) as output:
+        counts = auditor.audit(output, start_after, args.checkpoint)
+    logger.info('Audit finished: %s', ', '.join(
+        '{} {}'.format(count, result) for result, count in counts.items()
+    ) or 'no keys')
+
+
+def _list_vault_uuids(args, client, config):
+    """Return the UUIDs which have a key stored for this host
+
+    :param: args: argparser generated cli arguments
+    :param: client: hvac.Client for Vault access
+    :param: config: configparser object of vaultlocker config
+    :returns: list of device UUIDs
+    """
+    return _list_device_uuids(_vault_store(client, config), config)
 
 
 def _device_exists(block_uuid):
@@ -264,15 +1925,36 @@ def _device_exists(block_uuid):
     return os.path.exists(path)
 
 
-def _do_it_with_persistence(func, args, config):
+def _device_present(block_uuid, detached=None):
+    """Checks if the encrypted block device has appeared.
+
+    :param block_uuid: UUID of the block device
+    :param detached: dict as returned by headers.lookup, or None
+    """
+    if detached:
+        return os.path.exists(detached['device'])
+    return os.path.exists('/dev/disk/by-uuid/{}'.format(block_uuid))
+
+
+def _do_it_with_persistence(func, args, config, adapter=None):
     """Exec func with retries based on provided cli flags
 
     :param: func: function to attempt to execute
     :param: args: argparser generated cli arguments
     :param: config: configparser object of vaultlocker config
+    :param: adapter: hvac adapter class of the Vault clients, if not the
+                     default
+    :returns: the return value of func
     """
+    if getattr(args, 'stagger', False):
+        # spread retries of hosts that failed together at boot
+        wait = tenacity.wait_random_exponential(multiplier=1,
+                                                max=MAX_RETRY_WAIT)
+    else:
+        wait = tenacity.wait_fixed(1)
+
     @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
+        wait=wait,
         reraise=True,
         stop=(
             tenacity.stop_after_delay(args.retry) if args.retry > 0
@@ -284,9 +1966,64 @@ def _do_it_with_persistence(func, args, config):
             )
         )
     def _do_it():
-        client = _vault_client(config)
-        func(args, client, config)
-    _do_it()
+        client = _vault_client(config, adapter)
+        return func(args, client, config)
+    return _do_it()
+
+
+def _selects_devices(args):
+    """Whether any device selection filter was given"""
+    return any(
+        getattr(args, option, None) is not None
+        for option in ('match', 'min_size', 'max_size', 'rotational',
+                       'model')
+    )
+
+
+def _select_devices(args):
+    """Resolve the block devices to encrypt
+
+    Named devices and devices matching the selection filters are taken
+    from a single scan of the host. Named devices that are mounted, held
+    or read-only are rejected before any key is generated; only devices
+    found by the selection filters must also be blank.
+
+    :param: args: argparser generated cli arguments
+    :returns: list of block device paths
+    :raises exceptions.DeviceInUse: if a named device is in use
+    """
+    devices = discovery.scan()
+    named = []
+    for path in args.block_device:
+        try:
+            named.append(discovery.find(devices, path))
+        except ValueError:
+            # left for cryptsetup to accept or refuse
+            logger.debug('%s not found by the device scan', path)
+    rejected = {}
+    for device in named:
+        reasons = discovery.in_use(device, contents=False)
+        if reasons:
+            rejected[device['path']] = reasons
+    if rejected:
+        raise exceptions.DeviceInUse(rejected)
+
+    block_devices = list(args.block_device)
+    if _selects_devices(args):
+        seen = {device['path'] for device in named}
+        block_devices.extend(
+            device['path']
+            for device in discovery.select(
+                devices,
+                patterns=args.match,
+                min_size=args.min_size,
+                max_size=args.max_size,
+                rotational=args.rotational,
+                model=args.model,
+            )
+            if device['path'] not in seen
+        )
+    return block_devices
 
 
 def encrypt(args, config):
@@ -295,7 +2032,21 @@ def encrypt(args, config):
     :param: args: argparser generated cli arguments
     :param: config: configparser object of vaultlocker config
     """
-    _do_it_with_persistence(_encrypt_block_device, args, config)
+    block_devices = _select_devices(args)
+    if not block_devices:
+        raise ValueError('No unused block device matches the selection')
+    if args.uuid and len(block_devices) > 1:
+        raise ValueError('--uuid can only be used with a single device')
+    keys_args = copy.copy(args)
+    keys_args.block_device = block_devices
+    keys = _do_it_with_persistence(_generate_device_keys, keys_args, config)
+    for block_device, key in zip(block_devices, keys):
+        device_args = copy.copy(args)
+        device_args.block_device = [block_device]
+        with _device_locks(config, args.uuid, block_device):
+            _do_it_with_persistence(
+                functools.partial(_encrypt_block_device, key=key),
+                device_args, config)
 
 
 def decrypt(args, config):
@@ -304,25 +2055,266 @@ def decrypt(args, config):
     :param: args: argparser generated cli arguments
     :param: config: configparser object of vaultlocker config
     """
-    _do_it_with_persistence(_decrypt_block_device, args, config)
+    if args.defer and not _device_exists(args.uuid[0]):
+        detached = headers.lookup(args.uuid[0], _header_dir(config))
+        if not _device_present(args.uuid[0], detached):
+            # the by-uuid symlink may only be waiting for udev
+            dmcrypt.udevadm_settle(args.uuid[0])
+        if not _device_present(args.uuid[0], detached):
+            if detached:
+                # the data device carries no LUKS signature, so the udev
+                # rule will not start the unit again when it appears
+                raise exceptions.VaultlockerException(
+                    'Data device {} of {} has not appeared'.format(
+                        detached['device'], args.uuid[0])
+                )
+            logger.info('%s has not appeared; it will be unlocked when '
+                        'it does', args.uuid[0])
+            return
+    if args.stagger and not _device_exists(args.uuid[0]):
+        delay = _start_delay(config, args.priority)
+        if delay:
+            logger.info('Waiting %.1f seconds before unlocking %s',
+                        delay, args.uuid[0])
+            time.sleep(delay)
+    # the existence check of the device and its opening must not race
+    # with other processes unlocking the same device
+    with _device_locks(config, args.uuid[0]):
+        _do_it_with_persistence(_decrypt_block_device, args, config)
+
+
+def hotplug(args, config):
+    """Unlock a LUKS device that has just appeared
+
+    Run by a udev rule, so the unlock is only queued as a start job of
+    the device's decrypt unit; devices not encrypted by vaultlocker on
+    this host are ignored.
 
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    block_uuid = args.uuid[0]
+    if block_uuid not in systemd.enabled_instances(status.DECRYPT_UNIT):
+        logger.debug('%s is not registered with vaultlocker', block_uuid)
+        return
+    if _device_exists(block_uuid):
+        logger.info('%s is already open', block_uuid)
+        return
+    systemd.start(DECRYPT_UNIT.format(block_uuid), block=False)
 
-def get_config(config_path):
-    """Read vaultlocker configuration from config file
 
-    :param: config_path: path to the configuration file
-    :returns: configparser. Parsed configuration options
+def resume(args, config):
+    """Unfinished encryption resume handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_resume, args, config)
+
+
+def rotate(args, config):
+    """Key rotation handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_rotate, args, config)
+
+
+def rekey(args, config):
+    """Keyslot rotation handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_rekey, args, config)
+
+
+def header_backup(args, config):
+    """LUKS header backup handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_header_backup, args, config)
+
+
+def header_restore(args, config):
+    """LUKS header restore handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_header_restore, args, config)
+
+
+def export_keys(args, config):
+    """Bulk key export handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_export_keys, args, config)
+
+
+def import_keys(args, config):
+    """Bulk key import handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    payload = _unwrap_export(args, _vault_client(config))
+    _do_it_with_persistence(functools.partial(_import_keys, payload), args,
+                            config)
+
+
+def migrate_layout(args, config):
+    """Storage layout migration handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_migrate_layout, args, config)
+
+
+def audit_keys(args, config):
+    """Fleet-wide key audit handler
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
+    """
+    _do_it_with_persistence(_audit, args, config)
+
+
+def show_status(args, config):
+    """Key, device and unit status handler
+
+    The Vault listing is cached in args.cache for args.max_age seconds,
+    local state is scanned on every run.
+
+    :param: args: argparser generated cli arguments
+    :param: config: configparser object of vaultlocker config
     """
-    config = configparser.ConfigParser()
-    if os.path.exists(config_path):
-        config.read(config_path)
+    vault_uuids = None
+    if args.max_age > 0:
+        vault_uuids = status.read_cache(args.cache, args.max_age)
+    if vault_uuids is None:
+        vault_uuids = _do_it_with_persistence(_list_vault_uuids, args,
+                                              config)
+        if args.max_age > 0:
+            status.write_cache(args.cache, vault_uuids)
+
+    index = status.local_index(vault_uuids, _header_dir(config))
+    if args.format == 'json':
+        output = json.dumps({
+            'hostname': get_hostname(config),
+            'devices': index,
+        })
     else:
-        raise FileNotFoundError(
-            "Configuration file not found: {}".format(config_path)
-        )
+        output = status.format_table(index)
+    print(output)
+
+
+def _validate_config(config):
+    """Check every option of a vaultlocker configuration.
+
+    :param config: parsed vaultlocker configuration
+    :returns: list of error messages, empty if the config is valid
+    """
+    errors = []
+    for option in ('url', 'backend'):
+        if not config.get('vault', option, fallback=None):
+            errors.append(
+                "Missing option '{}' in section [vault]".format(option)
+            )
+    for option in ('ca_bundle', 'client_cert', 'client_key', 'token_file',
+                   'jwt_file'):
+        path = config.get('vault', option, fallback=None)
+        if path and not os.path.exists(path):
+            errors.append("{} '{}' does not exist".format(option, path))
+    checks = (
+        _vault_auth,
+        _get_kv_version,
+        _get_layout,
+        _get_key_wrapping,
+        _get_key_size,
+        _get_key_source,
+        _get_timeout,
+        _get_preload_tls,
+        _get_lock_timeout,
+        _get_cryptsetup_slots,
+        _governor,
+        _get_tracing,
+        lambda config: _get_delay(config, 'boot_jitter'),
+        lambda config: _get_delay(config, 'priority_delay'),
+    )
+    for check in checks:
+        try:
+            check(config)
+        except ValueError as error:
+            if str(error) not in errors:
+                errors.append(str(error))
+    return errors
+
+
+def get_config(config_path, cache_path=None):
+    """Read and validate vaultlocker configuration from config file
+
+    Values derived from the environment, such as the hostname, are
+    resolved once here.  With a cache path the validated configuration
+    is reused by later processes for as long as the file is unchanged.
+
+    :param: config_path: path to the configuration file
+    :param: cache_path: optional path of the validated config cache
+    :returns: conf.Config. Immutable configuration options
+    :raises exceptions.ConfigError: listing every invalid option
+    """
+    if cache_path:
+        config = conf.read_cache(cache_path, config_path)
+        if config is not None:
+            return config
+    config = conf.read(config_path)
+    errors = _validate_config(config)
+    try:
+        hostname = get_hostname(config)
+    except RuntimeError as hostname_error:
+        errors.append(str(hostname_error))
+    if errors:
+        raise exceptions.ConfigError(config_path, errors)
+    config = config.replace(
+        DEFAULT={'hostname': hostname},
+        vault={'kv_version': _get_kv_version(config)},
+    )
+    if cache_path:
+        try:
+            conf.write_cache(cache_path, config_path, config)
+        except OSError as cache_error:
+            logger.warning('Unable to cache configuration at %s: %s',
+                           cache_path, cache_error)
     return config
 
 
+def _traced_uuids(args):
+    """UUIDs named on the command line, as a span attribute"""
+    block_uuids = getattr(args, 'uuid', None)
+    if isinstance(block_uuids, str):
+        return block_uuids
+    return ','.join(block_uuids) if block_uuids else None
+
+
+def _bare_option_argv(argv):
+    """Give a bare --profile or --config-cache its default value.
+
+    Both options take their path as --option=PATH only, so that a bare
+    option does not swallow the subcommand.
+    """
+    bare = {
+        '--profile': '--profile=',
+        '--config-cache': '--config-cache=' + DEFAULT_CONFIG_CACHE,
+    }
+    return [bare.get(arg, arg) for arg in argv]
+
+
 def main():
     parser = argparse.ArgumentParser('vaultlocker')
     parser.set_defaults(prog=parser.prog)
@@ -343,6 +2335,33 @@ def main():
         type=str,
         help="Path to vaultlocker configuration file"
     )
+    parser.add_argument(
+        '--config-cache',
+        metavar='PATH',
+        help="Reuse the validated configuration cached at PATH; "
+             "--config-cache=PATH, or a bare --config-cache for "
+             "{}".format(DEFAULT_CONFIG_CACHE)
+    )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help="Report time spent queueing for and waiting on Vault"
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='PATH',
+        help="Profile the subcommand; --profile=PATH writes the profile "
+             "to PATH, a bare --profile to vaultlocker-<pid>.<format> in "
+             "the current directory"
+    )
+    parser.add_argument(
+        '--profile-format',
+        choices=profiling.FORMATS,
+        default=profiling.FORMAT_PSTATS,
+        help="pstats for a deterministic profile, or collapsed for "
+             "sampled stacks of all threads as read by flamegraph.pl "
+             "(default: %(default)s)"
+    )
 
     encrypt_parser = subparsers.add_parser(
         'encrypt',
@@ -352,8 +2371,42 @@ def main():
                                 dest="uuid",
                                 help="UUID to use to reference encryption key")
     encrypt_parser.add_argument('block_device',
-                                metavar='BLOCK_DEVICE', nargs=1,
+                                metavar='BLOCK_DEVICE', nargs='*',
                                 help="Full path to block device to encrypt")
+    select_group = encrypt_parser.add_argument_group(
+        'device selection',
+        'Also encrypt every unused disk or partition matching all of '
+        'these filters'
+    )
+    select_group.add_argument('--match',
+                              metavar='GLOB', action='append',
+                              help="Device path or udev symlink glob, e.g. "
+                                   "'/dev/disk/by-id/nvme-*' (repeatable)")
+    select_group.add_argument('--min-size',
+                              metavar='SIZE', type=discovery.parse_size,
+                              help="Smallest device size, e.g. 100G")
+    select_group.add_argument('--max-size',
+                              metavar='SIZE', type=discovery.parse_size,
+                              help="Largest device size, e.g. 4T")
+    select_group.add_argument('--rotational',
+                              action=argparse.BooleanOptionalAction,
+                              help="Only spinning (or with --no-rotational "
+                                   "only solid-state) disks")
+    select_group.add_argument('--model',
+                              metavar='GLOB',
+                              help="Device model glob")
+    encrypt_parser.add_argument('--detached-header',
+                                action='store_true',
+                                help="Keep the LUKS header in header_dir "
+                                     "instead of on the device")
+    encrypt_parser.add_argument('--backup-header',
+                                action='store_true',
+                                help="Also store the detached header in "
+                                     "Vault")
+    encrypt_parser.add_argument('--priority',
+                                choices=PRIORITIES,
+                                help="Boot unlock priority of the device "
+                                     "(default: {})".format(DEFAULT_PRIORITY))
     encrypt_parser.set_defaults(func=encrypt)
 
     decrypt_parser = subparsers.add_parser(
@@ -363,17 +2416,272 @@ def main():
     decrypt_parser.add_argument('uuid',
                                 metavar='uuid', nargs=1,
                                 help='UUID of block device to decrypt')
+    decrypt_parser.add_argument('--priority',
+                                choices=PRIORITIES,
+                                default=DEFAULT_PRIORITY,
+                                help="Boot unlock priority of the device")
+    decrypt_parser.add_argument('--stagger',
+                                action='store_true',
+                                help="Delay the unlock by the boot jitter "
+                                     "and priority delay of the host and "
+                                     "back off randomly between retries")
+    decrypt_parser.add_argument('--defer',
+                                action='store_true',
+                                help="Succeed without unlocking if the "
+                                     "device has not appeared yet; the "
+                                     "udev rule unlocks it when it does")
     decrypt_parser.set_defaults(func=decrypt)
 
-    args = parser.parse_args()
+    hotplug_parser = subparsers.add_parser(
+        'hotplug',
+        help='Queue the unlock of a LUKS device that has appeared, from '
+             'a udev rule'
+    )
+    hotplug_parser.add_argument('uuid',
+                                metavar='uuid', nargs=1,
+                                help='UUID of the LUKS device')
+    hotplug_parser.set_defaults(func=hotplug)
+
+    resume_parser = subparsers.add_parser(
+        'resume',
+        help='Complete or roll back encryptions interrupted by a crash'
+    )
+    resume_parser.add_argument('--rollback',
+                               action='store_true',
+                               help="Roll back every unfinished encryption "
+                                    "instead of completing it")
+    resume_parser.set_defaults(func=resume)
+
+    rotate_parser = subparsers.add_parser(
+        'rotate',
+        help='Rotate device keys with online LUKS2 reencryption'
+    )
+    rotate_parser.add_argument('uuid',
+                               metavar='uuid', nargs='*',
+                               help="UUIDs of the devices to rotate "
+                                    "(default: all devices of the host)")
+    rotate_parser.add_argument('--parallel',
+                               type=int,
+                               default=1,
+                               help="Devices reencrypted at once on the "
+                                    "host (default: 1)")
+    rotate_parser.add_argument('--resilience',
+                               choices=RESILIENCE_MODES,
+                               help="cryptsetup reencryption resilience "
+                                    "mode")
+    rotate_parser.add_argument('--hotzone-size',
+                               help="Size of the area reencrypted at once, "
+                                    "e.g. 4M; smaller values lower the IO "
+                                    "burst")
+    rotate_parser.add_argument('--ionice',
+                               action=argparse.BooleanOptionalAction,
+                               default=True,
+                               help="Reencrypt in the idle IO scheduling "
+                                    "class (default: on)")
+    rotate_parser.set_defaults(func=rotate)
+
+    rekey_parser = subparsers.add_parser(
+        'rekey',
+        help='Replace device keyslots with new keys, without reencryption'
+    )
+    rekey_parser.add_argument('uuid',
+                              metavar='uuid', nargs='*',
+                              help="UUIDs of the devices to rekey "
+                                   "(default: all devices of the host)")
+    rekey_parser.add_argument('--parallel',
+                              type=int,
+                              default=DEFAULT_WORKERS,
+                              help="Devices rekeyed at once (default: "
+                                   "{})".format(DEFAULT_WORKERS))
+    rekey_parser.set_defaults(func=rekey)
+
+    header_parser = subparsers.add_parser(
+        'header',
+        help='Back up or restore LUKS headers through Vault'
+    )
+    header_subparsers = header_parser.add_subparsers(
+        title="header subcommands",
+        description="valid header subcommands",
+    )
+    header_backup_parser = header_subparsers.add_parser(
+        'backup',
+        help='Store compressed LUKS header backups in Vault'
+    )
+    header_backup_parser.add_argument('uuid',
+                                      metavar='uuid', nargs='*',
+                                      help="UUIDs of the devices to back up "
+                                           "(default: all devices of the "
+                                           "host)")
+    header_backup_parser.add_argument('--parallel',
+                                      type=int,
+                                      default=DEFAULT_WORKERS,
+                                      help="Devices backed up at once "
+                                           "(default: {})".format(
+                                               DEFAULT_WORKERS))
+    header_backup_parser.set_defaults(func=header_backup)
+    header_restore_parser = header_subparsers.add_parser(
+        'restore',
+        help='Restore damaged LUKS headers from their Vault backups'
+    )
+    header_restore_parser.add_argument('uuid',
+                                       metavar='uuid', nargs='*',
+                                       help="UUIDs of the devices to "
+                                            "restore (default: all backups "
+                                            "of the host)")
+    header_restore_parser.add_argument('--device',
+                                       help="Device to restore to, instead "
+                                            "of the one recorded in the "
+                                            "backup")
+    header_restore_parser.add_argument('--force',
+                                       action='store_true',
+                                       help="Also overwrite headers that "
+                                            "look intact or belong to "
+                                            "another device")
+    header_restore_parser.add_argument('--parallel',
+                                       type=int,
+                                       default=DEFAULT_WORKERS,
+                                       help="Devices restored at once "
+                                            "(default: {})".format(
+                                                DEFAULT_WORKERS))
+    header_restore_parser.set_defaults(func=header_restore)
+
+    keys_parser = subparsers.add_parser(
+        'keys',
+        help='Bulk export or import of all keys stored for this host'
+    )
+    keys_subparsers = keys_parser.add_subparsers(
+        title="keys subcommands",
+        description="valid keys subcommands",
+    )
+    export_parser = keys_subparsers.add_parser(
+        'export',
+        help='Export all keys for this host as a response-wrapped token'
+    )
+    export_parser.add_argument('--output',
+                               default='-',
+                               help="File to write the wrapping token to")
+    export_parser.add_argument('--wrap-ttl',
+                               default=DEFAULT_WRAP_TTL,
+                               help="TTL of the wrapping token")
+    export_parser.add_argument('--workers',
+                               default=DEFAULT_WORKERS,
+                               type=int,
+                               help="Number of concurrent Vault requests")
+    export_parser.set_defaults(func=export_keys)
+    import_parser = keys_subparsers.add_parser(
+        'import',
+        help='Import keys from a wrapping token created by keys export'
+    )
+    import_parser.add_argument('--input',
+                               default='-',
+                               help="File to read the wrapping token from")
+    import_parser.add_argument('--workers',
+                               default=DEFAULT_WORKERS,
+                               type=int,
+                               help="Number of concurrent Vault requests")
+    import_parser.add_argument('--force',
+                               action='store_true',
+                               help="Replace keys already stored for the "
+                                    "same UUIDs")
+    import_parser.set_defaults(func=import_keys)
+
+    migrate_parser = subparsers.add_parser(
+        'migrate',
+        help='Move per-device keys of this host into one host key document'
+    )
+    migrate_parser.add_argument('--prune',
+                                action='store_true',
+                                help="Delete the per-device keys once "
+                                     "the host key document is verified")
+    migrate_parser.add_argument('--workers',
+                                default=DEFAULT_WORKERS,
+                                type=int,
+                                help="Number of concurrent Vault requests")
+    migrate_parser.set_defaults(func=migrate_layout)
+
+    status_parser = subparsers.add_parser(
+        'status',
+        help='Report keys, devices, mappings and units of this host'
+    )
+    status_parser.add_argument('--format',
+                               choices=('table', 'json'),
+                               default='table',
+                               help="Output format")
+    status_parser.add_argument('--cache',
+                               default=DEFAULT_STATUS_CACHE,
+                               help="File caching the Vault key listing")
+    status_parser.add_argument('--max-age',
+                               default=0,
+                               type=int,
+                               help="Seconds to reuse the cached Vault "
+                                    "key listing; 0 disables the cache")
+    status_parser.set_defaults(func=show_status)
+
+    audit_parser = subparsers.add_parser(
+        'audit',
+        help='Audit the keys of every host in the Vault mount'
+    )
+    audit_parser.add_argument('--inventory',
+                              help="JSON file mapping hostnames to the "
+                                   "UUIDs registered for them")
+    audit_parser.add_argument('--output',
+                              default='-',
+                              help="File to stream NDJSON results to")
+    audit_parser.add_argument('--checkpoint',
+                              help="File recording audit progress")
+    audit_parser.add_argument('--resume',
+                              action='store_true',
+                              help="Continue after the host recorded in "
+                                   "the checkpoint")
+    audit_parser.add_argument('--workers',
+                              default=16,
+                              type=int,
+                              help="Number of concurrent Vault requests")
+    audit_parser.add_argument('--page-size',
+                              default=100,
+                              type=int,
+                              help="Number of hosts per checkpointed page")
+    audit_parser.add_argument('--rate',
+                              default=0,
+                              type=float,
+                              help="Maximum Vault requests per second; "
+                                   "0 for no limit")
+    audit_parser.set_defaults(func=audit_keys)
+
+    args = parser.parse_args(_bare_option_argv(sys.argv[1:]))
+    if (getattr(args, 'func', None) is encrypt and not args.block_device and
+            not _selects_devices(args)):
+        encrypt_parser.error('a block device or a selection filter is '
+                             'required')
+    if (getattr(args, 'func', None) is encrypt and args.backup_header and
+            not args.detached_header):
+        encrypt_parser.error('--backup-header requires --detached-header')
 
     logging.basicConfig(level=logging.DEBUG)
 
     try:
-        if (len(vars(args)) <= 2):
+        if not hasattr(args, 'func'):
             parser.print_help()
         else:
-            args.func(args, get_config())
+            with contextlib.ExitStack() as stack:
+                if args.profile is not None:
+                    stack.enter_context(profiling.profile(
+                        (args.profile or
+                         profiling.default_path(args.profile_format)),
+                        args.profile_format,
+                    ))
+                config = get_config(args.config, args.config_cache)
+                exporter = _get_tracing(config)
+                if exporter:
+                    tracing.configure(*exporter, attributes={
+                        'host.name': get_hostname(config),
+                    })
+                with tracing.span(
+                    'vaultlocker.{}'.format(args.func.__name__),
+                    **{'vaultlocker.uuid': _traced_uuids(args)}
+                ):
+                    logger.debug('Trace ID %s', tracing.trace_id())
+                    args.func(args, config)
     except Exception as e:
         raise SystemExit(
             '{prog}: {msg}'.format(
@@ -381,3 +2689,7 @@ def main():
                 msg=e,
             )
         )
+    finally:
+        tracing.shutdown()
+        if args.timings:
+            timing.TIMINGS.report(sys.stderr)
@@ -0,0 +1,173 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+from vaultlocker import headers
+from vaultlocker import systemd
+
+logger = logging.getLogger(__name__)
+
+DEV_MAPPER = '/dev/mapper'
+BY_UUID = '/dev/disk/by-uuid'
+MAPPING_PREFIX = 'crypt-'
+DECRYPT_UNIT = 'vaultlocker-decrypt@'
+
+PROBLEM_NO_KEY = 'no-key'
+PROBLEM_NO_DEVICE = 'no-device'
+PROBLEM_NOT_OPEN = 'not-open'
+PROBLEM_UNIT_DISABLED = 'unit-disabled'
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+
+def open_mappings():
+    """Return the UUIDs of open vaultlocker dm-crypt mappings
+
+    :returns: set of device UUIDs
+    """
+    return {
+        name[len(MAPPING_PREFIX):]
+        for name in _listdir(DEV_MAPPER)
+        if name.startswith(MAPPING_PREFIX)
+    }
+
+
+def present_devices():
+    """Return the UUIDs of block devices present on this host
+
+    :returns: set of UUIDs with a /dev/disk/by-uuid symlink
+    """
+    return set(_listdir(BY_UUID))
+
+
+def build_index(vault_uuids, opened, present, enabled):
+    """Join the key, device, mapping and unit state of a host
+
+    :param: vault_uuids: UUIDs with a key stored in Vault
+    :param: opened: UUIDs with an open dm-crypt mapping
+    :param: present: UUIDs with a by-uuid device symlink
+    :param: enabled: UUIDs with an enabled decrypt unit
+    :returns: list of dicts, one per UUID, sorted by UUID
+    """
+    index = []
+    for block_uuid in sorted(set(vault_uuids) | opened | enabled):
+        entry = {
+            'uuid': block_uuid,
+            'key': block_uuid in vault_uuids,
+            'device': block_uuid in present,
+            'open': block_uuid in opened,
+            'unit': block_uuid in enabled,
+            'problems': [],
+        }
+        if not entry['key']:
+            entry['problems'].append(PROBLEM_NO_KEY)
+        if not entry['device'] and not entry['open']:
+            entry['problems'].append(PROBLEM_NO_DEVICE)
+        elif not entry['open']:
+            entry['problems'].append(PROBLEM_NOT_OPEN)
+        if entry['key'] and not entry['unit']:
+            entry['problems'].append(PROBLEM_UNIT_DISABLED)
+        index.append(entry)
+    return index
+
+
+def local_index(vault_uuids, header_dir=headers.HEADER_DIR):
+    """Build the status index of this host against a set of Vault keys
+
+    The local state is read with one directory scan each of the
+    device-mapper nodes, the by-uuid symlinks, the detached headers and
+    the systemd wants directories.
+
+    :param: vault_uuids: UUIDs with a key stored in Vault
+    :param: header_dir: directory of detached LUKS headers
+    :returns: list of dicts, one per UUID
+    """
+    return build_index(
+        set(vault_uuids),
+        open_mappings(),
+        present_devices() | headers.present_devices(header_dir),
+        systemd.enabled_instances(DECRYPT_UNIT),
+    )
+
+
+def read_cache(path, max_age):
+    """Return cached Vault UUIDs if the cache is younger than max_age
+
+    :param: path: cache file
+    :param: max_age: maximum age of the cache in seconds
+    :returns: list of UUIDs, or None if there is no usable cache
+    """
+    try:
+        with open(path) as cache:
+            cached = json.load(cache)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get('timestamp', 0) > max_age:
+        return None
+    return cached['vault_uuids']
+
+
+def write_cache(path, vault_uuids):
+    """Atomically replace the cache of Vault UUIDs
+
+    :param: path: cache file
+    :param: vault_uuids: UUIDs with a key stored in Vault
+    """
+    cache_dir = os.path.dirname(path) or '.'
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.status-cache-')
+    try:
+        with os.fdopen(fd, 'w') as cache:
+            json.dump({'timestamp': time.time(),
+                       'vault_uuids': sorted(vault_uuids)}, cache)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def format_table(index):
+    """Render a status index as a text table
+
+    :param: index: list of dicts as returned by build_index
+    :returns: str
+    """
+    def _flag(value):
+        return 'yes' if value else 'no'
+
+    rows = [('UUID', 'KEY', 'DEVICE', 'OPEN', 'UNIT', 'PROBLEMS')]
+    for entry in index:
+        rows.append((
+            entry['uuid'],
+            _flag(entry['key']),
+            _flag(entry['device']),
+            _flag(entry['open']),
+            _flag(entry['unit']),
+            ','.join(entry['problems']) or 'ok',
+        ))
+    widths = [max(len(row[column]) for row in rows)
+              for column in range(len(rows[0]))]
+    return '\n'.join(
+        '  '.join(value.ljust(width)
+                  for value, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
@@ -12,11 +12,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import glob
 import logging
+import os
 import subprocess
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_UNIT_DIR = '/etc/systemd/system'
+
 
 def enable(service_name):
     """Enable a systemd unit
@@ -26,3 +30,54 @@ def enable(service_name):
     logging.info('Enabling systemd unit for {}'.format(service_name))
     cmd = ['systemctl', 'enable', service_name]
     subprocess.check_call(cmd)
+
+
+def start(service_name, block=True):
+    """Start a systemd unit
+
+    :param: service_name: Name of the service to start.
+    :param: block: wait for the start job to finish; udev rules must
+                   not, as the unit may wait for udev itself.
+    """
+    logging.info('Starting systemd unit {}'.format(service_name))
+    cmd = ['systemctl', 'start', service_name]
+    if not block:
+        cmd.insert(2, '--no-block')
+    subprocess.check_call(cmd)
+
+
+def enabled_instances(template):
+    """Return the instances of a template unit that are enabled
+
+    Reads the wants directories of the system unit directory instead
+    of calling systemctl once per unit.
+
+    :param: template: unit name prefix up to and including the '@'.
+    :returns: set of instance names
+    """
+    pattern = os.path.join(SYSTEM_UNIT_DIR, '*.wants',
+                           '{}*.service'.format(template))
+    return {
+        os.path.basename(path)[len(template):-len('.service')]
+        for path in glob.glob(pattern)
+    }
+
+
+def set_environment(service_name, environment):
+    """Set environment variables of a unit through a drop-in file
+
+    :param: service_name: Name of the service, e.g. an instance of a
+                          template unit.
+    :param: environment: dict of variable names and values.
+    """
+    dropin_dir = os.path.join(SYSTEM_UNIT_DIR,
+                              '{}.d'.format(service_name))
+    os.makedirs(dropin_dir, exist_ok=True)
+    lines = ['[Service]']
+    lines.extend(
+        'Environment={}={}'.format(name, value)
+        for name, value in sorted(environment.items())
+    )
+    with open(os.path.join(dropin_dir, 'vaultlocker.conf'), 'w') as dropin:
+        dropin.write('\n'.join(lines) + '\n')
+    subprocess.check_call(['systemctl', 'daemon-reload'])
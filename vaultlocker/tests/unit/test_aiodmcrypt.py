@@ -0,0 +1,173 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_aiodmcrypt
+----------------------------------
+
+Tests for `aiodmcrypt` module.
+"""
+
+import asyncio
+import subprocess
+import sys
+import time
+from unittest import mock
+
+from vaultlocker import aiodmcrypt
+from vaultlocker.tests.unit import base
+
+IGNORE_TERM = [
+    sys.executable, '-c',
+    'import signal, time\n'
+    'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+    'print("ready", flush=True)\n'
+    'time.sleep(30)\n',
+]
+
+
+class TestRun(base.TestCase):
+
+    def test_output(self):
+        self.assertEqual(b'out\n', asyncio.run(
+            aiodmcrypt.run(['sh', '-c', 'echo out; echo err >&2'])))
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as error:
+            asyncio.run(aiodmcrypt.run(
+                ['sh', '-c', 'echo out; echo No key available >&2; '
+                             'exit 2']))
+
+        self.assertEqual(2, error.exception.returncode)
+        self.assertEqual(b'out\n', error.exception.output)
+        self.assertEqual(b'No key available\n', error.exception.stderr)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired) as error:
+            asyncio.run(aiodmcrypt.run(['sleep', '30'], timeout=0.1))
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(['sleep', '30'], error.exception.cmd)
+
+    @mock.patch.object(aiodmcrypt, 'GRACE_PERIOD', 0.1)
+    def test_timeout_kills_after_grace_period(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired) as error:
+            asyncio.run(aiodmcrypt.run(IGNORE_TERM, timeout=1))
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(b'ready\n', error.exception.output)
+
+    def test_cancel(self):
+        processes = []
+        create = asyncio.create_subprocess_exec
+
+        async def _create(*args, **kwargs):
+            process = await create(*args, **kwargs)
+            processes.append(process)
+            return process
+
+        async def _cancel():
+            task = asyncio.ensure_future(aiodmcrypt.run(['sleep', '30']))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await task
+
+        with mock.patch.object(aiodmcrypt.asyncio,
+                               'create_subprocess_exec', _create):
+            self.assertRaises(asyncio.CancelledError, asyncio.run,
+                              _cancel())
+        # the child is reaped before the cancellation propagates
+        self.assertIsNotNone(processes[0].returncode)
+
+    def test_concurrent(self):
+        async def _run_all():
+            return await asyncio.gather(*(
+                aiodmcrypt.run(['sh', '-c', 'sleep 0.2; echo {}'.format(n)])
+                for n in range(20)
+            ))
+
+        start = time.monotonic()
+        outputs = asyncio.run(_run_all())
+
+        self.assertEqual([b'%d\n' % n for n in range(20)], outputs)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class TestAioDMCrypt(base.TestCase):
+
+    def _capture_run(self):
+        """Record the commands run and the keys cryptsetup would read"""
+        calls, keys = [], []
+
+        async def _run(command, timeout=None, pass_fds=()):
+            calls.append((command, timeout, pass_fds))
+            if '--key-file' in command:
+                path = command[command.index('--key-file') + 1]
+                self.assertEqual(
+                    '/proc/self/fd/{}'.format(pass_fds[0]), path)
+                with open(path, 'rb') as key_file:
+                    keys.append(key_file.read())
+            return b''
+
+        patcher = mock.patch.object(aiodmcrypt, 'run', _run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls, keys
+
+    def test_luks_format(self):
+        calls, keys = self._capture_run()
+
+        asyncio.run(aiodmcrypt.luks_format('mykey', '/dev/sdb', 'test-uuid',
+                                           timeout=60))
+
+        self.assertEqual(
+            [(['cryptsetup', '--batch-mode', '--uuid', 'test-uuid',
+               '--key-file', mock.ANY, 'luksFormat', '/dev/sdb'],
+              60, mock.ANY)],
+            calls,
+        )
+        self.assertEqual([b'mykey'], keys)
+
+    def test_luks_open(self):
+        calls, keys = self._capture_run()
+
+        handle = asyncio.run(aiodmcrypt.luks_open(
+            'mykey', 'test-uuid', header='/headers/test-uuid.luks',
+            device='/dev/disk/by-id/wwn-1'))
+
+        self.assertEqual('crypt-test-uuid', handle)
+        self.assertEqual(
+            [(['cryptsetup', '--batch-mode', '--key-file', mock.ANY,
+               '--header', '/headers/test-uuid.luks', 'open',
+               '/dev/disk/by-id/wwn-1', 'crypt-test-uuid',
+               '--type', 'luks'], None, mock.ANY)],
+            calls,
+        )
+        self.assertEqual([b'mykey'], keys)
+
+    def test_udevadm(self):
+        calls, _ = self._capture_run()
+
+        async def _both():
+            await aiodmcrypt.udevadm_rescan('/dev/sdb')
+            await aiodmcrypt.udevadm_settle('test-uuid', timeout=30)
+
+        asyncio.run(_both())
+
+        self.assertEqual([
+            (['udevadm', 'trigger', '--name-match=/dev/sdb',
+              '--action=add'], None, ()),
+            (['udevadm', 'settle',
+              '--exit-if-exists=/dev/disk/by-uuid/test-uuid'], 30, ()),
+        ], calls)
@@ -0,0 +1,156 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_audit
+----------------------------------
+
+Tests for `vaultlocker.audit` module.
+"""
+
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+import hvac
+
+from vaultlocker import audit
+from vaultlocker.tests.unit import base
+
+KEY = 'a2V5'
+
+
+class FakeStore(object):
+    """In-memory stand-in for a KV store holding nested paths"""
+
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.reads = []
+
+    def read(self, path):
+        self.reads.append(path)
+        if path not in self.secrets:
+            raise hvac.exceptions.InvalidPath(path)
+        if isinstance(self.secrets[path], Exception):
+            raise self.secrets[path]
+        return self.secrets[path]
+
+    def list(self, path):
+        prefix = '{}/'.format(path) if path else ''
+        entries = set()
+        for secret_path in self.secrets:
+            if secret_path.startswith(prefix):
+                rest = secret_path[len(prefix):]
+                if '/' in rest:
+                    entries.add(rest.split('/', 1)[0] + '/')
+                else:
+                    entries.add(rest)
+        if not entries:
+            raise hvac.exceptions.InvalidPath(path)
+        return sorted(entries)
+
+
+class TestAuditor(base.TestCase):
+
+    def setUp(self):
+        super(TestAuditor, self).setUp()
+        self.store = FakeStore({
+            'host-a/uuid-1': {'dmcrypt_key': KEY},
+            'host-a/uuid-2': {'dmcrypt_key': 'not base64!'},
+            'host-a/headers/uuid-1/manifest': {'chunks': 1},
+            'host-b': {'format': 1, 'keys': {
+                'uuid-3': {'wrapped_key': 'vault:v1:abc'},
+            }},
+            'host-c/uuid-4': hvac.exceptions.Forbidden('denied'),
+        })
+
+    def test_valid_record(self):
+        self.assertTrue(audit.valid_record({'dmcrypt_key': KEY}))
+        self.assertTrue(audit.valid_record({'wrapped_key': 'vault:v1:x'}))
+        self.assertFalse(audit.valid_record({'dmcrypt_key': ''}))
+        self.assertFalse(audit.valid_record({'wrapped_key': 'plain'}))
+        self.assertFalse(audit.valid_record({}))
+        self.assertFalse(audit.valid_record(None))
+
+    def test_audit(self):
+        output = io.StringIO()
+
+        counts = audit.Auditor(self.store, workers=4).audit(output)
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertIn('denied', results[-1].pop('error'))
+        self.assertEqual(
+            [
+                {'host': 'host-a', 'uuid': 'uuid-1', 'status': 'ok'},
+                {'host': 'host-a', 'uuid': 'uuid-2', 'status': 'invalid'},
+                {'host': 'host-b', 'uuid': 'uuid-3', 'status': 'ok'},
+                {'host': 'host-c', 'uuid': 'uuid-4', 'status': 'error'},
+            ],
+            results,
+        )
+        self.assertEqual({'ok': 2, 'invalid': 1, 'error': 1}, counts)
+
+    def test_audit_inventory(self):
+        output = io.StringIO()
+        auditor = audit.Auditor(
+            self.store,
+            inventory={
+                'host-a': ['uuid-1', 'uuid-9'],
+                'host-b': [],
+                'host-d': ['uuid-5'],
+            },
+        )
+
+        counts = auditor.audit(output)
+
+        results = {
+            (result['host'], result['uuid']): result['status']
+            for result in map(json.loads, output.getvalue().splitlines())
+        }
+        self.assertEqual('ok', results[('host-a', 'uuid-1')])
+        self.assertEqual('missing', results[('host-a', 'uuid-9')])
+        self.assertEqual('unregistered', results[('host-b', 'uuid-3')])
+        self.assertEqual('missing', results[('host-d', 'uuid-5')])
+        self.assertEqual(2, counts['missing'])
+
+    def test_audit_checkpoint_and_resume(self):
+        with tempfile.TemporaryDirectory() as root:
+            checkpoint = os.path.join(root, 'audit.checkpoint')
+            auditor = audit.Auditor(self.store, page_size=2)
+
+            auditor.audit(io.StringIO(), checkpoint=checkpoint)
+            self.assertEqual('host-c', audit.read_checkpoint(checkpoint))
+
+            audit.write_checkpoint(checkpoint, 'host-a')
+            output = io.StringIO()
+            auditor.audit(output,
+                          start_after=audit.read_checkpoint(checkpoint))
+
+        self.assertEqual(
+            ['host-b', 'host-c'],
+            [json.loads(line)['host']
+             for line in output.getvalue().splitlines()],
+        )
+
+    def test_read_checkpoint_missing(self):
+        self.assertIsNone(audit.read_checkpoint('/nonexistent/checkpoint'))
+
+    def test_requests_are_rate_limited(self):
+        limiter = mock.MagicMock()
+
+        audit.Auditor(self.store, limiter=limiter).audit(io.StringIO())
+
+        # one root listing, a read and a listing per host and one read
+        # per device entry
+        self.assertEqual(1 + 2 * 3 + 3, limiter.acquire.call_count)
@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_conf
+----------------------------------
+
+Tests for `vaultlocker.conf` module.
+"""
+
+import configparser
+import os
+import stat
+import tempfile
+import threading
+
+from vaultlocker import conf
+from vaultlocker.tests.unit import base
+
+CONFIG = """
+[DEFAULT]
+hostname = host-1
+key_size = 512
+
+[vault]
+url = https://vault.test.com
+backend = secret
+key_size = 1024
+"""
+
+
+class TestConfig(base.TestCase):
+
+    def setUp(self):
+        super(TestConfig, self).setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = os.path.join(self.root.name, 'vaultlocker.conf')
+        with open(self.path, 'w') as config_file:
+            config_file.write(CONFIG)
+
+    def test_read(self):
+        config = conf.read(self.path)
+
+        self.assertEqual('https://vault.test.com',
+                         config.get('vault', 'url'))
+        self.assertEqual('host-1', config.get('vault', 'hostname'))
+        self.assertEqual('1024', config.get('vault', 'key_size'))
+        self.assertEqual('512', config.get('DEFAULT', 'key_size'))
+        self.assertEqual(['vault'], config.sections())
+
+    def test_read_missing(self):
+        self.assertRaises(FileNotFoundError, conf.read,
+                          os.path.join(self.root.name, 'missing.conf'))
+
+    def test_get_missing(self):
+        config = conf.read(self.path)
+
+        self.assertIsNone(config.get('vault', 'ca_bundle', fallback=None))
+        self.assertIsNone(config.get('other', 'url', fallback=None))
+        self.assertRaises(configparser.NoOptionError,
+                          config.get, 'vault', 'ca_bundle')
+        self.assertRaises(configparser.NoSectionError,
+                          config.get, 'other', 'url')
+
+    def test_immutable(self):
+        config = conf.read(self.path)
+
+        replaced = config.replace(DEFAULT={'hostname': 'host-2'},
+                                  vault={'kv_version': '2'})
+
+        self.assertEqual('host-1', config.get('vault', 'hostname'))
+        self.assertEqual('host-2', replaced.get('vault', 'hostname'))
+        self.assertEqual('2', replaced.get('vault', 'kv_version'))
+        with self.assertRaises(TypeError):
+            config._sections['vault']['url'] = 'x'
+
+    def test_cache_round_trip(self):
+        cache_path = os.path.join(self.root.name, 'run', 'config.json')
+        config = conf.read(self.path)
+
+        conf.write_cache(cache_path, self.path, config)
+
+        self.assertEqual(config, conf.read_cache(cache_path, self.path))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(cache_path).st_mode))
+
+    def test_cache_concurrent_writers(self):
+        cache_dir = os.path.join(self.root.name, 'run')
+        cache_path = os.path.join(cache_dir, 'config.json')
+        config = conf.read(self.path)
+
+        writers = [
+            threading.Thread(target=conf.write_cache,
+                             args=(cache_path, self.path, config))
+            for _ in range(8)
+        ]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        self.assertEqual(config, conf.read_cache(cache_path, self.path))
+        self.assertEqual(['config.json'], os.listdir(cache_dir))
+
+    def test_cache_stale(self):
+        cache_path = os.path.join(self.root.name, 'config.json')
+        conf.write_cache(cache_path, self.path, conf.read(self.path))
+
+        with open(self.path, 'a') as config_file:
+            config_file.write('ca_bundle = /etc/ssl/vault.pem\n')
+
+        self.assertIsNone(conf.read_cache(cache_path, self.path))
+
+    def test_cache_missing(self):
+        self.assertIsNone(conf.read_cache(
+            os.path.join(self.root.name, 'config.json'), self.path))
@@ -0,0 +1,161 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_discovery
+----------------------------------
+
+Tests for `vaultlocker.discovery` module.
+"""
+
+import os
+import tempfile
+
+from vaultlocker import discovery
+from vaultlocker.tests.unit import base
+
+
+class TestDiscovery(base.TestCase):
+
+    def setUp(self):
+        super(TestDiscovery, self).setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        self.devices = os.path.join(self.root, 'devices')
+        self.sys_dir = os.path.join(self.root, 'class', 'block')
+        self.udev_dir = os.path.join(self.root, 'udev')
+        self.mountinfo = os.path.join(self.root, 'mountinfo')
+        os.makedirs(self.sys_dir)
+        os.makedirs(self.udev_dir)
+        with open(self.mountinfo, 'w') as mountinfo:
+            mountinfo.write('22 1 8:1 / / rw,relatime - ext4 /dev/sda1 rw\n')
+
+        self._disk('sda', '8:0', sectors=1 << 21, rotational=True,
+                   model='HDD 1', udev=['E:ID_PART_TABLE_TYPE=gpt'])
+        self._partition('sda', 'sda1', '8:1', udev=['E:ID_FS_TYPE=ext4'])
+        self._disk('nvme0n1', '259:0', sectors=1 << 22, model='NVMe 1',
+                   udev=['S:disk/by-id/nvme-NVMe_1_S1'])
+        self._disk('nvme1n1', '259:1', sectors=1 << 22, model='NVMe 1',
+                   holders=['dm-0'], udev=['S:disk/by-id/nvme-NVMe_1_S2'])
+        self._disk('sdb', '8:16', sectors=1 << 23, rotational=True,
+                   model='HDD 2')
+        self._disk('loop0', '7:0', sectors=1 << 20, physical=False)
+
+    def _write(self, path, value):
+        with open(path, 'w') as attribute:
+            attribute.write('{}\n'.format(value))
+
+    def _device_dir(self, path, name, dev, sectors, holders, udev):
+        os.makedirs(os.path.join(path, 'holders'))
+        for holder in holders:
+            os.mkdir(os.path.join(path, 'holders', holder))
+        self._write(os.path.join(path, 'dev'), dev)
+        self._write(os.path.join(path, 'size'), sectors)
+        self._write(os.path.join(path, 'ro'), 0)
+        with open(os.path.join(self.udev_dir, 'b{}'.format(dev)),
+                  'w') as record:
+            record.write(''.join('{}\n'.format(line) for line in udev))
+        os.symlink(path, os.path.join(self.sys_dir, name))
+
+    def _disk(self, name, dev, sectors, rotational=False, model='',
+              holders=(), udev=(), physical=True):
+        path = os.path.join(self.devices, name)
+        os.makedirs(os.path.join(path, 'queue'))
+        self._write(os.path.join(path, 'queue', 'rotational'),
+                    int(rotational))
+        if physical:
+            os.mkdir(os.path.join(path, 'device'))
+            self._write(os.path.join(path, 'device', 'model'), model)
+        self._device_dir(path, name, dev, sectors, holders, udev)
+
+    def _partition(self, disk, name, dev, udev=()):
+        path = os.path.join(self.devices, disk, name)
+        os.makedirs(path)
+        self._write(os.path.join(path, 'partition'), 1)
+        self._device_dir(path, name, dev, 1 << 20, (), udev)
+
+    def _scan(self):
+        return {
+            device['name']: device
+            for device in discovery.scan(self.sys_dir, self.udev_dir,
+                                         self.mountinfo)
+        }
+
+    def test_scan(self):
+        devices = self._scan()
+
+        self.assertEqual(['loop0', 'nvme0n1', 'nvme1n1', 'sda', 'sda1',
+                          'sdb'], sorted(devices))
+        sda1 = devices['sda1']
+        self.assertEqual('/dev/sda1', sda1['path'])
+        self.assertEqual(discovery.TYPE_PARTITION, sda1['type'])
+        self.assertEqual(512 << 20, sda1['size'])
+        # disk attributes are inherited by partitions
+        self.assertTrue(sda1['rotational'])
+        self.assertEqual('HDD 1', sda1['model'])
+        self.assertTrue(sda1['mounted'])
+        self.assertEqual('ext4', sda1['signature'])
+        self.assertEqual(['sda1'], devices['sda']['partitions'])
+        self.assertEqual('gpt', devices['sda']['signature'])
+        self.assertEqual(['/dev/disk/by-id/nvme-NVMe_1_S1'],
+                         devices['nvme0n1']['links'])
+        self.assertEqual(['dm-0'], devices['nvme1n1']['holders'])
+        self.assertFalse(devices['loop0']['physical'])
+
+    def test_in_use(self):
+        devices = self._scan()
+
+        self.assertEqual([], discovery.in_use(devices['sdb']))
+        self.assertEqual(['mounted', 'has a ext4 signature'],
+                         discovery.in_use(devices['sda1']))
+        self.assertEqual(['has partitions sda1', 'has a gpt signature'],
+                         discovery.in_use(devices['sda']))
+        self.assertEqual(['held by dm-0'],
+                         discovery.in_use(devices['nvme1n1']))
+        self.assertEqual([], discovery.in_use(devices['sda'], contents=False))
+        self.assertEqual(['mounted'],
+                         discovery.in_use(devices['sda1'], contents=False))
+
+    def test_select(self):
+        devices = list(self._scan().values())
+
+        def _select(**filters):
+            return sorted(device['name']
+                          for device in discovery.select(devices, **filters))
+
+        self.assertEqual(['nvme0n1', 'sdb'], _select())
+        self.assertEqual(['nvme0n1'],
+                         _select(patterns=['/dev/disk/by-id/nvme-*']))
+        self.assertEqual(['sdb'], _select(rotational=True))
+        self.assertEqual(['nvme0n1'], _select(rotational=False))
+        self.assertEqual(['sdb'], _select(min_size=3 << 30))
+        self.assertEqual(['nvme0n1'], _select(max_size=2 << 30))
+        self.assertEqual(['nvme0n1'], _select(model='NVMe*'))
+        self.assertEqual([], _select(model='SSD*'))
+
+    def test_find(self):
+        devices = list(self._scan().values())
+
+        self.assertEqual(
+            'nvme0n1',
+            discovery.find(devices, '/dev/disk/by-id/nvme-NVMe_1_S1')['name']
+        )
+        self.assertEqual('sdb', discovery.find(devices, '/dev/sdb')['name'])
+        self.assertRaises(ValueError, discovery.find, devices, '/dev/sdz')
+
+    def test_parse_size(self):
+        self.assertEqual(512, discovery.parse_size('512'))
+        self.assertEqual(100 << 30, discovery.parse_size('100G'))
+        self.assertEqual(3 << 39, discovery.parse_size('1.5TiB'))
+        self.assertEqual(4 << 10, discovery.parse_size('4k'))
+        self.assertRaises(ValueError, discovery.parse_size, '10X')
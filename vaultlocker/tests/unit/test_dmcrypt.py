@@ -20,6 +20,7 @@ Tests for `dmcrypt` module.
 """
 
 import base64
+import subprocess
 from unittest import mock
 
 from vaultlocker import dmcrypt
@@ -28,30 +29,94 @@ from vaultlocker.tests.unit import base
 
 class TestDMCrypt(base.TestCase):
 
+    def _capture_key(self, _subprocess):
+        """Record the key cryptsetup would read from its key file"""
+        keys = []
+
+        def _check_output(command, pass_fds):
+            path = command[command.index('--key-file') + 1]
+            self.assertEqual(
+                '/proc/self/fd/{}'.format(pass_fds[0]), path
+            )
+            with open(path, 'rb') as key_file:
+                keys.append(key_file.read())
+        _subprocess.check_output.side_effect = _check_output
+        return keys
+
     @mock.patch.object(dmcrypt, 'subprocess')
     def test_luks_format(self, _subprocess):
+        keys = self._capture_key(_subprocess)
         dmcrypt.luks_format('mykey', '/dev/sdb', 'test-uuid')
         _subprocess.check_output.assert_called_once_with(
             ['cryptsetup',
              '--batch-mode',
              '--uuid', 'test-uuid',
-             '--key-file', '-',
+             '--key-file', mock.ANY,
              'luksFormat', '/dev/sdb'],
-            input='mykey'.encode('UTF-8')
+            pass_fds=mock.ANY,
         )
+        self.assertEqual([b'mykey'], keys)
 
     @mock.patch.object(dmcrypt, 'subprocess')
     def test_luks_open(self, _subprocess):
+        keys = self._capture_key(_subprocess)
         dmcrypt.luks_open('mykey', 'test-uuid')
         _subprocess.check_output.assert_called_once_with(
             ['cryptsetup',
              '--batch-mode',
-             '--key-file', '-',
+             '--key-file', mock.ANY,
              'open', 'UUID=test-uuid', 'crypt-test-uuid',
              '--type', 'luks'],
-            input='mykey'.encode('UTF-8')
+            pass_fds=mock.ANY,
+        )
+        self.assertEqual([b'mykey'], keys)
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_format_detached_header(self, _subprocess):
+        dmcrypt.luks_format('mykey', '/dev/sdb', 'test-uuid',
+                            header='/headers/test-uuid.luks')
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup',
+             '--batch-mode',
+             '--uuid', 'test-uuid',
+             '--key-file', mock.ANY,
+             '--type', 'luks2',
+             '--header', '/headers/test-uuid.luks',
+             'luksFormat', '/dev/sdb'],
+            pass_fds=mock.ANY,
         )
 
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_open_detached_header(self, _subprocess):
+        dmcrypt.luks_open('mykey', 'test-uuid',
+                          header='/headers/test-uuid.luks',
+                          device='/dev/disk/by-id/ata-HDD_1')
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup',
+             '--batch-mode',
+             '--key-file', mock.ANY,
+             '--header', '/headers/test-uuid.luks',
+             'open', '/dev/disk/by-id/ata-HDD_1', 'crypt-test-uuid',
+             '--type', 'luks'],
+            pass_fds=mock.ANY,
+        )
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_open_pipe_fallback(self, _subprocess):
+        keys = self._capture_key(_subprocess)
+        with mock.patch.object(dmcrypt.os, 'memfd_create',
+                               side_effect=OSError('ENOSYS')):
+            dmcrypt.luks_open('mykey', 'test-uuid')
+        self.assertEqual([b'mykey'], keys)
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_open_bytearray_left_to_caller(self, _subprocess):
+        keys = self._capture_key(_subprocess)
+        key = bytearray(b'mykey')
+        dmcrypt.luks_open(key, 'test-uuid')
+        self.assertEqual([b'mykey'], keys)
+        self.assertEqual(bytearray(b'mykey'), key)
+
     @mock.patch.object(dmcrypt, 'os')
     def test_generate_key(self, _os):
         _key = b'randomdatastringfromentropy'
@@ -60,6 +125,227 @@ class TestDMCrypt(base.TestCase):
                          base64.b64encode(_key).decode('UTF-8'))
         _os.urandom.assert_called_with(dmcrypt.KEY_SIZE / 8)
 
+    @mock.patch.object(dmcrypt, 'os')
+    def test_generate_key_size(self, _os):
+        _os.urandom.return_value = b'x' * 32
+        dmcrypt.generate_key(256)
+        _os.urandom.assert_called_once_with(32)
+
+    @mock.patch.object(dmcrypt, 'os')
+    def test_generate_keys_single_buffer(self, _os):
+        _os.urandom.return_value = b'a' * 32 + b'b' * 32 + b'c' * 32
+        self.assertEqual(
+            [base64.b64encode(b'a' * 32).decode('UTF-8'),
+             base64.b64encode(b'b' * 32).decode('UTF-8'),
+             base64.b64encode(b'c' * 32).decode('UTF-8')],
+            dmcrypt.generate_keys(3, 256),
+        )
+        _os.urandom.assert_called_once_with(96)
+
+    def test_generate_keys_default_size(self):
+        keys = dmcrypt.generate_keys(2)
+        self.assertEqual(2, len(keys))
+        self.assertNotEqual(keys[0], keys[1])
+        for key in keys:
+            self.assertEqual(dmcrypt.KEY_SIZE // 8,
+                             len(base64.b64decode(key)))
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_reencrypt(self, _subprocess):
+        keys = self._capture_key(_subprocess)
+        dmcrypt.luks_reencrypt('mykey', 'test-uuid',
+                               resilience='checksum', hotzone_size='4M')
+        _subprocess.check_output.assert_called_once_with(
+            ['ionice', '-c', '3',
+             'cryptsetup',
+             '--batch-mode',
+             '--key-file', mock.ANY,
+             '--resilience', 'checksum',
+             '--hotzone-size', '4M',
+             'reencrypt', 'UUID=test-uuid'],
+            pass_fds=mock.ANY,
+        )
+        self.assertEqual([b'mykey'], keys)
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_reencrypt_defaults(self, _subprocess):
+        self._capture_key(_subprocess)
+        dmcrypt.luks_reencrypt('mykey', 'test-uuid', ionice=False)
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup',
+             '--batch-mode',
+             '--key-file', mock.ANY,
+             'reencrypt', 'UUID=test-uuid'],
+            pass_fds=mock.ANY,
+        )
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_change_key(self, _subprocess):
+        keys = []
+
+        def _check_output(command, pass_fds):
+            self.assertEqual(
+                ['cryptsetup', '--batch-mode', '--key-file',
+                 '/proc/self/fd/{}'.format(pass_fds[0]),
+                 'luksChangeKey', 'UUID=test-uuid',
+                 '/proc/self/fd/{}'.format(pass_fds[1])],
+                command,
+            )
+            for fd in pass_fds:
+                with open('/proc/self/fd/{}'.format(fd), 'rb') as key_file:
+                    keys.append(key_file.read())
+        _subprocess.check_output.side_effect = _check_output
+
+        dmcrypt.luks_change_key('oldkey', 'newkey', 'test-uuid')
+
+        self.assertEqual([b'oldkey', b'newkey'], keys)
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_test_key(self, _subprocess):
+        keys = self._capture_key(_subprocess)
+        self.assertTrue(dmcrypt.luks_test_key('mykey', 'test-uuid'))
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup',
+             '--batch-mode',
+             '--key-file', mock.ANY,
+             'open', '--test-passphrase', 'UUID=test-uuid'],
+            pass_fds=mock.ANY,
+        )
+        self.assertEqual([b'mykey'], keys)
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_test_key_wrong_key(self, _check_output):
+        _check_output.side_effect = subprocess.CalledProcessError(2, 'cmd')
+        self.assertFalse(dmcrypt.luks_test_key('mykey', 'test-uuid'))
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_add_key(self, _subprocess):
+        keys = []
+
+        def _check_output(command, pass_fds):
+            self.assertEqual(
+                ['cryptsetup', '--batch-mode', '--key-file',
+                 '/proc/self/fd/{}'.format(pass_fds[0]),
+                 'luksAddKey', 'UUID=test-uuid',
+                 '/proc/self/fd/{}'.format(pass_fds[1])],
+                command,
+            )
+            for fd in pass_fds:
+                with open('/proc/self/fd/{}'.format(fd), 'rb') as key_file:
+                    keys.append(key_file.read())
+        _subprocess.check_output.side_effect = _check_output
+
+        dmcrypt.luks_add_key('oldkey', 'newkey', 'test-uuid')
+
+        self.assertEqual([b'oldkey', b'newkey'], keys)
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_key_slot(self, _check_output):
+        _check_output.return_value = (
+            b'Key slot 3 unlocked.\nCommand successful.\n'
+        )
+        self.assertEqual(3, dmcrypt.luks_key_slot('mykey', 'test-uuid'))
+        _check_output.assert_called_once_with(
+            ['cryptsetup',
+             '--batch-mode',
+             '--verbose',
+             '--key-file', mock.ANY,
+             'open', '--test-passphrase', 'UUID=test-uuid'],
+            pass_fds=mock.ANY,
+        )
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_key_slot_wrong_key(self, _check_output):
+        _check_output.side_effect = subprocess.CalledProcessError(2, 'cmd')
+        self.assertIsNone(dmcrypt.luks_key_slot('mykey', 'test-uuid'))
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_key_slots_luks2(self, _check_output):
+        _check_output.return_value = (
+            b'LUKS header information\n'
+            b'Version:        2\n'
+            b'Keyslots:\n'
+            b'  0: luks2\n'
+            b'\tKey:        512 bits\n'
+            b'  2: luks2\n'
+            b'\tKey:        512 bits\n'
+            b'Tokens:\n'
+        )
+        self.assertEqual({0, 2}, dmcrypt.luks_key_slots('test-uuid'))
+        _check_output.assert_called_once_with(
+            ['cryptsetup', 'luksDump', 'UUID=test-uuid']
+        )
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_key_slots_luks1(self, _check_output):
+        _check_output.return_value = (
+            b'Version:       \t1\n'
+            b'Key Slot 0: DISABLED\n'
+            b'Key Slot 1: ENABLED\n'
+            b'\tIterations:         \t1000\n'
+            b'Key Slot 2: DISABLED\n'
+        )
+        self.assertEqual({1}, dmcrypt.luks_key_slots('test-uuid'))
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_kill_slot(self, _subprocess):
+        keys = self._capture_key(_subprocess)
+        dmcrypt.luks_kill_slot('mykey', 'test-uuid', 1)
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup',
+             '--batch-mode',
+             '--key-file', mock.ANY,
+             'luksKillSlot', 'UUID=test-uuid', '1'],
+            pass_fds=mock.ANY,
+        )
+        self.assertEqual([b'mykey'], keys)
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_header_backup(self, _subprocess):
+        dmcrypt.luks_header_backup('test-uuid', '/tmp/backup')
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup', '--batch-mode', 'luksHeaderBackup',
+             'UUID=test-uuid', '--header-backup-file', '/tmp/backup']
+        )
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_header_backup_detached(self, _subprocess):
+        dmcrypt.luks_header_backup('test-uuid', '/tmp/backup',
+                                   header='/headers/test-uuid.luks')
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup', '--batch-mode', 'luksHeaderBackup',
+             '/headers/test-uuid.luks', '--header-backup-file',
+             '/tmp/backup']
+        )
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_header_restore(self, _subprocess):
+        dmcrypt.luks_header_restore('/dev/sdb', '/tmp/backup')
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup', '--batch-mode', 'luksHeaderRestore', '/dev/sdb',
+             '--header-backup-file', '/tmp/backup']
+        )
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_uuid(self, _check_output):
+        _check_output.return_value = b'test-uuid\n'
+        self.assertEqual('test-uuid', dmcrypt.luks_uuid('/dev/sdb'))
+        _check_output.assert_called_once_with(
+            ['cryptsetup', 'luksUUID', '/dev/sdb']
+        )
+
+    @mock.patch.object(dmcrypt.subprocess, 'check_output')
+    def test_luks_uuid_not_luks(self, _check_output):
+        _check_output.side_effect = subprocess.CalledProcessError(1, 'cmd')
+        self.assertIsNone(dmcrypt.luks_uuid('/dev/sdb'))
+
+    @mock.patch.object(dmcrypt, 'subprocess')
+    def test_luks_close(self, _subprocess):
+        dmcrypt.luks_close('test-uuid')
+        _subprocess.check_output.assert_called_once_with(
+            ['cryptsetup', 'close', 'crypt-test-uuid']
+        )
+
     @mock.patch.object(dmcrypt, 'subprocess')
     def test_udevadm_rescan(self, _subprocess):
         dmcrypt.udevadm_rescan('/dev/vdb')
@@ -0,0 +1,142 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_headers
+----------------------------------
+
+Tests for `vaultlocker.headers` module.
+"""
+
+import os
+import tempfile
+from unittest import mock
+
+from vaultlocker import headers
+from vaultlocker.tests.unit import base
+
+
+class TestHeaders(base.TestCase):
+
+    def setUp(self):
+        super(TestHeaders, self).setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        self.header_dir = os.path.join(self.root, 'headers')
+
+    def test_register_and_lookup(self):
+        self.assertIsNone(headers.lookup('uuid-1', self.header_dir))
+
+        header = headers.register('uuid-1', '/dev/disk/by-id/ata-HDD_1',
+                                  self.header_dir)
+
+        self.assertEqual(os.path.join(self.header_dir, 'uuid-1.luks'),
+                         header)
+        self.assertEqual(
+            {'uuid': 'uuid-1', 'device': '/dev/disk/by-id/ata-HDD_1',
+             'header': header},
+            headers.lookup('uuid-1', self.header_dir),
+        )
+
+    def test_unregister(self):
+        header = headers.register('uuid-1', '/dev/sdb', self.header_dir)
+        open(header, 'w').close()
+
+        headers.unregister('uuid-1', self.header_dir)
+        headers.unregister('uuid-1', self.header_dir)
+
+        self.assertIsNone(headers.lookup('uuid-1', self.header_dir))
+        self.assertEqual([], os.listdir(self.header_dir))
+
+    def test_present_devices(self):
+        device = os.path.join(self.root, 'sdb')
+        open(device, 'w').close()
+        headers.register('uuid-1', device, self.header_dir)
+        headers.register('uuid-2', os.path.join(self.root, 'sdc'),
+                         self.header_dir)
+
+        self.assertEqual({'uuid-1'},
+                         headers.present_devices(self.header_dir))
+        self.assertEqual(set(), headers.present_devices(
+            os.path.join(self.root, 'missing')))
+
+
+class DictStore(object):
+    """KV store keeping secrets in a dict"""
+
+    def __init__(self):
+        self.secrets = {}
+
+    def write(self, path, secret, cas=None):
+        self.secrets[path] = dict(secret)
+        return {}
+
+    def read(self, path):
+        return dict(self.secrets[path])
+
+
+class TestHeaderBackups(base.TestCase):
+
+    def setUp(self):
+        super(TestHeaderBackups, self).setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        self.store = DictStore()
+        self.header = os.path.join(self.root, 'header')
+        # a LUKS2 header is mostly zeroed keyslot area
+        self.data = os.urandom(4096) + bytes(1 << 20) + os.urandom(4096)
+        with open(self.header, 'wb') as header:
+            header.write(self.data)
+
+    @mock.patch.object(headers, 'READ_SIZE', 1000)
+    @mock.patch.object(headers, 'CHUNK_SIZE', 2048)
+    def test_round_trip(self):
+        description = headers.store_backup(
+            self.store, 'host/headers/uuid-1', self.header,
+            device='/dev/sdb',
+        )
+
+        self.assertEqual(len(self.data), description['size'])
+        self.assertEqual('/dev/sdb', description['device'])
+        self.assertGreater(description['chunks'], 1)
+        self.assertEqual(
+            ['host/headers/uuid-1'] + [
+                'host/headers/uuid-1/{}'.format(index)
+                for index in range(description['chunks'])
+            ],
+            sorted(self.store.secrets, key=len),
+        )
+        # zeroed areas compress away
+        self.assertLess(description['chunks'] * 2048, len(self.data) // 10)
+
+        restored = os.path.join(self.root, 'restored')
+        self.assertEqual(description, headers.load_backup(
+            self.store, 'host/headers/uuid-1', restored))
+        with open(restored, 'rb') as header:
+            self.assertEqual(self.data, header.read())
+
+    def test_load_corrupted(self):
+        headers.store_backup(self.store, 'host/headers/uuid-1', self.header)
+        self.store.secrets['host/headers/uuid-1']['sha256'] = '0' * 64
+
+        self.assertRaises(ValueError, headers.load_backup, self.store,
+                          'host/headers/uuid-1',
+                          os.path.join(self.root, 'restored'))
+
+    def test_load_unknown_format(self):
+        self.store.write('host/headers/uuid-1', {'format': 99})
+
+        self.assertRaises(ValueError, headers.load_backup, self.store,
+                          'host/headers/uuid-1',
+                          os.path.join(self.root, 'restored'))
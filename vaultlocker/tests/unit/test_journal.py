@@ -0,0 +1,71 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_journal
+----------------------------------
+
+Tests for `vaultlocker.journal` module.
+"""
+
+import os
+import tempfile
+
+from vaultlocker import journal
+from vaultlocker.tests.unit import base
+
+
+class TestJournal(base.TestCase):
+
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.directory = os.path.join(root.name, 'journal')
+        self.journal = journal.Journal(self.directory)
+
+    def test_record(self):
+        self.journal.record('uuid-1', journal.PHASE_STARTED,
+                            block_device='/dev/sdb')
+        self.journal.record('uuid-1', journal.PHASE_KEY_STORED)
+
+        entry = self.journal.get('uuid-1')
+        self.assertEqual('uuid-1', entry['uuid'])
+        self.assertEqual(journal.PHASE_KEY_STORED, entry['phase'])
+        self.assertEqual('/dev/sdb', entry['block_device'])
+        self.assertEqual(['uuid-1.json'], os.listdir(self.directory))
+
+    def test_record_unknown_phase(self):
+        self.assertRaises(ValueError, self.journal.record,
+                          'uuid-1', 'enabled')
+
+    def test_entries(self):
+        self.journal.record('uuid-2', journal.PHASE_FORMATTED)
+        self.journal.record('uuid-1', journal.PHASE_STARTED)
+
+        self.assertEqual(
+            ['uuid-1', 'uuid-2'],
+            [entry['uuid'] for entry in self.journal.entries()],
+        )
+
+    def test_remove(self):
+        self.journal.record('uuid-1', journal.PHASE_OPENED)
+
+        self.journal.remove('uuid-1')
+        self.journal.remove('uuid-1')
+
+        self.assertIsNone(self.journal.get('uuid-1'))
+        self.assertEqual([], self.journal.entries())
+
+    def test_no_journal(self):
+        self.assertEqual([], self.journal.entries())
+        self.assertIsNone(self.journal.get('uuid-1'))
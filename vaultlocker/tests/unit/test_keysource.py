@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_keysource
+----------------------------------
+
+Tests for `vaultlocker.keysource` module.
+"""
+
+import base64
+import os
+import tempfile
+from unittest import mock
+
+from vaultlocker import keysource
+from vaultlocker.tests.unit import base
+
+
+class TestVaultKeySource(base.TestCase):
+
+    def setUp(self):
+        super(TestVaultKeySource, self).setUp()
+        self.client = mock.MagicMock()
+        self.client.adapter.post.side_effect = lambda url, json: {
+            'data': {
+                'random_bytes': base64.b64encode(
+                    b'r' * int(url.rsplit('/', 1)[1])
+                ).decode('UTF-8'),
+            },
+        }
+
+    def test_generate_many_single_request(self):
+        source = keysource.VaultKeySource(self.client, 256)
+
+        keys = source.generate_many(4)
+
+        self.assertEqual(4, len(keys))
+        self.assertEqual(b'r' * 32, base64.b64decode(keys[0]))
+        self.client.adapter.post.assert_called_once_with(
+            '/v1/sys/tools/random/128',
+            json={'format': 'base64'},
+        )
+
+    @mock.patch.object(keysource, 'VAULT_RANDOM_MAX_BYTES', 64)
+    def test_generate_many_chunks_requests(self):
+        source = keysource.VaultKeySource(self.client, 256)
+
+        self.assertEqual(5, len(source.generate_many(5)))
+        self.assertEqual(3, self.client.adapter.post.call_count)
+
+
+class TestDeviceKeySource(base.TestCase):
+
+    def test_generate_reads_device(self):
+        with tempfile.NamedTemporaryFile() as rng:
+            rng.write(os.urandom(64))
+            rng.flush()
+            source = keysource.DeviceKeySource(
+                mock.MagicMock(), 256, device=rng.name,
+            )
+
+            keys = source.generate_many(2)
+
+        self.assertEqual(2, len(keys))
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_short_read_raises(self):
+        with tempfile.NamedTemporaryFile() as rng:
+            source = keysource.DeviceKeySource(
+                mock.MagicMock(), 256, device=rng.name,
+            )
+
+            self.assertRaises(OSError, source.generate)
+
+
+class TestKeySourceFactory(base.TestCase):
+
+    def test_get_source_vault(self):
+        client = mock.MagicMock()
+
+        source = keysource.KeySource.get_source('vault', client, 1024)
+
+        self.assertIsInstance(source, keysource.VaultKeySource)
+        self.assertIs(client, source.client)
+        self.assertEqual(1024, source.key_size)
+
+    def test_get_source_hwrng_options(self):
+        source = keysource.KeySource.get_source(
+            'hwrng', mock.MagicMock(), device='/dev/tpmrng',
+        )
+
+        self.assertIsInstance(source, keysource.DeviceKeySource)
+        self.assertEqual('/dev/tpmrng', source.device)
+
+    def test_get_source_rejects_unknown(self):
+        with self.assertRaises(ValueError) as error:
+            keysource.KeySource.get_source('dice', mock.MagicMock())
+
+        self.assertIn("Unsupported key_source 'dice'", str(error.exception))
@@ -0,0 +1,173 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_loadgen
+----------------------------------
+
+Tests for `vaultlocker.loadgen` and `vaultlocker.fakevault` modules.
+"""
+
+import io
+import random
+import warnings
+
+import hvac
+
+from vaultlocker import fakevault
+from vaultlocker import loadgen
+from vaultlocker import shell
+from vaultlocker.tests.unit import base
+from vaultlocker import vault
+
+
+class TestFakeVault(base.TestCase):
+
+    def setUp(self):
+        super(TestFakeVault, self).setUp()
+        # hvac warns on every KV v2 read without raise_on_deleted_version
+        warnings.simplefilter('ignore', DeprecationWarning)
+        self.addCleanup(warnings.resetwarnings)
+
+    def _store(self, server):
+        client = hvac.Client(url=server.url)
+        client.auth.approle.login(role_id='role', secret_id='secret')
+        return vault.KVStore.get_store(client=client,
+                                       mount_point=server.mount_point,
+                                       kv_version=server.kv_version)
+
+    def test_kv_v1(self):
+        with fakevault.FakeVault() as server:
+            store = self._store(server)
+            store.write('host/a', {'dmcrypt_key': 'key'})
+
+            self.assertEqual({'dmcrypt_key': 'key'}, store.read('host/a'))
+            self.assertEqual(['host/'], store.list(''))
+            store.delete('host/a')
+            self.assertRaises(hvac.exceptions.InvalidPath, store.read,
+                              'host/a')
+
+    def test_kv_v2_check_and_set(self):
+        with fakevault.FakeVault(kv_version=vault.KV_VERSION_2) as server:
+            store = self._store(server)
+            self.assertEqual(1, store.write('host', {'keys': {}},
+                                            cas=0)['version'])
+
+            self.assertEqual(({'keys': {}}, 1), store.read_version('host'))
+            with self.assertRaises(hvac.exceptions.InvalidRequest) as error:
+                store.write('host', {'keys': {}}, cas=0)
+            self.assertTrue(vault.is_cas_conflict(error.exception))
+
+    def test_requires_token(self):
+        with fakevault.FakeVault() as server:
+            client = hvac.Client(url=server.url)
+            self.assertRaises(hvac.exceptions.Forbidden,
+                              client.secrets.kv.v1.read_secret, 'host/a')
+
+    def test_outage(self):
+        with fakevault.FakeVault(outage=60) as server:
+            client = hvac.Client(url=server.url)
+            self.assertRaises(hvac.exceptions.VaultDown,
+                              client.auth.approle.login, role_id='role')
+            self.assertEqual(1, server.requests)
+
+
+class TestLoadgen(base.TestCase):
+
+    def setUp(self):
+        super(TestLoadgen, self).setUp()
+        warnings.simplefilter('ignore', DeprecationWarning)
+        self.addCleanup(warnings.resetwarnings)
+
+    def _run(self, server, layout=vault.LAYOUT_DEVICE, retry=-1,
+             outage=0.0):
+        configs = loadgen.host_configs(loadgen.fake_config(server, layout),
+                                       3)
+        loadgen.seed(configs, 2, workers=2)
+        offsets = loadgen.arrivals(configs, loadgen.ARRIVAL_BURST, 0,
+                                   random.Random(0))
+        server.outage = outage
+        server.restart_clock()
+        return loadgen.run(configs, 2, offsets, concurrency=6, retry=retry)
+
+    def test_run(self):
+        luks_open = shell._luks_open
+        vault_client = shell._vault_client
+        request = vault.TracedAdapter.request
+        with fakevault.FakeVault() as server:
+            recorder, wall = self._run(server)
+
+        summary = recorder.summary(wall)
+        self.assertEqual(6, summary['unlock']['count'])
+        self.assertEqual(6, summary['vault.login']['count'])
+        self.assertEqual(6, summary['vault.kv']['count'])
+        self.assertEqual(0, recorder.counts['retries'])
+        self.assertEqual(0, recorder.counts['unlock.failed'])
+        # the run leaves the module functions alone
+        self.assertIs(luks_open, shell._luks_open)
+        self.assertIs(vault_client, shell._vault_client)
+        self.assertIs(request, vault.TracedAdapter.request)
+
+        output = io.StringIO()
+        loadgen.report(recorder, wall, output)
+        self.assertIn('failed unlocks 0', output.getvalue())
+
+    def test_run_host_layout(self):
+        with fakevault.FakeVault(kv_version=vault.KV_VERSION_2) as server:
+            recorder, wall = self._run(server, vault.LAYOUT_HOST)
+
+        self.assertEqual(6, recorder.summary(wall)['unlock']['count'])
+
+    def test_run_retries_outage(self):
+        with fakevault.FakeVault() as server:
+            recorder, wall = self._run(server, retry=30, outage=0.5)
+
+        self.assertEqual(6, recorder.summary(wall)['unlock']['count'])
+        self.assertEqual(6, recorder.counts['retries'])
+        self.assertEqual(6, recorder.counts['error.VaultDown'])
+
+    def test_run_fails_without_retry(self):
+        with fakevault.FakeVault() as server:
+            server.outage = 60
+            configs = loadgen.host_configs(loadgen.fake_config(server), 1)
+            recorder, wall = loadgen.run(configs, 2, [0.0], concurrency=2)
+
+        self.assertEqual(2, recorder.counts['unlock.failed'])
+        self.assertNotIn('unlock', recorder.summary(wall))
+
+    def test_arrivals(self):
+        configs = loadgen.host_configs(
+            shell.conf.Config({'DEFAULT': {'boot_jitter': '30'}}), 4)
+        rng = random.Random(0)
+
+        self.assertEqual([0.0] * 4, loadgen.arrivals(
+            configs, loadgen.ARRIVAL_BURST, 10, rng))
+        self.assertEqual([0.0, 2.5, 5.0, 7.5], loadgen.arrivals(
+            configs, loadgen.ARRIVAL_UNIFORM, 10, rng))
+        poisson = loadgen.arrivals(configs, loadgen.ARRIVAL_POISSON, 10, rng)
+        self.assertEqual(sorted(poisson), poisson)
+        jitter = loadgen.arrivals(configs, loadgen.ARRIVAL_JITTER, 10, rng)
+        self.assertEqual(4, len(set(jitter)))
+        self.assertTrue(all(0 <= offset < 30 for offset in jitter))
+
+    def test_device_uuids_stable(self):
+        self.assertEqual(loadgen.device_uuids('host', 3),
+                         loadgen.device_uuids('host', 3))
+        self.assertEqual(3, len(set(loadgen.device_uuids('host', 3))))
+
+    def test_percentile(self):
+        samples = [float(value) for value in range(1, 101)]
+
+        self.assertEqual(50.0, loadgen.percentile(samples, 50))
+        self.assertEqual(99.0, loadgen.percentile(samples, 99))
+        self.assertEqual(1.0, loadgen.percentile(samples, 0))
+        self.assertEqual(0.0, loadgen.percentile([], 50))
@@ -0,0 +1,100 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_locking
+----------------------------------
+
+Tests for `vaultlocker.locking` module.
+"""
+
+import fcntl
+import os
+import tempfile
+
+from vaultlocker import exceptions
+from vaultlocker import locking
+from vaultlocker.tests.unit import base
+
+
+class TestLocking(base.TestCase):
+
+    def setUp(self):
+        super(TestLocking, self).setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.lock_dir = os.path.join(self.root.name, 'locks')
+
+    def _hold(self, name):
+        """Hold a lock through a separate open file description"""
+        fd = os.open(os.path.join(self.lock_dir, '{}.lock'.format(name)),
+                     os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self.addCleanup(os.close, fd)
+        return fd
+
+    def test_lock(self):
+        with locking.lock('uuid-1', timeout=0, lock_dir=self.lock_dir):
+            self.assertRaises(
+                exceptions.LockTimeout,
+                self._try, 'uuid-1',
+            )
+        with locking.lock('uuid-1', timeout=0, lock_dir=self.lock_dir):
+            pass
+
+    def _try(self, name):
+        with locking.lock(name, timeout=0.05, lock_dir=self.lock_dir):
+            pass
+
+    def test_lock_timeout(self):
+        os.makedirs(self.lock_dir)
+        self._hold('uuid-1')
+
+        with self.assertRaises(exceptions.LockTimeout) as error:
+            self._try('uuid-1')
+        self.assertIn('uuid-1', str(error.exception))
+
+    def test_locks_independent_names(self):
+        with locking.locks(['uuid-1', 'uuid-2'], timeout=0,
+                           lock_dir=self.lock_dir):
+            with locking.lock('uuid-3', timeout=0, lock_dir=self.lock_dir):
+                pass
+            self.assertRaises(exceptions.LockTimeout, self._try, 'uuid-2')
+
+    def test_semaphore(self):
+        name = 'cryptsetup-{}'
+        with locking.semaphore(name, 2, timeout=0, lock_dir=self.lock_dir):
+            with locking.semaphore(name, 2, timeout=0,
+                                   lock_dir=self.lock_dir):
+                self.assertRaises(
+                    exceptions.LockTimeout,
+                    self._enter_semaphore, name, 2,
+                )
+            self._enter_semaphore(name, 2)
+
+    def _enter_semaphore(self, name, limit):
+        with locking.semaphore(name, limit, timeout=0.05,
+                               lock_dir=self.lock_dir):
+            pass
+
+    def test_device_lock_name_resolves_links(self):
+        device = os.path.join(self.root.name, 'sdb')
+        link = os.path.join(self.root.name, 'by-id')
+        open(device, 'w').close()
+        os.symlink(device, link)
+
+        self.assertEqual(locking.device_lock_name(device),
+                         locking.device_lock_name(link))
+        self.assertNotIn('/', locking.device_lock_name(device))
+
+    def test_uuid_lock_name(self):
+        self.assertEqual('uuid-abc', locking.uuid_lock_name('abc'))
@@ -0,0 +1,98 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_profiling
+----------------------------------
+
+Tests for `vaultlocker.profiling` module.
+"""
+
+import io
+import os
+import pstats
+import subprocess
+import tempfile
+import threading
+
+from vaultlocker import profiling
+from vaultlocker.tests.unit import base
+
+
+def _wait_for_child():
+    subprocess.check_call(['sleep', '0.1'])
+
+
+class TestProfiling(base.TestCase):
+
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'profile')
+        self.stream = io.StringIO()
+
+    def test_pstats(self):
+        with profiling.profile(self.path, stream=self.stream):
+            _wait_for_child()
+
+        stats = pstats.Stats(self.path)
+        # subprocess waits count towards the caller's wall-clock time
+        wait = [
+            stat for func, stat in stats.stats.items()
+            if func[2] == '_wait_for_child'
+        ]
+        self.assertEqual(1, len(wait))
+        self.assertGreaterEqual(wait[0][3], 0.1)
+        summary = self.stream.getvalue()
+        self.assertIn('child process cpu', summary)
+        self.assertIn('pstats profile written to {}'.format(self.path),
+                      summary)
+
+    def test_collapsed(self):
+        worker = threading.Thread(target=_wait_for_child, name='worker')
+        with profiling.profile(self.path, profiling.FORMAT_COLLAPSED,
+                               stream=self.stream, interval=0.01):
+            worker.start()
+            worker.join()
+
+        with open(self.path) as collapsed:
+            lines = collapsed.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any(
+            line.startswith('worker;') and
+            'test_profiling.py:_wait_for_child' in line
+            for line in lines
+        ))
+
+    def test_written_on_error(self):
+        def _fail():
+            with profiling.profile(self.path, stream=self.stream):
+                raise ValueError('failed')
+
+        self.assertRaises(ValueError, _fail)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_invalid_format(self):
+        def _profile():
+            with profiling.profile(self.path, 'callgrind'):
+                pass
+
+        self.assertRaises(ValueError, _profile)
+
+    def test_process_age(self):
+        age = profiling.process_age()
+        if age is not None:
+            self.assertGreaterEqual(age, 0)
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_ratelimit
+----------------------------------
+
+Tests for `vaultlocker.ratelimit` module.
+"""
+
+from unittest import mock
+
+from vaultlocker import ratelimit
+from vaultlocker import timing
+from vaultlocker.tests.unit import base
+
+
+class TestTokenBucket(base.TestCase):
+
+    def setUp(self):
+        super(TestTokenBucket, self).setUp()
+        self.now = 100.0
+        self.sleeps = []
+        self.patch_time = mock.patch.object(ratelimit, 'time')
+        _time = self.patch_time.start()
+        self.addCleanup(self.patch_time.stop)
+        _time.monotonic.side_effect = lambda: self.now
+        _time.sleep.side_effect = self.sleeps.append
+
+    def test_burst_then_wait(self):
+        bucket = ratelimit.TokenBucket(rate=10, burst=2)
+
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertAlmostEqual(0.1, bucket.acquire())
+        self.assertAlmostEqual(0.2, bucket.acquire())
+        self.assertEqual(2, len(self.sleeps))
+
+    def test_refill(self):
+        bucket = ratelimit.TokenBucket(rate=10, burst=1)
+
+        bucket.acquire()
+        self.now += 0.5
+        self.assertEqual(0, bucket.acquire())
+
+    def test_rejects_non_positive_rate(self):
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 0)
+
+
+class TestGovernor(base.TestCase):
+
+    def test_records_queueing_delay(self):
+        timings = timing.Timings()
+        governor = ratelimit.Governor(max_in_flight=2, timings=timings)
+
+        with governor.request() as queued:
+            self.assertGreaterEqual(queued, 0)
+
+        summary = timings.summary()
+        self.assertEqual(1, summary['vault.queue']['count'])
+        self.assertEqual(1, summary['vault.request']['count'])
+
+    def test_bounds_requests_in_flight(self):
+        governor = ratelimit.Governor(max_in_flight=1,
+                                      timings=timing.Timings())
+
+        with governor.request():
+            self.assertFalse(governor.slots.acquire(blocking=False))
+        self.assertTrue(governor.slots.acquire(blocking=False))
+
+    def test_releases_slot_on_error(self):
+        governor = ratelimit.Governor(max_in_flight=1,
+                                      timings=timing.Timings())
+
+        with self.assertRaises(RuntimeError):
+            with governor.request():
+                raise RuntimeError()
+        self.assertTrue(governor.slots.acquire(blocking=False))
+
+    @mock.patch.object(ratelimit.TokenBucket, 'acquire')
+    def test_takes_token(self, _acquire):
+        governor = ratelimit.Governor(rate=5, timings=timing.Timings())
+
+        with governor.request():
+            pass
+
+        _acquire.assert_called_once_with()
+        self.assertIsNone(governor.slots)
+
+    def test_rejects_invalid_max_in_flight(self):
+        self.assertRaises(ValueError, ratelimit.Governor, max_in_flight=0)
+
+    def test_shared_governor(self):
+        ratelimit.shared_governor.cache_clear()
+        self.addCleanup(ratelimit.shared_governor.cache_clear)
+
+        governor = ratelimit.shared_governor(5, None, 2)
+
+        self.assertIs(governor, ratelimit.shared_governor(5, None, 2))
+        self.assertIsNot(governor, ratelimit.shared_governor(10, None, 2))
@@ -0,0 +1,96 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_status
+----------------------------------
+
+Tests for `vaultlocker.status` module.
+"""
+
+import os
+import tempfile
+from unittest import mock
+
+from vaultlocker import status
+from vaultlocker.tests.unit import base
+
+
+class TestStatus(base.TestCase):
+
+    def test_build_index(self):
+        index = status.build_index(
+            vault_uuids={'ok', 'closed', 'orphan-key', 'no-unit'},
+            opened={'ok', 'no-unit', 'orphan-mapping'},
+            present={'ok', 'closed', 'no-unit', 'orphan-mapping'},
+            enabled={'ok', 'closed', 'orphan-key', 'orphan-mapping'},
+        )
+
+        self.assertEqual(
+            {
+                'closed': ['not-open'],
+                'no-unit': ['unit-disabled'],
+                'ok': [],
+                'orphan-key': ['no-device'],
+                'orphan-mapping': ['no-key'],
+            },
+            {entry['uuid']: entry['problems'] for entry in index},
+        )
+
+    def test_local_scans(self):
+        with tempfile.TemporaryDirectory() as root:
+            mapper = os.path.join(root, 'mapper')
+            by_uuid = os.path.join(root, 'by-uuid')
+            os.mkdir(mapper)
+            os.mkdir(by_uuid)
+            for name in ('control', 'crypt-uuid-1', 'vg-lv'):
+                open(os.path.join(mapper, name), 'w').close()
+            open(os.path.join(by_uuid, 'uuid-2'), 'w').close()
+
+            with mock.patch.object(status, 'DEV_MAPPER', mapper), \
+                    mock.patch.object(status, 'BY_UUID', by_uuid):
+                self.assertEqual({'uuid-1'}, status.open_mappings())
+                self.assertEqual({'uuid-2'}, status.present_devices())
+
+    def test_local_scans_missing_directories(self):
+        with mock.patch.object(status, 'DEV_MAPPER', '/nonexistent'):
+            self.assertEqual(set(), status.open_mappings())
+
+    def test_cache_round_trip(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'run', 'status.json')
+            status.write_cache(path, ['uuid-2', 'uuid-1'])
+
+            self.assertEqual(['uuid-1', 'uuid-2'],
+                             status.read_cache(path, 60))
+            with mock.patch.object(status.time, 'time',
+                                   return_value=os.path.getmtime(path) + 120):
+                self.assertIsNone(status.read_cache(path, 60))
+
+    def test_read_cache_missing(self):
+        self.assertIsNone(status.read_cache('/nonexistent/status.json', 60))
+
+    def test_format_table(self):
+        table = status.format_table([
+            {'uuid': 'uuid-1', 'key': True, 'device': True,
+             'open': True, 'unit': True, 'problems': []},
+            {'uuid': 'uuid-22', 'key': False, 'device': False,
+             'open': False, 'unit': True,
+             'problems': ['no-key', 'no-device']},
+        ])
+
+        self.assertEqual(
+            'UUID     KEY  DEVICE  OPEN  UNIT  PROBLEMS\n'
+            'uuid-1   yes  yes     yes   yes   ok\n'
+            'uuid-22  no   no      no    yes   no-key,no-device',
+            table,
+        )
@@ -19,6 +19,8 @@ test_systemd
 Tests for `systemd` module.
 """
 
+import os
+import tempfile
 from unittest import mock
 
 from vaultlocker import systemd
@@ -33,3 +35,44 @@ class TestSystemD(base.TestCase):
         _subprocess.check_call.assert_called_once_with(
             ['systemctl', 'enable', 'my-service.service']
         )
+
+    @mock.patch.object(systemd, 'subprocess')
+    def test_start(self, _subprocess):
+        systemd.start('my-service.service')
+        systemd.start('my-service.service', block=False)
+        _subprocess.check_call.assert_has_calls([
+            mock.call(['systemctl', 'start', 'my-service.service']),
+            mock.call(['systemctl', 'start', '--no-block',
+                       'my-service.service']),
+        ])
+
+    def test_enabled_instances(self):
+        with tempfile.TemporaryDirectory() as unit_dir:
+            wants = os.path.join(unit_dir, 'multi-user.target.wants')
+            os.mkdir(wants)
+            for name in ('vaultlocker-decrypt@uuid-1.service',
+                         'vaultlocker-decrypt@uuid-2.service',
+                         'ssh.service'):
+                os.symlink('/lib/systemd/system/unit.service',
+                           os.path.join(wants, name))
+
+            with mock.patch.object(systemd, 'SYSTEM_UNIT_DIR', unit_dir):
+                self.assertEqual(
+                    {'uuid-1', 'uuid-2'},
+                    systemd.enabled_instances('vaultlocker-decrypt@'),
+                )
+
+    @mock.patch.object(systemd, 'subprocess')
+    def test_set_environment(self, _subprocess):
+        with tempfile.TemporaryDirectory() as unit_dir:
+            with mock.patch.object(systemd, 'SYSTEM_UNIT_DIR', unit_dir):
+                systemd.set_environment('my-service@a.service',
+                                        {'PRIORITY': 'os'})
+            with open(os.path.join(unit_dir, 'my-service@a.service.d',
+                                   'vaultlocker.conf')) as dropin:
+                self.assertEqual(
+                    '[Service]\nEnvironment=PRIORITY=os\n', dropin.read()
+                )
+        _subprocess.check_call.assert_called_once_with(
+            ['systemctl', 'daemon-reload']
+        )
@@ -0,0 +1,133 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_tls
+----------------------------------
+
+Tests for `vaultlocker.tls` module.
+"""
+
+import ssl
+from unittest import mock
+
+import requests
+
+from vaultlocker import timing
+from vaultlocker import tls
+from vaultlocker.tests.unit import base
+
+
+class TestClientContext(base.TestCase):
+
+    def setUp(self):
+        super(TestClientContext, self).setUp()
+        tls.client_context.cache_clear()
+        self.addCleanup(tls.client_context.cache_clear)
+
+    @mock.patch.object(tls.ResumingSSLContext, 'load_cert_chain')
+    @mock.patch.object(tls.ResumingSSLContext, 'load_default_certs')
+    @mock.patch.object(tls.ResumingSSLContext, 'load_verify_locations')
+    def test_loads_only_configured_ca(self, _load_verify, _load_default,
+                                      _load_cert_chain):
+        context = tls.client_context('/etc/ssl/vault-ca.pem',
+                                     '/etc/ssl/client.pem',
+                                     '/etc/ssl/client.key')
+
+        _load_verify.assert_called_once_with(cafile='/etc/ssl/vault-ca.pem')
+        _load_default.assert_not_called()
+        _load_cert_chain.assert_called_once_with('/etc/ssl/client.pem',
+                                                 '/etc/ssl/client.key')
+        self.assertEqual(ssl.CERT_REQUIRED, context.verify_mode)
+        self.assertTrue(context.check_hostname)
+
+    @mock.patch.object(tls.ResumingSSLContext, 'load_verify_locations')
+    def test_context_is_reused(self, _load_verify):
+        context = tls.client_context('/etc/ssl/vault-ca.pem')
+
+        self.assertIs(context, tls.client_context('/etc/ssl/vault-ca.pem'))
+        _load_verify.assert_called_once_with(cafile='/etc/ssl/vault-ca.pem')
+
+    @mock.patch.object(tls.ResumingSSLContext, 'load_default_certs')
+    def test_system_store_without_ca(self, _load_default):
+        tls.client_context()
+
+        _load_default.assert_called_once_with()
+
+
+class TestResumingSSLContext(base.TestCase):
+
+    def _socket(self, has_ticket=True):
+        sock = mock.MagicMock()
+        sock.server_hostname = 'vault.test.com'
+        sock.session.has_ticket = has_ticket
+        return sock
+
+    @mock.patch.object(ssl.SSLContext, 'wrap_socket')
+    def test_resumes_saved_session(self, _wrap_socket):
+        context = tls.ResumingSSLContext(timing.Timings())
+        sock = self._socket()
+        context.save_session(sock)
+
+        context.wrap_socket('raw', server_hostname='vault.test.com')
+
+        _wrap_socket.assert_called_once_with(
+            'raw', False, server_hostname='vault.test.com',
+            session=sock.session,
+        )
+
+    @mock.patch.object(ssl.SSLContext, 'wrap_socket')
+    def test_new_host_has_no_session(self, _wrap_socket):
+        context = tls.ResumingSSLContext(timing.Timings())
+        context.save_session(self._socket())
+
+        context.wrap_socket('raw', server_hostname='other.test.com')
+
+        _wrap_socket.assert_called_once_with(
+            'raw', False, server_hostname='other.test.com', session=None,
+        )
+
+    def test_ticketless_session_does_not_replace_ticket(self):
+        context = tls.ResumingSSLContext(timing.Timings())
+        with_ticket = self._socket()
+        context.save_session(with_ticket)
+
+        context.save_session(self._socket(has_ticket=False))
+
+        self.assertIs(with_ticket.session,
+                      context._sessions['vault.test.com'])
+
+
+class TestContextAdapter(base.TestCase):
+
+    def test_ignores_request_certificates(self):
+        adapter = tls.ContextAdapter(mock.MagicMock())
+        request = requests.Request(
+            'GET', 'https://vault.test.com:8200/v1/sys/health').prepare()
+
+        host_params, pool_kwargs = (
+            adapter.build_connection_pool_key_attributes(
+                request, '/etc/ssl/other.pem', ('cert.pem', 'key.pem'))
+        )
+
+        self.assertEqual({'scheme': 'https', 'host': 'vault.test.com',
+                          'port': 8200}, host_params)
+        self.assertEqual({'cert_reqs': 'CERT_REQUIRED'}, pool_kwargs)
+
+    def test_session_mounts_adapter(self):
+        context = mock.MagicMock()
+
+        http = tls.session(context)
+
+        adapter = http.get_adapter('https://vault.test.com')
+        self.assertIsInstance(adapter, tls.ContextAdapter)
+        self.assertIs(context, adapter.ssl_context)
@@ -0,0 +1,122 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_tracing
+----------------------------------
+
+Tests for `vaultlocker.tracing` module.
+"""
+
+import asyncio
+import datetime
+import inspect
+import json
+import os
+import tempfile
+import unittest
+
+from vaultlocker import tracing
+from vaultlocker.tests.unit import base
+
+
+class TestTracing(base.TestCase):
+
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.addCleanup(tracing.shutdown)
+
+    def test_span_without_tracing(self):
+        with tracing.span('test', attribute='value') as span:
+            self.assertIsNone(span)
+
+    def test_traced_without_tracing(self):
+        @tracing.traced('test', 'uuid')
+        def _open(key, uuid):
+            return key, uuid
+
+        self.assertEqual(('key', 'uuid-1'), _open('key', uuid='uuid-1'))
+        self.assertEqual('_open', _open.__name__)
+
+    def test_traced_coroutine_without_tracing(self):
+        @tracing.traced('test', 'uuid')
+        async def _open(key, uuid):
+            return key, uuid
+
+        self.assertTrue(inspect.iscoroutinefunction(_open))
+        self.assertEqual(('key', 'uuid-1'),
+                         asyncio.run(_open('key', uuid='uuid-1')))
+
+    def test_headers_without_tracing(self):
+        first = tracing.headers()[tracing.TRACEPARENT].split('-')
+        second = tracing.headers()[tracing.TRACEPARENT].split('-')
+
+        self.assertEqual(tracing.trace_id(), first[1])
+        self.assertEqual(first[1], second[1])
+        self.assertNotEqual(first[2], second[2])
+
+    def test_configure_unknown_exporter(self):
+        self.assertRaises(ValueError, tracing.configure, 'zipkin')
+
+    @unittest.skipIf(tracing.available(), 'OpenTelemetry is installed')
+    def test_configure_not_installed(self):
+        self.assertRaises(ValueError, tracing.configure, 'file', '/tmp/x')
+
+    @unittest.skipUnless(tracing.available(), 'OpenTelemetry not installed')
+    def test_file_exporter(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'spans.jsonl')
+            tracing.configure('file', path, {'host.name': 'host'})
+
+            @tracing.traced('dmcrypt.luks_open', 'uuid')
+            def _open(key, uuid):
+                return tracing.headers()
+
+            with tracing.span('vaultlocker.decrypt'):
+                trace_id = tracing.trace_id()
+                headers = _open('secret', 'uuid-1')
+            tracing.shutdown()
+
+            with open(path) as spans:
+                spans = {span['name']: span
+                         for span in map(json.loads, spans)}
+
+        self.assertEqual(trace_id, headers['traceparent'].split('-')[1])
+        luks_open = spans['dmcrypt.luks_open']
+        self.assertEqual({'uuid': 'uuid-1'}, luks_open['attributes'])
+        self.assertEqual(spans['vaultlocker.decrypt']['context']['span_id'],
+                         luks_open['parent_id'])
+        self.assertEqual('host',
+                         luks_open['resource']['attributes']['host.name'])
+
+    @unittest.skipUnless(tracing.available(), 'OpenTelemetry not installed')
+    def test_file_exporter_coroutine(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'spans.jsonl')
+            tracing.configure('file', path)
+
+            @tracing.traced('dmcrypt.luks_open', 'uuid')
+            async def _open(key, uuid):
+                await asyncio.sleep(0.05)
+
+            asyncio.run(_open('secret', 'uuid-1'))
+            tracing.shutdown()
+
+            with open(path) as spans:
+                span = json.loads(spans.readline())
+
+        # the span covers the awaited body
+        start, end = (
+            datetime.datetime.fromisoformat(span[field].rstrip('Z'))
+            for field in ('start_time', 'end_time')
+        )
+        self.assertGreaterEqual((end - start).total_seconds(), 0.05)
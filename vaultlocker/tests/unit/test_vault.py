@@ -17,6 +17,8 @@ test_vault
 Tests for `vaultlocker.vault` module.
 """
 
+import os
+import tempfile
 from unittest import mock
 
 import hvac
@@ -68,6 +70,33 @@ class TestKVStoreV1(base.TestCase):
             )
         )
 
+    def test_write_rejects_check_and_set(self):
+        self.assertRaises(
+            ValueError,
+            self.store.write,
+            'host/device', {'dmcrypt_key': 'test-key'}, cas=0,
+        )
+        (
+            self.client.secrets.kv.v1.create_or_update_secret
+            .assert_not_called()
+        )
+
+    def test_list(self):
+        self.client.secrets.kv.v1.list_secrets.return_value = {
+            'data': {
+                'keys': ['uuid-1', 'uuid-2'],
+            },
+        }
+
+        self.assertEqual(['uuid-1', 'uuid-2'], self.store.list('host'))
+        (
+            self.client.secrets.kv.v1.list_secrets
+            .assert_called_once_with(
+                path='host',
+                mount_point='vaultlocker-v1',
+            )
+        )
+
     def test_read_raises(self):
         self.client.secrets.kv.v1.read_secret.side_effect = (
             hvac.exceptions.InvalidPath('missing')
@@ -103,6 +132,50 @@ class TestKVStoreV2(base.TestCase):
             )
         )
 
+    def test_write_returns_version_metadata(self):
+        self.client.secrets.kv.v2.create_or_update_secret.return_value = {
+            'data': {
+                'version': 2,
+                'created_time': '2026-01-01T00:00:00Z',
+            },
+        }
+
+        self.assertEqual(
+            {'version': 2, 'created_time': '2026-01-01T00:00:00Z'},
+            self.store.write('host/device', {'dmcrypt_key': 'test-key'}),
+        )
+
+    def test_write_check_and_set(self):
+        self.store.write('host', {'format': 1}, cas=3)
+
+        (
+            self.client.secrets.kv.v2
+            .create_or_update_secret
+            .assert_called_once_with(
+                path='host',
+                secret={'format': 1},
+                cas=3,
+                mount_point='vaultlocker-v2',
+            )
+        )
+
+    def test_read_version(self):
+        self.client.secrets.kv.v2.read_secret_version.return_value = {
+            'data': {
+                'data': {
+                    'format': 1,
+                },
+                'metadata': {
+                    'version': 7,
+                },
+            },
+        }
+
+        self.assertEqual(
+            ({'format': 1}, 7),
+            self.store.read_version('host'),
+        )
+
     def test_read_unwraps_nested_data(self):
         self.client.secrets.kv.v2.read_secret_version.return_value = {
             'data': {
@@ -132,6 +205,22 @@ class TestKVStoreV2(base.TestCase):
             )
         )
 
+    def test_list(self):
+        self.client.secrets.kv.v2.list_secrets.return_value = {
+            'data': {
+                'keys': ['uuid-1', 'headers/'],
+            },
+        }
+
+        self.assertEqual(['uuid-1', 'headers/'], self.store.list('host'))
+        (
+            self.client.secrets.kv.v2.list_secrets
+            .assert_called_once_with(
+                path='host',
+                mount_point='vaultlocker-v2',
+            )
+        )
+
     def test_read_raises(self):
         self.client.secrets.kv.v2.read_secret_version.side_effect = (
             hvac.exceptions.InvalidPath('missing')
@@ -181,3 +270,244 @@ class TestKVStoreFactory(base.TestCase):
             )
 
         self.assertIn("Unsupported kv_version '3'", str(error.exception))
+
+
+class TestAuth(base.TestCase):
+
+    def setUp(self):
+        super(TestAuth, self).setUp()
+        self.client = mock.MagicMock()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def _file(self, content):
+        path = os.path.join(self.root.name, 'credential')
+        with open(path, 'w') as credential:
+            credential.write(content)
+        return path
+
+    def test_approle(self):
+        vault.Auth.get_auth(
+            vault.AUTH_APPROLE, role_id='role', secret_id='secret',
+        ).login(self.client)
+
+        self.client.auth.approle.login.assert_called_once_with(
+            role_id='role', secret_id='secret',
+        )
+
+    def test_approle_mount_point(self):
+        vault.AppRoleAuth('role', 'secret', 'hosts').login(self.client)
+
+        self.client.auth.approle.login.assert_called_once_with(
+            role_id='role', secret_id='secret', mount_point='hosts',
+        )
+
+    def test_cert(self):
+        vault.Auth.get_auth(vault.AUTH_CERT, name='osd').login(self.client)
+
+        self.client.adapter.login.assert_called_once_with(
+            '/v1/auth/cert/login', json={'name': 'osd'},
+        )
+
+    def test_cert_any_role(self):
+        vault.CertAuth(mount_point='hosts-cert').login(self.client)
+
+        self.client.adapter.login.assert_called_once_with(
+            '/v1/auth/hosts-cert/login', json={},
+        )
+
+    def test_token_file(self):
+        path = self._file('s.token\n')
+
+        vault.Auth.get_auth(vault.AUTH_TOKEN_FILE,
+                            path=path).login(self.client)
+
+        self.assertEqual('s.token', self.client.token)
+        self.client.adapter.login.assert_not_called()
+
+    def test_token_file_empty(self):
+        auth = vault.TokenFileAuth(self._file(''))
+
+        self.assertRaises(ValueError, auth.login, self.client)
+
+    def test_jwt(self):
+        path = self._file('header.payload.signature\n')
+
+        vault.Auth.get_auth(vault.AUTH_JWT, role='osd',
+                            path=path).login(self.client)
+
+        self.client.auth.jwt.jwt_login.assert_called_once_with(
+            role='osd', jwt='header.payload.signature', path='jwt',
+        )
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, vault.Auth.get_auth, 'ldap')
+
+
+class TestGovernedAdapter(base.TestCase):
+
+    @mock.patch.object(hvac.adapters.JSONAdapter, 'request')
+    def test_request_is_governed(self, _request):
+        governor = mock.MagicMock()
+        adapter = vault.GovernedAdapter(
+            base_uri='https://vault.test.com', governor=governor,
+        )
+
+        result = adapter.get('/v1/secret/host/uuid')
+
+        governor.request.assert_called_once_with()
+        governor.request.return_value.__enter__.assert_called_once_with()
+        _request.assert_called_once_with(
+            'get', '/v1/secret/host/uuid', {'traceparent': mock.ANY}
+        )
+        self.assertIs(result, _request.return_value)
+
+    @mock.patch.object(hvac.adapters.JSONAdapter, 'request')
+    def test_no_governor(self, _request):
+        adapter = vault.GovernedAdapter(base_uri='https://vault.test.com')
+
+        adapter.get('/v1/secret/host/uuid')
+
+        _request.assert_called_once_with(
+            'get', '/v1/secret/host/uuid', {'traceparent': mock.ANY}
+        )
+
+
+class TestTracedAdapter(base.TestCase):
+
+    @mock.patch.object(hvac.adapters.JSONAdapter, 'request')
+    def test_traceparent(self, _request):
+        adapter = vault.TracedAdapter(base_uri='https://vault.test.com')
+
+        adapter.get('/v1/secret/host/uuid', headers={'X-Test': '1'})
+        adapter.get('/v1/secret/host/uuid')
+
+        first, second = [call[0][2] for call in _request.call_args_list]
+        self.assertEqual('1', first['X-Test'])
+        version, trace_id, span_id, flags = first['traceparent'].split('-')
+        self.assertEqual(('00', 32, 16, '01'),
+                         (version, len(trace_id), len(span_id), flags))
+        # one trace per process, one span per request
+        self.assertEqual(trace_id, second['traceparent'].split('-')[1])
+        self.assertNotEqual(span_id, second['traceparent'].split('-')[2])
+
+
+class TestCASConflict(base.TestCase):
+
+    def test_cas_conflict(self):
+        self.assertTrue(vault.is_cas_conflict(
+            hvac.exceptions.InvalidRequest(
+                'check-and-set parameter did not match the current version'
+            )
+        ))
+
+    def test_other_errors(self):
+        self.assertFalse(vault.is_cas_conflict(
+            hvac.exceptions.InvalidRequest('invalid path')
+        ))
+        self.assertFalse(vault.is_cas_conflict(
+            hvac.exceptions.Forbidden('check-and-set')
+        ))
+
+
+class TestTransitKeyWrapper(base.TestCase):
+
+    def setUp(self):
+        super(TestTransitKeyWrapper, self).setUp()
+        self.client = mock.MagicMock()
+        self.wrapper = vault.TransitKeyWrapper(
+            self.client, 'transit', 'vaultlocker-host',
+        )
+
+    def test_wrap_batches_keys(self):
+        self.client.secrets.transit.encrypt_data.return_value = {
+            'data': {
+                'batch_results': [
+                    {'ciphertext': 'vault:v1:one'},
+                    {'ciphertext': 'vault:v1:two'},
+                ],
+            },
+        }
+
+        self.assertEqual(
+            ['vault:v1:one', 'vault:v1:two'],
+            self.wrapper.wrap(['a2V5MQ==', 'a2V5Mg==']),
+        )
+        self.client.secrets.transit.encrypt_data.assert_called_once_with(
+            name='vaultlocker-host',
+            batch_input=[
+                {'plaintext': 'a2V5MQ=='},
+                {'plaintext': 'a2V5Mg=='},
+            ],
+            mount_point='transit',
+        )
+
+    def test_unwrap_batches_ciphertexts(self):
+        self.client.secrets.transit.decrypt_data.return_value = {
+            'data': {
+                'batch_results': [
+                    {'plaintext': 'a2V5MQ=='},
+                    {'plaintext': 'a2V5Mg=='},
+                ],
+            },
+        }
+
+        self.assertEqual(
+            ['a2V5MQ==', 'a2V5Mg=='],
+            self.wrapper.unwrap(['vault:v1:one', 'vault:v1:two']),
+        )
+        self.client.secrets.transit.decrypt_data.assert_called_once_with(
+            name='vaultlocker-host',
+            batch_input=[
+                {'ciphertext': 'vault:v1:one'},
+                {'ciphertext': 'vault:v1:two'},
+            ],
+            mount_point='transit',
+        )
+
+    def test_unwrap_raises_on_batch_error(self):
+        self.client.secrets.transit.decrypt_data.return_value = {
+            'data': {
+                'batch_results': [
+                    {'error': 'cipher: message authentication failed'},
+                ],
+            },
+        }
+
+        self.assertRaises(
+            hvac.exceptions.InvalidRequest,
+            self.wrapper.unwrap,
+            ['vault:v1:broken'],
+        )
+
+
+class TestResponseWrapping(base.TestCase):
+
+    def test_wrap(self):
+        client = mock.MagicMock()
+        client.adapter.post.return_value = {
+            'wrap_info': {
+                'token': 'wrapping-token',
+            },
+        }
+
+        self.assertEqual(
+            'wrapping-token',
+            vault.wrap(client, {'keys': {}}, '5m'),
+        )
+        client.adapter.post.assert_called_once_with(
+            '/v1/sys/wrapping/wrap',
+            json={'keys': {}},
+            headers={'X-Vault-Wrap-TTL': '5m'},
+        )
+
+    def test_unwrap(self):
+        client = mock.MagicMock()
+        client.sys.unwrap.return_value = {
+            'data': {
+                'keys': {},
+            },
+        }
+
+        self.assertEqual({'keys': {}}, vault.unwrap(client, 'token'))
+        client.sys.unwrap.assert_called_once_with(token='token')
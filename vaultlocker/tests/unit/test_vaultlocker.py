@@ -19,14 +19,26 @@ test_vaultlocker
 Tests for `vaultlocker` module.
 """
 
+import argparse
 import configparser
+import hashlib
+import io
+import json
+import os
+import re
+import shlex
+import shutil
 import subprocess
+import tempfile
 
 from unittest import mock
 
 import hvac
+import tenacity
 
 from vaultlocker import exceptions
+from vaultlocker import headers
+from vaultlocker import journal
 from vaultlocker import shell
 from vaultlocker.tests.unit import base
 
@@ -51,6 +63,16 @@ class TestVaultlocker(base.TestCase):
             )
         self.config.get.side_effect = side_effect
 
+    def setUp(self):
+        super(TestVaultlocker, self).setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.journal = journal.Journal(os.path.join(root.name, 'journal'))
+        patcher = mock.patch.object(shell, '_journal',
+                                    return_value=self.journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def _hostname_config(self, hostname=None):
         config = configparser.ConfigParser()
         config.add_section('vault')
@@ -60,6 +82,151 @@ class TestVaultlocker(base.TestCase):
 
         return config
 
+    @mock.patch.object(shell.hvac, 'Client')
+    def test_vault_client_governed(self, _client):
+        config = self._hostname_config()
+        for option, value in self._test_config.items():
+            config.set('vault', option, value)
+        config.set('vault', 'rate_limit', '20')
+        config.set('vault', 'max_in_flight', '4')
+
+        shell._vault_client(config)
+
+        kwargs = _client.call_args.kwargs
+        self.assertIs(kwargs['adapter'], shell.vault.GovernedAdapter)
+        self.assertEqual(20, kwargs['governor'].bucket.rate)
+        self.assertIsNotNone(kwargs['governor'].slots)
+
+        # a retry builds a new client sharing the limits of the first
+        shell._vault_client(config)
+
+        self.assertIs(kwargs['governor'], _client.call_args.kwargs['governor'])
+
+        # an adapter given by the caller still gets the governor
+        adapter = type('Adapter', (shell.vault.GovernedAdapter,), {})
+        shell._vault_client(config, adapter)
+
+        self.assertIs(adapter, _client.call_args.kwargs['adapter'])
+        self.assertIs(kwargs['governor'], _client.call_args.kwargs['governor'])
+
+    @mock.patch.object(shell, 'tls')
+    @mock.patch.object(shell.hvac, 'Client')
+    def test_vault_client_preloaded_tls(self, _client, _tls):
+        config = self._hostname_config()
+        for option, value in self._test_config.items():
+            config.set('vault', option, value)
+        config.set('vault', 'preload_tls', 'true')
+        config.set('vault', 'ca_bundle', '/etc/ssl/vault-ca.pem')
+        config.set('vault', 'client_cert', '/etc/ssl/client.pem')
+
+        shell._vault_client(config)
+
+        _tls.client_context.assert_called_once_with(
+            '/etc/ssl/vault-ca.pem', '/etc/ssl/client.pem', None
+        )
+        _tls.session.assert_called_once_with(
+            _tls.client_context.return_value
+        )
+        self.assertIs(_tls.session.return_value,
+                      _client.call_args.kwargs['session'])
+
+    def test_vault_auth_cert(self):
+        config = self._hostname_config()
+        config.set('vault', 'auth_method', 'cert')
+        config.set('vault', 'cert_role', 'osd')
+
+        auth = shell._vault_auth(config)
+
+        self.assertIsInstance(auth, shell.vault.CertAuth)
+        self.assertEqual('osd', auth.name)
+        self.assertEqual('cert', auth.mount_point)
+
+    def test_vault_auth_mount(self):
+        config = self._hostname_config()
+        config.set('vault', 'auth_method', 'jwt')
+        config.set('vault', 'jwt_role', 'osd')
+        config.set('vault', 'jwt_file', '/run/secrets/token')
+        config.set('vault', 'auth_mount', 'oidc')
+
+        auth = shell._vault_auth(config)
+
+        self.assertEqual('oidc', auth.mount_point)
+        self.assertEqual('/run/secrets/token', auth.path)
+
+    def test_vault_auth_missing_option(self):
+        config = self._hostname_config()
+        config.set('vault', 'auth_method', 'token_file')
+
+        self.assertRaises(ValueError, shell._vault_auth, config)
+
+    def test_vault_auth_invalid_method(self):
+        config = self._hostname_config()
+        config.set('vault', 'auth_method', 'ldap')
+
+        self.assertRaises(ValueError, shell._vault_auth, config)
+
+    def test_governor_unset(self):
+        self.assertIsNone(shell._governor(self._hostname_config()))
+
+    def test_governor_invalid(self):
+        config = self._hostname_config()
+        config.set('vault', 'max_in_flight', 'many')
+
+        self.assertRaises(ValueError, shell._governor, config)
+
+    def test_tracing_unset(self):
+        self.assertIsNone(shell._get_tracing(self._hostname_config()))
+
+    def test_tracing_invalid_exporter(self):
+        config = self._hostname_config()
+        config.add_section('tracing')
+        config.set('tracing', 'exporter', 'zipkin')
+
+        self.assertRaises(ValueError, shell._get_tracing, config)
+
+    @mock.patch.object(shell.tracing, 'available', return_value=True)
+    def test_tracing_file(self, _available):
+        config = self._hostname_config()
+        config.add_section('tracing')
+        config.set('tracing', 'exporter', 'file')
+
+        self.assertRaises(ValueError, shell._get_tracing, config)
+        config.set('tracing', 'path', '/var/log/vaultlocker/spans.jsonl')
+        self.assertEqual(('file', '/var/log/vaultlocker/spans.jsonl'),
+                         shell._get_tracing(config))
+
+    def test_bare_option_argv(self):
+        self.assertEqual(
+            ['--profile=', 'encrypt', '/dev/sdb'],
+            shell._bare_option_argv(['--profile', 'encrypt', '/dev/sdb']),
+        )
+        self.assertEqual(
+            ['--profile=/tmp/vl.pstats', 'decrypt', 'test-uuid'],
+            shell._bare_option_argv(['--profile=/tmp/vl.pstats', 'decrypt',
+                                     'test-uuid']),
+        )
+        self.assertEqual(
+            ['--config-cache=' + shell.DEFAULT_CONFIG_CACHE, 'decrypt',
+             'test-uuid'],
+            shell._bare_option_argv(['--config-cache', 'decrypt',
+                                     'test-uuid']),
+        )
+
+    @mock.patch.object(shell, '_get_tracing', return_value=None)
+    @mock.patch.object(shell, 'get_config')
+    @mock.patch.object(shell, 'decrypt')
+    def test_main_bare_config_cache(self, _decrypt, _get_config,
+                                    _get_tracing):
+        _decrypt.__name__ = 'decrypt'
+        argv = ['vaultlocker', '--config-cache', 'decrypt', 'test-uuid']
+        with mock.patch.object(shell.sys, 'argv', argv):
+            shell.main()
+
+        _get_config.assert_called_once_with(shell.DEFAULT_CONF_FILE,
+                                            shell.DEFAULT_CONFIG_CACHE)
+        args = _decrypt.call_args.args[0]
+        self.assertEqual(['test-uuid'], args.uuid)
+
     @mock.patch.object(shell.hvac, 'Client')
     def test_vault_client_uses_approle_login(self, _client):
         client = _client.return_value
@@ -102,6 +269,8 @@ class TestVaultlocker(base.TestCase):
         args = mock.MagicMock()
         args.uuid = 'passed-UUID'
         args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
 
         client = mock.MagicMock()
 
@@ -114,7 +283,7 @@ class TestVaultlocker(base.TestCase):
         store.read.assert_called_once_with('host/passed-UUID')
 
         _dmcrypt.luks_format.assert_called_once_with(
-            'testkey', '/dev/sdb', 'passed-UUID'
+            'testkey', '/dev/sdb', 'passed-UUID', header=None
         )
         _dmcrypt.luks_open.assert_called_once_with(
             'testkey', 'passed-UUID'
@@ -123,6 +292,239 @@ class TestVaultlocker(base.TestCase):
             'vaultlocker-decrypt@passed-UUID.service'
         )
 
+    @mock.patch.object(shell, '_stable_device_path')
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_encrypt_detached_header(self, _dmcrypt, _systemd, _vault_store,
+                                     _get_hostname, _header_dir,
+                                     _stable_device_path):
+        header_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, header_dir)
+        _header_dir.return_value = header_dir
+        _stable_device_path.return_value = '/dev/disk/by-id/ata-HDD_1'
+        _get_hostname.return_value = 'host'
+        _dmcrypt.generate_key.return_value = 'testkey'
+        store = _vault_store.return_value
+        store.read.return_value = {'dmcrypt_key': 'testkey'}
+        header = os.path.join(header_dir, 'passed-UUID.luks')
+
+        def _luks_header_backup(uuid, backup_file, header):
+            with open(backup_file, 'wb') as backup:
+                backup.write(b'LUKS\xba\xbe')
+        _dmcrypt.luks_header_backup.side_effect = _luks_header_backup
+
+        args = mock.MagicMock()
+        args.uuid = 'passed-UUID'
+        args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = True
+        args.backup_header = True
+
+        shell._encrypt_block_device(args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_format.assert_called_once_with(
+            'testkey', '/dev/disk/by-id/ata-HDD_1', 'passed-UUID',
+            header=header
+        )
+        _dmcrypt.udevadm_rescan.assert_not_called()
+        _dmcrypt.luks_open.assert_called_once_with(
+            'testkey', 'passed-UUID', header=header,
+            device='/dev/disk/by-id/ata-HDD_1'
+        )
+        _dmcrypt.luks_header_backup.assert_called_once_with(
+            'passed-UUID', mock.ANY, header=header
+        )
+        store.write.assert_called_with('host/headers/passed-UUID', {
+            'device': '/dev/disk/by-id/ata-HDD_1', 'detached': True,
+            'format': headers.BACKUP_FORMAT, 'compression': 'zlib',
+            'chunks': 1, 'size': 6,
+            'sha256': hashlib.sha256(b'LUKS\xba\xbe').hexdigest(),
+        })
+        self.assertEqual(
+            {'uuid': 'passed-UUID', 'device': '/dev/disk/by-id/ata-HDD_1',
+             'header': header},
+            headers.lookup('passed-UUID', header_dir),
+        )
+
+    @mock.patch.object(shell, '_backup_header')
+    @mock.patch.object(shell, '_list_device_uuids')
+    @mock.patch.object(shell, '_vault_store')
+    def test_header_backup(self, _vault_store, _list_device_uuids,
+                           _backup_header):
+        _list_device_uuids.return_value = ['uuid-2', 'uuid-1']
+        _backup_header.return_value = {'size': 16 << 20, 'chunks': 1}
+        args = mock.MagicMock()
+        args.uuid = []
+        args.parallel = 2
+
+        shell._header_backup(args, mock.MagicMock(), self.config)
+
+        self.assertEqual(
+            [mock.call(_vault_store.return_value, 'uuid-1', self.config,
+                       None),
+             mock.call(_vault_store.return_value, 'uuid-2', self.config,
+                       None)],
+            sorted(_backup_header.call_args_list,
+                   key=lambda call: call[0][1]),
+        )
+
+    def _restore_args(self, block_uuids=('uuid-1',), device=None,
+                      force=False):
+        args = mock.MagicMock()
+        args.uuid = list(block_uuids)
+        args.device = device
+        args.force = force
+        args.parallel = 4
+        return args
+
+    def _load_backup(self, description):
+        def _load(store, path, backup_file):
+            with open(backup_file, 'wb') as backup:
+                backup.write(b'LUKS\xba\xbe')
+            return description
+        return _load
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.headers, 'load_backup')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_header_restore(self, _dmcrypt, _vault_store, _get_hostname,
+                            _load_backup, _device_locks):
+        _get_hostname.return_value = 'host'
+        with tempfile.NamedTemporaryFile() as device:
+            _load_backup.side_effect = self._load_backup(
+                {'device': device.name, 'detached': False})
+            _dmcrypt.luks_uuid.return_value = None
+
+            shell._header_restore(self._restore_args(), mock.MagicMock(),
+                                  self.config)
+
+            _load_backup.assert_called_once_with(
+                _vault_store.return_value, 'host/headers/uuid-1', mock.ANY)
+            _dmcrypt.luks_header_restore.assert_called_once_with(
+                device.name, mock.ANY)
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.headers, 'load_backup')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_header_restore_intact(self, _dmcrypt, _vault_store,
+                                   _get_hostname, _load_backup,
+                                   _device_locks):
+        calls = []
+        _device_locks.return_value.__enter__.side_effect = (
+            lambda: calls.append('locked'))
+        with tempfile.NamedTemporaryFile() as device:
+            _load_backup.side_effect = self._load_backup(
+                {'device': device.name, 'detached': False})
+            _dmcrypt.luks_uuid.side_effect = (
+                lambda target: calls.append('checked') or 'uuid-1')
+
+            shell._header_restore(self._restore_args(), mock.MagicMock(),
+                                  self.config)
+
+            _device_locks.assert_called_once_with(self.config, 'uuid-1',
+                                                  device.name)
+            self.assertEqual(['locked', 'checked'], calls)
+            _dmcrypt.luks_header_restore.assert_not_called()
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.headers, 'load_backup')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_header_restore_other_device(self, _dmcrypt, _vault_store,
+                                         _get_hostname, _load_backup,
+                                         _device_locks):
+        with tempfile.NamedTemporaryFile() as device:
+            _load_backup.side_effect = self._load_backup(
+                {'device': '/dev/disk/by-id/ata-HDD_1', 'detached': False})
+            _dmcrypt.luks_uuid.return_value = 'uuid-2'
+
+            self.assertRaises(exceptions.VaultlockerException,
+                              shell._header_restore,
+                              self._restore_args(device=device.name),
+                              mock.MagicMock(), self.config)
+
+            _dmcrypt.luks_uuid.assert_called_once_with(device.name)
+            _dmcrypt.luks_header_restore.assert_not_called()
+
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.headers, 'load_backup')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_header_restore_detached(self, _dmcrypt, _vault_store,
+                                     _get_hostname, _load_backup,
+                                     _device_locks, _header_dir):
+        header_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, header_dir)
+        _header_dir.return_value = header_dir
+        _load_backup.side_effect = self._load_backup(
+            {'device': '/dev/disk/by-id/ata-HDD_1', 'detached': True})
+
+        shell._header_restore(self._restore_args(), mock.MagicMock(),
+                              self.config)
+
+        detached = headers.lookup('uuid-1', header_dir)
+        self.assertEqual('/dev/disk/by-id/ata-HDD_1', detached['device'])
+        with open(detached['header'], 'rb') as header:
+            self.assertEqual(b'LUKS\xba\xbe', header.read())
+        _dmcrypt.luks_header_restore.assert_not_called()
+
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.headers, 'load_backup')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_header_restore_detached_no_device(self, _dmcrypt, _vault_store,
+                                               _get_hostname, _load_backup,
+                                               _device_locks, _header_dir):
+        header_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, header_dir)
+        _header_dir.return_value = header_dir
+        _load_backup.side_effect = self._load_backup(
+            {'device': None, 'detached': True})
+
+        self.assertRaises(exceptions.VaultlockerException,
+                          shell._header_restore, self._restore_args(),
+                          mock.MagicMock(), self.config)
+
+        self.assertIsNone(headers.lookup('uuid-1', header_dir))
+        self.assertFalse(os.path.exists(
+            headers.header_path('uuid-1', header_dir)))
+
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_decrypt_detached_header(self, _dmcrypt, _vault_store,
+                                     _header_dir):
+        header_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, header_dir)
+        _header_dir.return_value = header_dir
+        header = headers.register('uuid-1', '/dev/disk/by-id/ata-HDD_1',
+                                  header_dir)
+        _vault_store.return_value.read.return_value = {
+            'dmcrypt_key': 'testkey',
+        }
+        _dmcrypt.luks_open.return_value = 'crypt-uuid-1'
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+
+        shell._decrypt_block_device(args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_open.assert_called_once_with(
+            'testkey', 'uuid-1', header=header,
+            device='/dev/disk/by-id/ata-HDD_1',
+        )
+
     @mock.patch.object(shell, 'get_hostname')
     @mock.patch.object(shell, '_vault_store')
     @mock.patch.object(shell, 'systemd')
@@ -140,6 +542,8 @@ class TestVaultlocker(base.TestCase):
         args = mock.MagicMock()
         args.uuid = 'passed-UUID'
         args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
 
         client = mock.MagicMock()
 
@@ -177,6 +581,24 @@ class TestVaultlocker(base.TestCase):
             'testkey', 'passed-UUID'
         )
 
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, 'get_hostname', return_value='host')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_decrypt_given_open(self, _dmcrypt, _vault_store, _get_hostname,
+                                _device_exists):
+        _vault_store.return_value.read.return_value = {
+            'dmcrypt_key': 'testkey',
+        }
+        luks_open = mock.MagicMock()
+
+        shell._decrypt_block_device(mock.MagicMock(uuid=['passed-UUID']),
+                                    mock.MagicMock(), self.config,
+                                    luks_open=luks_open)
+
+        luks_open.assert_called_once_with('testkey', 'passed-UUID', None)
+        _dmcrypt.luks_open.assert_not_called()
+
     @mock.patch.object(shell, '_device_exists', return_value=False)
     @mock.patch.object(shell, 'get_hostname')
     @mock.patch.object(shell, '_vault_store')
@@ -237,6 +659,91 @@ class TestVaultlocker(base.TestCase):
 
         _vault_store.assert_not_called()
 
+    @mock.patch.object(shell, '_transit_wrapper')
+    @mock.patch.object(shell, '_get_key_wrapping', return_value='transit')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_encrypt_transit_wrapped(self, _dmcrypt, _systemd, _vault_store,
+                                     _get_hostname, _get_key_wrapping,
+                                     _transit_wrapper):
+        _get_hostname.return_value = 'host'
+        _dmcrypt.generate_key.return_value = 'testkey'
+        _transit_wrapper.return_value.wrap.return_value = ['vault:v1:abc']
+
+        store = _vault_store.return_value
+        store.read.return_value = {
+            'wrapped_key': 'vault:v1:abc',
+        }
+
+        args = mock.MagicMock()
+        args.uuid = 'passed-UUID'
+        args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
+
+        shell._encrypt_block_device(args, mock.MagicMock(), self.config)
+
+        _transit_wrapper.return_value.wrap.assert_called_once_with(
+            ['testkey']
+        )
+        store.write.assert_called_once_with(
+            'host/passed-UUID',
+            {'wrapped_key': 'vault:v1:abc'},
+        )
+        _dmcrypt.luks_format.assert_called_once_with(
+            'testkey', '/dev/sdb', 'passed-UUID', header=None
+        )
+
+    @mock.patch.object(shell, '_transit_wrapper')
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_decrypt_transit_wrapped(self, _dmcrypt, _vault_store,
+                                     _get_hostname, _device_exists,
+                                     _transit_wrapper):
+        _get_hostname.return_value = 'host'
+        _transit_wrapper.return_value.unwrap.return_value = ['testkey']
+
+        store = _vault_store.return_value
+        store.read.return_value = {
+            'wrapped_key': 'vault:v1:abc',
+        }
+
+        args = mock.MagicMock()
+        args.uuid = ['passed-UUID']
+
+        shell._decrypt_block_device(args, mock.MagicMock(), self.config)
+
+        _transit_wrapper.return_value.unwrap.assert_called_once_with(
+            ['vault:v1:abc']
+        )
+        _dmcrypt.luks_open.assert_called_once_with(
+            'testkey', 'passed-UUID'
+        )
+
+    @mock.patch.object(shell, '_transit_wrapper')
+    def test_unwrap_keys_single_batch(self, _transit_wrapper):
+        _transit_wrapper.return_value.unwrap.return_value = ['key-2', 'key-3']
+
+        self.assertEqual(
+            {'uuid-1': 'key-1', 'uuid-2': 'key-2', 'uuid-3': 'key-3'},
+            shell._unwrap_keys(
+                {
+                    'uuid-1': {'dmcrypt_key': 'key-1'},
+                    'uuid-2': {'wrapped_key': 'vault:v1:two'},
+                    'uuid-3': {'wrapped_key': 'vault:v1:three'},
+                },
+                mock.MagicMock(),
+                self.config,
+            ),
+        )
+        _transit_wrapper.return_value.unwrap.assert_called_once_with(
+            ['vault:v1:two', 'vault:v1:three']
+        )
+
     @mock.patch.object(shell, 'get_hostname')
     def test_get_vault_path(self, _get_hostname):
         _get_hostname.return_value = 'myhost'
@@ -266,6 +773,8 @@ class TestVaultlocker(base.TestCase):
         args = mock.MagicMock()
         args.uuid = 'passed-UUID'
         args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
 
         client = mock.MagicMock()
 
@@ -292,6 +801,8 @@ class TestVaultlocker(base.TestCase):
         args = mock.MagicMock()
         args.uuid = 'passed-UUID'
         args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
 
         client = mock.MagicMock()
 
@@ -315,6 +826,8 @@ class TestVaultlocker(base.TestCase):
         args = mock.MagicMock()
         args.uuid = 'passed-UUID'
         args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
 
         client = mock.MagicMock()
 
@@ -324,88 +837,1293 @@ class TestVaultlocker(base.TestCase):
             args, client, self.config
         )
 
-    @mock.patch.object(shell, 'socket')
-    @mock.patch.object(shell, 'platform')
-    def test_get_hostname_uses_configured_value(self, _platform, _socket):
-        self.assertEqual(
-            'configured-host',
-            shell.get_hostname(
-                self._hostname_config('configured-host')
-            ),
-        )
-
-        _platform.node.assert_not_called()
-        _socket.gethostname.assert_not_called()
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    def test_read_host_keys_skips_sub_paths(self, _vault_store,
+                                            _get_hostname):
+        _get_hostname.return_value = 'host'
 
-    @mock.patch.object(shell, 'socket')
-    @mock.patch.object(shell, 'platform')
-    def test_get_hostname_uses_platform_node(self, _platform, _socket):
-        _platform.node.return_value = 'node-host'
+        store = _vault_store.return_value
+        store.list.return_value = ['uuid-1', 'headers/', 'uuid-2']
+        store.read.side_effect = lambda path: {
+            'dmcrypt_key': 'key-for-{}'.format(path),
+        }
 
         self.assertEqual(
-            'node-host',
-            shell.get_hostname(self._hostname_config()),
+            {
+                'uuid-1': 'key-for-host/uuid-1',
+                'uuid-2': 'key-for-host/uuid-2',
+            },
+            shell._read_host_keys(store, self.config, workers=2),
         )
+        store.list.assert_called_once_with('host')
 
-        _socket.gethostname.assert_not_called()
+    @mock.patch.object(shell, 'get_hostname')
+    def test_read_host_keys_missing_host(self, _get_hostname):
+        _get_hostname.return_value = 'host'
+        store = mock.MagicMock()
+        store.list.side_effect = hvac.exceptions.InvalidPath('missing')
 
-    @mock.patch.object(shell, 'socket')
-    @mock.patch.object(shell, 'platform')
-    def test_get_hostname_uses_socket_fallback(self, _platform, _socket):
-        _platform.node.return_value = ''
-        _socket.gethostname.return_value = 'socket-host'
+        self.assertEqual({}, shell._read_host_keys(store, self.config))
 
-        self.assertEqual(
-            'socket-host',
-            shell.get_hostname(self._hostname_config()),
-        )
+    @mock.patch.object(shell, '_open_output')
+    @mock.patch.object(shell, 'vault')
+    @mock.patch.object(shell, '_read_host_keys')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    def test_export_keys(self, _vault_store, _get_hostname,
+                         _read_host_keys, _vault, _open_output):
+        _get_hostname.return_value = 'host'
+        _read_host_keys.return_value = {'uuid-1': 'key-1'}
+        _vault.wrap.return_value = 'wrapping-token'
+        output = io.StringIO()
+        output.close = mock.MagicMock()
+        _open_output.return_value = output
 
-        _socket.gethostname.assert_called_once_with()
+        args = mock.MagicMock()
+        args.output = '/tmp/export.json'
+        args.wrap_ttl = '5m'
+        args.workers = 4
 
-    @mock.patch.object(shell, 'socket')
-    @mock.patch.object(shell, 'platform')
-    def test_get_hostname_raises_when_socket_fails(self, _platform, _socket):
-        _platform.node.return_value = ''
-        _socket.gethostname.side_effect = OSError('no hostname')
+        client = mock.MagicMock()
 
-        with self.assertRaises(RuntimeError) as error:
-            shell.get_hostname(self._hostname_config())
+        shell._export_keys(args, client, self.config)
 
-        self.assertIn(
-            'Unable to determine hostname',
-            str(error.exception),
+        _vault.wrap.assert_called_once_with(
+            client,
+            {
+                'version': shell.EXPORT_FORMAT_VERSION,
+                'hostname': 'host',
+                'keys': {'uuid-1': 'key-1'},
+            },
+            '5m',
+        )
+        self.assertEqual(
+            {
+                'hostname': 'host',
+                'count': 1,
+                'wrap_ttl': '5m',
+                'wrap_token': 'wrapping-token',
+            },
+            json.loads(output.getvalue()),
         )
 
+    @mock.patch.object(shell, '_vault_client')
+    @mock.patch.object(shell, '_open_input')
+    @mock.patch.object(shell, 'vault')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    def test_import_keys(self, _vault_store, _get_hostname, _vault,
+                         _open_input, _vault_client):
+        _get_hostname.return_value = 'new-host'
+        _open_input.return_value = io.StringIO(
+            json.dumps({'wrap_token': 'wrapping-token'})
+        )
+        _vault.unwrap.return_value = {
+            'version': shell.EXPORT_FORMAT_VERSION,
+            'hostname': 'old-host',
+            'keys': {'uuid-1': 'key-1', 'uuid-2': 'key-2'},
+        }
+        store = _vault_store.return_value
+        store.list.side_effect = hvac.exceptions.InvalidPath()
+        store.read.side_effect = lambda path: {
+            'dmcrypt_key': {
+                'new-host/uuid-1': 'key-1',
+                'new-host/uuid-2': 'key-2',
+            }[path],
+        }
 
-class TestKVConfiguration(base.TestCase):
+        args = mock.MagicMock()
+        args.input = '/tmp/export.json'
+        args.force = False
+        args.workers = 2
+        args.retry = -1
+
+        shell.import_keys(args, self.config)
+
+        _vault.unwrap.assert_called_once_with(_vault_client.return_value,
+                                              'wrapping-token')
+        store.write.assert_has_calls(
+            [
+                mock.call('new-host/uuid-1', {'dmcrypt_key': 'key-1'}),
+                mock.call('new-host/uuid-2', {'dmcrypt_key': 'key-2'}),
+            ],
+            any_order=True,
+        )
 
-    def _config(self, kv_version=None):
-        config = configparser.ConfigParser()
-        config.add_section('vault')
-        config.set('vault', 'backend', 'vaultlocker-test')
+    @mock.patch.object(shell, '_open_input')
+    @mock.patch.object(shell, 'vault')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    def test_import_keys_verification_failure(self, _vault_store,
+                                              _get_hostname, _vault,
+                                              _open_input):
+        _get_hostname.return_value = 'new-host'
+        _open_input.return_value = io.StringIO(
+            json.dumps({'wrap_token': 'wrapping-token'})
+        )
+        _vault.unwrap.return_value = {
+            'version': shell.EXPORT_FORMAT_VERSION,
+            'hostname': 'old-host',
+            'keys': {'uuid-1': 'key-1'},
+        }
+        store = _vault_store.return_value
+        store.read.return_value = {'dmcrypt_key': 'brokendata'}
 
-        if kv_version is not None:
-            config.set('vault', 'kv_version', kv_version)
+        args = mock.MagicMock()
+        args.input = '/tmp/export.json'
+        args.force = False
+        args.workers = 2
 
-        return config
+        client = mock.MagicMock()
+        payload = shell._unwrap_export(args, client)
 
-    def test_kv_version_defaults_to_one(self):
-        self.assertEqual(
-            '1',
-            shell._get_kv_version(self._config()),
+        self.assertRaises(
+            exceptions.VaultKeyMismatch,
+            shell._import_keys,
+            payload, args, client, self.config
         )
 
-    def test_kv_version_one(self):
-        self.assertEqual(
-            '1',
-            shell._get_kv_version(self._config('1')),
+    @mock.patch.object(shell, 'get_hostname', return_value='new-host')
+    @mock.patch.object(shell, '_vault_store')
+    def test_import_keys_existing(self, _vault_store, _get_hostname):
+        store = _vault_store.return_value
+        store.list.return_value = ['uuid-1', 'uuid-2']
+        store.read.side_effect = lambda path: {
+            'dmcrypt_key': {
+                'new-host/uuid-1': 'key-1',
+                'new-host/uuid-2': 'stale-key',
+            }[path],
+        }
+        payload = {
+            'version': shell.EXPORT_FORMAT_VERSION,
+            'hostname': 'old-host',
+            'keys': {'uuid-1': 'key-1', 'uuid-2': 'key-2'},
+        }
+        args = mock.MagicMock()
+        args.workers = 1
+        args.force = False
+
+        self.assertRaises(exceptions.VaultlockerException,
+                          shell._import_keys, payload, args,
+                          mock.MagicMock(), self.config)
+        store.write.assert_not_called()
+
+        args.force = True
+        store.read.side_effect = [
+            {'dmcrypt_key': 'key-1'}, {'dmcrypt_key': 'stale-key'},
+            {'dmcrypt_key': 'key-2'},
+        ]
+        shell._import_keys(payload, args, mock.MagicMock(), self.config)
+
+        store.write.assert_called_once_with('new-host/uuid-2',
+                                            {'dmcrypt_key': 'key-2'})
+
+    @mock.patch.object(shell.tenacity, 'wait_fixed',
+                       return_value=tenacity.wait_none())
+    @mock.patch.object(shell, '_vault_client')
+    @mock.patch.object(shell, '_open_input')
+    @mock.patch.object(shell, 'vault')
+    @mock.patch.object(shell, 'get_hostname')
+    @mock.patch.object(shell, '_vault_store')
+    def test_import_keys_retries_writes_only(self, _vault_store,
+                                             _get_hostname, _vault,
+                                             _open_input, _vault_client,
+                                             _wait_fixed):
+        _get_hostname.return_value = 'new-host'
+        _open_input.return_value = io.StringIO(
+            json.dumps({'wrap_token': 'wrapping-token'})
         )
+        _vault.unwrap.return_value = {
+            'version': shell.EXPORT_FORMAT_VERSION,
+            'hostname': 'old-host',
+            'keys': {'uuid-1': 'key-1'},
+        }
+        store = _vault_store.return_value
+        store.write.side_effect = [hvac.exceptions.VaultDown(), None]
+        store.read.return_value = {'dmcrypt_key': 'key-1'}
+        args = mock.MagicMock()
+        args.input = '/tmp/export.json'
+        args.force = False
+        args.workers = 1
+        args.retry = 60
+        args.stagger = False
 
-    def test_kv_version_two(self):
-        self.assertEqual(
-            '2',
-            shell._get_kv_version(self._config('2')),
-        )
+        shell.import_keys(args, self.config)
+
+        _vault.unwrap.assert_called_once()
+        self.assertEqual(2, store.write.call_count)
+
+    @mock.patch.object(shell, '_write_verified_key')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_encrypt_journal_crash(self, _dmcrypt, _systemd, _vault_store,
+                                   _write_verified_key):
+        _dmcrypt.generate_key.return_value = 'testkey'
+        _dmcrypt.luks_format.side_effect = KeyboardInterrupt
+        args = mock.MagicMock()
+        args.uuid = 'passed-UUID'
+        args.block_device = ['/dev/sdb']
+        args.priority = 'os'
+        args.detached_header = False
+
+        self.assertRaises(KeyboardInterrupt, shell._encrypt_block_device,
+                          args, mock.MagicMock(), self.config)
+
+        entry = self.journal.get('passed-UUID')
+        self.assertEqual(journal.PHASE_KEY_STORED, entry['phase'])
+        self.assertEqual('/dev/sdb', entry['block_device'])
+        self.assertEqual('os', entry['priority'])
+
+    @mock.patch.object(shell, '_write_verified_key')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_encrypt_journal_key_write_failure(self, _dmcrypt, _vault_store,
+                                               _write_verified_key):
+        _write_verified_key.side_effect = exceptions.VaultKeyMismatch('p')
+        args = mock.MagicMock()
+        args.uuid = 'passed-UUID'
+        args.block_device = ['/dev/sdb']
+        args.priority = None
+        args.detached_header = False
+
+        self.assertRaises(exceptions.VaultKeyMismatch,
+                          shell._encrypt_block_device,
+                          args, mock.MagicMock(), self.config)
+
+        self.assertEqual([], self.journal.entries())
+
+    @mock.patch.object(shell, 'get_hostname', return_value='host')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_resume(self, _dmcrypt, _systemd, _vault_store, _device_exists,
+                    _device_locks, _get_hostname):
+        store = _vault_store.return_value
+        store.read.return_value = {'dmcrypt_key': 'testkey'}
+        self.journal.record('uuid-1', journal.PHASE_STARTED,
+                            block_device='/dev/sdb', priority=None)
+        self.journal.record('uuid-2', journal.PHASE_FORMATTED,
+                            block_device='/dev/sdc', priority='journal')
+        args = mock.MagicMock()
+        args.rollback = False
+
+        shell._resume(args, mock.MagicMock(), self.config)
+
+        store.delete.assert_not_called()
+        _dmcrypt.luks_close.assert_not_called()
+        _dmcrypt.luks_format.assert_not_called()
+        _dmcrypt.udevadm_rescan.assert_called_once_with('/dev/sdc')
+        _dmcrypt.luks_open.assert_called_once_with('testkey', 'uuid-2')
+        _systemd.set_environment.assert_called_once_with(
+            'vaultlocker-decrypt@uuid-2.service',
+            {'VAULTLOCKER_PRIORITY': 'journal'},
+        )
+        _systemd.enable.assert_called_once_with(
+            'vaultlocker-decrypt@uuid-2.service'
+        )
+        self.assertEqual([], self.journal.entries())
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.discovery, 'scan')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_resume_device_not_blank(self, _dmcrypt, _vault_store, _scan,
+                                     _device_locks):
+        _dmcrypt.luks_uuid.return_value = None
+        _scan.return_value = [self._scanned('sdb', signature='xfs')]
+        self.journal.record('uuid-1', journal.PHASE_KEY_STORED,
+                            block_device='/dev/sdb', priority=None)
+        args = mock.MagicMock()
+        args.rollback = False
+
+        self.assertRaises(exceptions.VaultlockerException,
+                          shell._resume, args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_uuid.assert_called_once_with('/dev/sdb')
+        _dmcrypt.luks_format.assert_not_called()
+        self.assertEqual(1, len(self.journal.entries()))
+
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell.discovery, 'scan')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_resume_device_formatted(self, _dmcrypt, _vault_store, _scan,
+                                     _device_locks, _systemd,
+                                     _device_exists):
+        _dmcrypt.luks_uuid.return_value = 'uuid-1'
+        _vault_store.return_value.read.return_value = {
+            'dmcrypt_key': 'testkey',
+        }
+        self.journal.record('uuid-1', journal.PHASE_KEY_STORED,
+                            block_device='/dev/sdb', priority=None)
+        args = mock.MagicMock()
+        args.rollback = False
+
+        shell._resume(args, mock.MagicMock(), self.config)
+
+        _scan.assert_not_called()
+        _dmcrypt.luks_format.assert_called_once_with(
+            'testkey', '/dev/sdb', 'uuid-1', header=None)
+
+    @mock.patch.object(shell, 'get_hostname', return_value='host')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_resume_rollback(self, _dmcrypt, _systemd, _vault_store,
+                             _device_exists, _device_locks, _get_hostname):
+        store = _vault_store.return_value
+        self.journal.record('uuid-1', journal.PHASE_FORMATTED,
+                            block_device='/dev/sdb', priority=None)
+        args = mock.MagicMock()
+        args.rollback = True
+
+        shell._resume(args, mock.MagicMock(), self.config)
+
+        store.delete.assert_called_once_with('host/uuid-1')
+        _systemd.enable.assert_not_called()
+        self.assertEqual([], self.journal.entries())
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_device_exists', return_value=True)
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_resume_rollback_open(self, _dmcrypt, _vault_store,
+                                  _device_exists, _device_locks):
+        self.journal.record('uuid-1', journal.PHASE_OPENED,
+                            block_device='/dev/sdb', priority=None)
+        args = mock.MagicMock()
+        args.rollback = True
+
+        self.assertRaises(exceptions.VaultlockerException,
+                          shell._resume, args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_close.assert_not_called()
+        _vault_store.return_value.delete.assert_not_called()
+        self.assertEqual(1, len(self.journal.entries()))
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'systemd')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_resume_missing_key(self, _dmcrypt, _systemd, _vault_store,
+                                _device_exists, _device_locks):
+        _vault_store.return_value.read.side_effect = (
+            hvac.exceptions.InvalidPath()
+        )
+        self.journal.record('uuid-1', journal.PHASE_KEY_STORED,
+                            block_device='/dev/sdb', priority=None)
+        args = mock.MagicMock()
+        args.rollback = False
+
+        self.assertRaises(exceptions.VaultlockerException,
+                          shell._resume, args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_format.assert_not_called()
+        self.assertEqual(1, len(self.journal.entries()))
+
+    def _rotate_args(self):
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.parallel = 2
+        args.resilience = 'checksum'
+        args.hotzone_size = '4M'
+        args.ionice = True
+        return args
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_store_key_records')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rotate(self, _dmcrypt, _vault_store, _store_key_records,
+                    _device_locks, _locking):
+        store = _vault_store.return_value
+        store.read.return_value = {'dmcrypt_key': 'oldkey'}
+        _dmcrypt.generate_keys.return_value = ['newkey']
+        _dmcrypt.luks_test_key.return_value = False
+
+        shell._rotate(self._rotate_args(), mock.MagicMock(), self.config)
+
+        _dmcrypt.generate_keys.assert_called_once_with(1, mock.ANY)
+        _dmcrypt.generate_key.assert_not_called()
+
+        self.assertEqual(
+            [mock.call(store, {'uuid-1': {'dmcrypt_key': 'oldkey',
+                                          'dmcrypt_key_next': 'newkey'}},
+                       self.config),
+             mock.call(store, {'uuid-1': {'dmcrypt_key': 'newkey'}},
+                       self.config)],
+            _store_key_records.call_args_list,
+        )
+        _locking.semaphore.assert_called_once_with(
+            shell.REENCRYPT_SLOT, 2, lock_dir=_locking.LOCK_DIR,
+        )
+        _dmcrypt.luks_reencrypt.assert_called_once_with(
+            'oldkey', 'uuid-1', resilience='checksum', hotzone_size='4M',
+            ionice=True,
+        )
+        _dmcrypt.luks_change_key.assert_called_once_with(
+            'oldkey', 'newkey', 'uuid-1'
+        )
+        self.assertEqual([], self.journal.entries())
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_store_key_records')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rotate_resumes_after_reencrypt(self, _dmcrypt, _vault_store,
+                                            _store_key_records,
+                                            _device_locks, _locking):
+        _vault_store.return_value.read.return_value = {
+            'dmcrypt_key': 'oldkey', 'dmcrypt_key_next': 'newkey',
+        }
+        _dmcrypt.luks_test_key.return_value = False
+        self.journal.record('uuid-1', journal.PHASE_REENCRYPTED,
+                            operation=journal.OPERATION_ROTATE)
+
+        shell._rotate(self._rotate_args(), mock.MagicMock(), self.config)
+
+        _dmcrypt.generate_key.assert_not_called()
+        _dmcrypt.luks_reencrypt.assert_not_called()
+        _dmcrypt.luks_change_key.assert_called_once_with(
+            'oldkey', 'newkey', 'uuid-1'
+        )
+        _store_key_records.assert_called_once_with(
+            _vault_store.return_value, {'uuid-1': {'dmcrypt_key': 'newkey'}},
+            self.config,
+        )
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_store_key_records')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rotate_key_already_changed(self, _dmcrypt, _vault_store,
+                                        _store_key_records, _device_locks,
+                                        _locking):
+        _vault_store.return_value.read.return_value = {
+            'dmcrypt_key': 'oldkey', 'dmcrypt_key_next': 'newkey',
+        }
+        _dmcrypt.luks_test_key.return_value = True
+
+        shell._rotate(self._rotate_args(), mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_reencrypt.assert_not_called()
+        _dmcrypt.luks_change_key.assert_not_called()
+        _store_key_records.assert_called_once_with(
+            _vault_store.return_value, {'uuid-1': {'dmcrypt_key': 'newkey'}},
+            self.config,
+        )
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rotate_unfinished_encrypt(self, _dmcrypt, _vault_store,
+                                       _device_locks, _locking):
+        self.journal.record('uuid-1', journal.PHASE_FORMATTED,
+                            operation=journal.OPERATION_ENCRYPT)
+
+        self.assertRaises(exceptions.VaultlockerException, shell._rotate,
+                          self._rotate_args(), mock.MagicMock(), self.config)
+
+        _vault_store.return_value.read.assert_not_called()
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_store_key_records')
+    @mock.patch.object(shell, '_read_key_record')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rekey(self, _dmcrypt, _vault_store, _read_key_record,
+                   _store_key_records, _device_locks, _locking):
+        store = _vault_store.return_value
+        _read_key_record.side_effect = [
+            {'dmcrypt_key': 'oldkey'},
+            {'dmcrypt_key': 'oldkey', 'dmcrypt_key_next': 'newkey'},
+            {'dmcrypt_key': 'newkey'},
+        ]
+        _dmcrypt.generate_keys.return_value = ['newkey']
+        _dmcrypt.luks_key_slot.side_effect = [0, None, 1]
+        _dmcrypt.luks_key_slots.return_value = {0, 1}
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.parallel = 4
+
+        shell._rekey(args, mock.MagicMock(), self.config)
+
+        self.assertEqual(
+            [mock.call(store, {'uuid-1': {'dmcrypt_key': 'oldkey',
+                                          'dmcrypt_key_next': 'newkey'}},
+                       self.config),
+             mock.call(store, {'uuid-1': {'dmcrypt_key': 'newkey'}},
+                       self.config)],
+            _store_key_records.call_args_list,
+        )
+        _dmcrypt.luks_add_key.assert_called_once_with(
+            'oldkey', 'newkey', 'uuid-1'
+        )
+        _dmcrypt.luks_kill_slot.assert_called_once_with(
+            'newkey', 'uuid-1', 0
+        )
+        _dmcrypt.luks_reencrypt.assert_not_called()
+        self.assertEqual([], self.journal.entries())
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_store_key_records')
+    @mock.patch.object(shell, '_read_key_record')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rekey_resumes_after_key_stored(self, _dmcrypt, _vault_store,
+                                            _read_key_record,
+                                            _store_key_records,
+                                            _device_locks, _locking):
+        _read_key_record.return_value = {'dmcrypt_key': 'newkey'}
+        _dmcrypt.luks_key_slots.return_value = {1}
+        self.journal.record('uuid-1', journal.PHASE_KEY_STORED,
+                            operation=journal.OPERATION_REKEY,
+                            old_slot=0, new_slot=1)
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.parallel = 1
+
+        shell._rekey(args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_add_key.assert_not_called()
+        _store_key_records.assert_not_called()
+        # the old slot was wiped before the interruption
+        _dmcrypt.luks_kill_slot.assert_not_called()
+        self.assertEqual([], self.journal.entries())
+
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_read_key_record')
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_rekey_key_not_on_device(self, _dmcrypt, _vault_store,
+                                     _read_key_record, _device_locks,
+                                     _locking):
+        _read_key_record.return_value = {'dmcrypt_key': 'oldkey',
+                                         'dmcrypt_key_next': 'newkey'}
+        _dmcrypt.luks_key_slot.return_value = None
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.parallel = 1
+
+        self.assertRaises(exceptions.VaultlockerException, shell._rekey,
+                          args, mock.MagicMock(), self.config)
+
+        _dmcrypt.luks_add_key.assert_not_called()
+        self.assertEqual([], self.journal.entries())
+
+    def _detached_header_dir(self, *block_uuids):
+        header_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, header_dir)
+        for block_uuid in block_uuids:
+            headers.register(block_uuid, '/dev/disk/by-id/ata-HDD_1',
+                             header_dir)
+        return header_dir
+
+    @mock.patch.object(shell, '_list_device_uuids')
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, '_rotate_device')
+    @mock.patch.object(shell, '_vault_store')
+    def test_rotate_skips_detached_header(self, _vault_store,
+                                          _rotate_device, _header_dir,
+                                          _list_device_uuids):
+        _header_dir.return_value = self._detached_header_dir('uuid-2')
+        _list_device_uuids.return_value = ['uuid-1', 'uuid-2']
+        args = self._rotate_args()
+        args.uuid = []
+
+        shell._rotate(args, mock.MagicMock(), self.config)
+
+        self.assertEqual(['uuid-1'], [call.args[0] for call in
+                                      _rotate_device.call_args_list])
+
+    @mock.patch.object(shell, '_list_device_uuids')
+    @mock.patch.object(shell, '_generate_keys')
+    @mock.patch.object(shell, '_rotate_device')
+    @mock.patch.object(shell, '_vault_store')
+    def test_rotate_generates_keys_once(self, _vault_store, _rotate_device,
+                                        _generate_keys, _list_device_uuids):
+        _list_device_uuids.return_value = ['uuid-2', 'uuid-1']
+        _generate_keys.return_value = ['key-1', 'key-2']
+        args = self._rotate_args()
+        args.uuid = []
+        client = mock.MagicMock()
+
+        shell._rotate(args, client, self.config)
+
+        _generate_keys.assert_called_once_with(2, client, self.config)
+        self.assertEqual(
+            {'uuid-1': 'key-1', 'uuid-2': 'key-2'},
+            {call.args[0]: call.kwargs['new_key']
+             for call in _rotate_device.call_args_list},
+        )
+
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, '_rekey_device')
+    @mock.patch.object(shell, '_vault_store')
+    def test_rekey_named_detached_header(self, _vault_store,
+                                         _rekey_device, _header_dir):
+        _header_dir.return_value = self._detached_header_dir('uuid-1')
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.parallel = 1
+
+        self.assertRaises(exceptions.VaultlockerException, shell._rekey,
+                          args, mock.MagicMock(), self.config)
+
+        _rekey_device.assert_not_called()
+
+    @mock.patch.object(shell, '_vault_store')
+    @mock.patch.object(shell, 'dmcrypt')
+    def test_decrypt_staged_key(self, _dmcrypt, _vault_store):
+        _vault_store.return_value.read.return_value = {
+            'dmcrypt_key': 'oldkey', 'dmcrypt_key_next': 'newkey',
+        }
+        _dmcrypt.luks_open.side_effect = [
+            subprocess.CalledProcessError(2, 'cryptsetup'), 'crypt-uuid-1',
+        ]
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+
+        shell._decrypt_block_device(args, mock.MagicMock(), self.config)
+
+        self.assertEqual(
+            [mock.call('oldkey', 'uuid-1'), mock.call('newkey', 'uuid-1')],
+            _dmcrypt.luks_open.call_args_list,
+        )
+
+    @mock.patch.object(shell, '_select_devices')
+    @mock.patch.object(shell, 'locking')
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_encrypt_locks_device(self, _persistence, _locking,
+                                  _select_devices):
+        config = self._hostname_config()
+        config.set('DEFAULT', 'lock_timeout', '10')
+        args = mock.MagicMock()
+        args.uuid = 'uuid-1'
+        args.block_device = ['/dev/sdb']
+        _select_devices.return_value = ['/dev/sdb']
+        _persistence.side_effect = self._generated_keys
+
+        shell.encrypt(args, config)
+
+        _locking.device_lock_name.assert_called_once_with('/dev/sdb')
+        _locking.uuid_lock_name.assert_called_once_with('uuid-1')
+        _locking.locks.assert_called_once_with(
+            [_locking.device_lock_name.return_value,
+             _locking.uuid_lock_name.return_value],
+            timeout=10,
+            lock_dir=_locking.LOCK_DIR,
+        )
+        _locking.locks.return_value.__enter__.assert_called_once_with()
+        self.assertEqual(2, _persistence.call_count)
+        func, device_args, _ = _persistence.call_args[0]
+        self.assertIs(shell._encrypt_block_device, func.func)
+        self.assertEqual({'key': 'key-0'}, func.keywords)
+        self.assertEqual(['/dev/sdb'], device_args.block_device)
+
+    def _encrypt_args(self, block_devices=(), **filters):
+        args = argparse.Namespace(uuid=None, priority=None,
+                                  block_device=list(block_devices),
+                                  match=None, min_size=None, max_size=None,
+                                  rotational=None, model=None)
+        for option, value in filters.items():
+            setattr(args, option, value)
+        return args
+
+    def _generated_keys(self, func, args, config):
+        """Stand-in for _do_it_with_persistence generating device keys"""
+        if func is shell._generate_device_keys:
+            return ['key-{}'.format(index)
+                    for index in range(len(args.block_device))]
+
+    def _encrypted(self, _persistence):
+        """Devices and keys passed to _encrypt_block_device"""
+        return [(call[0][1].block_device, call[0][0].keywords['key'])
+                for call in _persistence.call_args_list
+                if call[0][0] is not shell._generate_device_keys]
+
+    def _scanned(self, name, **attributes):
+        device = {'name': name, 'path': '/dev/{}'.format(name),
+                  'links': [], 'mounted': False, 'holders': [],
+                  'partitions': [], 'signature': None, 'readonly': False,
+                  'physical': True, 'size': 1 << 30, 'rotational': False,
+                  'model': ''}
+        device.update(attributes)
+        return device
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    @mock.patch.object(shell.discovery, 'scan')
+    def test_encrypt_selected_devices(self, _scan, _persistence,
+                                      _device_locks):
+        _scan.return_value = [
+            self._scanned('sdb', rotational=True),
+            self._scanned('sdc', rotational=True, holders=['dm-0']),
+            self._scanned('sdd', rotational=True),
+            self._scanned('nvme0n1'),
+        ]
+        args = self._encrypt_args(['/dev/sdd'], rotational=True)
+        _persistence.side_effect = self._generated_keys
+
+        shell.encrypt(args, self.config)
+
+        self.assertEqual(
+            [(['/dev/sdd'], 'key-0'), (['/dev/sdb'], 'key-1')],
+            self._encrypted(_persistence),
+        )
+        self.assertEqual(
+            ['/dev/sdd', '/dev/sdb'],
+            _persistence.call_args_list[0][0][1].block_device,
+        )
+        self.assertEqual(['/dev/sdd'], args.block_device)
+
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    @mock.patch.object(shell.discovery, 'scan')
+    def test_encrypt_device_in_use(self, _scan, _persistence):
+        _scan.return_value = [
+            self._scanned('sdb', mounted=True, signature='xfs'),
+            self._scanned('sdc'),
+        ]
+
+        with self.assertRaises(exceptions.DeviceInUse) as raised:
+            shell.encrypt(self._encrypt_args(['/dev/sdc', '/dev/sdb']),
+                          self.config)
+
+        self.assertEqual({'/dev/sdb': ['mounted']},
+                         raised.exception.reasons)
+        _persistence.assert_not_called()
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    @mock.patch.object(shell.discovery, 'scan')
+    def test_encrypt_named_device_not_blank(self, _scan, _persistence,
+                                            _device_locks):
+        _scan.return_value = [
+            self._scanned('sdb', signature='xfs'),
+            self._scanned('sdc', partitions=['sdc1']),
+        ]
+        args = self._encrypt_args(['/dev/sdb', '/dev/sdc', '/dev/md0'])
+        _persistence.side_effect = self._generated_keys
+
+        shell.encrypt(args, self.config)
+
+        self.assertEqual(
+            [['/dev/sdb'], ['/dev/sdc'], ['/dev/md0']],
+            [device for device, _ in self._encrypted(_persistence)],
+        )
+
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    @mock.patch.object(shell.discovery, 'scan')
+    def test_encrypt_uuid_several_devices(self, _scan, _persistence):
+        _scan.return_value = [self._scanned('sdb'), self._scanned('sdc')]
+        args = self._encrypt_args(model='*')
+        args.uuid = 'uuid-1'
+
+        self.assertRaises(ValueError, shell.encrypt, args, self.config)
+        _persistence.assert_not_called()
+
+    @mock.patch.object(shell, 'locking')
+    def test_cryptsetup_slot(self, _locking):
+        config = self._hostname_config()
+        config.set('DEFAULT', 'cryptsetup_slots', '2')
+
+        slot = shell._cryptsetup_slot(config)
+
+        _locking.semaphore.assert_called_once_with(
+            _locking.CRYPTSETUP_SLOT, 2,
+            timeout=shell.DEFAULT_LOCK_TIMEOUT,
+            lock_dir=_locking.LOCK_DIR,
+        )
+        self.assertIs(_locking.semaphore.return_value, slot)
+
+    @mock.patch.object(shell, 'locking')
+    def test_cryptsetup_slot_unlimited(self, _locking):
+        with shell._cryptsetup_slot(self._hostname_config()):
+            pass
+
+        _locking.semaphore.assert_not_called()
+
+    def test_start_delay(self):
+        config = self._hostname_config('host-1')
+        config.set('DEFAULT', 'boot_jitter', '60')
+        config.set('DEFAULT', 'priority_delay', '120')
+
+        os_delay = shell._start_delay(config, 'os')
+        data_delay = shell._start_delay(config, 'data')
+
+        self.assertTrue(0 <= os_delay < 60)
+        self.assertEqual(os_delay, shell._start_delay(config, 'os'))
+        self.assertAlmostEqual(os_delay + 240, data_delay)
+
+        config.set('DEFAULT', 'hostname', 'host-2')
+        self.assertNotEqual(os_delay, shell._start_delay(config, 'os'))
+
+    def test_start_delay_unset(self):
+        config = self._hostname_config('host-1')
+
+        self.assertEqual(0, shell._start_delay(config, 'data'))
+
+    def test_start_delay_invalid(self):
+        config = self._hostname_config('host-1')
+        config.set('DEFAULT', 'boot_jitter', '-5')
+
+        self.assertRaises(ValueError, shell._start_delay, config, 'os')
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, 'time')
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_decrypt_stagger(self, _persistence, _device_exists, _time,
+                             _device_locks):
+        config = self._hostname_config('host-1')
+        config.set('DEFAULT', 'priority_delay', '30')
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.stagger = True
+        args.defer = False
+        args.priority = 'journal'
+
+        shell.decrypt(args, config)
+
+        _time.sleep.assert_called_once_with(30)
+        _device_locks.assert_called_once_with(config, 'uuid-1')
+        _persistence.assert_called_once_with(
+            shell._decrypt_block_device, args, config
+        )
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, 'time')
+    @mock.patch.object(shell, '_device_exists', return_value=True)
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_decrypt_stagger_already_open(self, _persistence,
+                                          _device_exists, _time,
+                                          _device_locks):
+        config = self._hostname_config('host-1')
+        config.set('DEFAULT', 'priority_delay', '30')
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.stagger = True
+        args.defer = False
+        args.priority = 'data'
+
+        shell.decrypt(args, config)
+
+        _time.sleep.assert_not_called()
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, 'dmcrypt')
+    @mock.patch.object(shell.os.path, 'exists', return_value=False)
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_decrypt_defer_missing_device(self, _persistence, _exists,
+                                          _dmcrypt, _device_locks):
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.defer = True
+
+        shell.decrypt(args, self.config)
+
+        _exists.assert_any_call('/dev/disk/by-uuid/uuid-1')
+        _dmcrypt.udevadm_settle.assert_called_once_with('uuid-1')
+        _persistence.assert_not_called()
+
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, 'dmcrypt')
+    @mock.patch.object(shell, '_device_present', side_effect=[False, True])
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_decrypt_defer_device_settled(self, _persistence,
+                                          _device_exists, _device_present,
+                                          _dmcrypt, _device_locks):
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.defer = True
+        args.stagger = False
+
+        shell.decrypt(args, self.config)
+
+        _dmcrypt.udevadm_settle.assert_called_once_with('uuid-1')
+        _persistence.assert_called_once_with(
+            shell._decrypt_block_device, args, self.config
+        )
+
+    @mock.patch.object(shell, '_header_dir')
+    @mock.patch.object(shell, '_device_locks')
+    @mock.patch.object(shell, 'dmcrypt')
+    @mock.patch.object(shell, '_device_present', return_value=False)
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_decrypt_defer_detached_header(self, _persistence,
+                                           _device_exists, _device_present,
+                                           _dmcrypt, _device_locks,
+                                           _header_dir):
+        header_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, header_dir)
+        _header_dir.return_value = header_dir
+        headers.register('uuid-1', '/dev/disk/by-id/ata-HDD_1', header_dir)
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+        args.defer = True
+
+        self.assertRaises(exceptions.VaultlockerException, shell.decrypt,
+                          args, self.config)
+
+        _dmcrypt.udevadm_settle.assert_called_once_with('uuid-1')
+        _persistence.assert_not_called()
+
+    @mock.patch.object(shell, 'headers')
+    @mock.patch.object(shell.os.path, 'exists', return_value=True)
+    def test_device_present_detached(self, _exists, _headers):
+        self.assertTrue(shell._device_present(
+            'uuid-1', {'device': '/dev/disk/by-id/wwn-1'}))
+        _exists.assert_called_once_with('/dev/disk/by-id/wwn-1')
+
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, 'systemd')
+    def test_hotplug(self, _systemd, _device_exists):
+        _systemd.enabled_instances.return_value = {'uuid-1', 'uuid-2'}
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+
+        shell.hotplug(args, self.config)
+
+        _systemd.enabled_instances.assert_called_once_with(
+            'vaultlocker-decrypt@')
+        _systemd.start.assert_called_once_with(
+            'vaultlocker-decrypt@uuid-1.service', block=False)
+
+    @mock.patch.object(shell, '_device_exists', return_value=False)
+    @mock.patch.object(shell, 'systemd')
+    def test_hotplug_unregistered(self, _systemd, _device_exists):
+        _systemd.enabled_instances.return_value = {'uuid-2'}
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+
+        shell.hotplug(args, self.config)
+
+        _systemd.start.assert_not_called()
+
+    @mock.patch.object(shell, '_device_exists', return_value=True)
+    @mock.patch.object(shell, 'systemd')
+    def test_hotplug_already_open(self, _systemd, _device_exists):
+        _systemd.enabled_instances.return_value = {'uuid-1'}
+        args = mock.MagicMock()
+        args.uuid = ['uuid-1']
+
+        shell.hotplug(args, self.config)
+
+        _systemd.start.assert_not_called()
+
+    @mock.patch.object(shell, '_get_tracing', return_value=None)
+    @mock.patch.object(shell, 'get_config')
+    @mock.patch.object(shell, 'hotplug')
+    def test_hotplug_udev_rule(self, _hotplug, _get_config, _get_tracing):
+        _hotplug.__name__ = 'hotplug'
+        rules = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                             'tools', '70-vaultlocker.rules')
+        with open(rules) as rules_file:
+            command = re.search(r'RUN\+="([^"]*)"', rules_file.read()).group(1)
+        argv = shlex.split(command.replace('$env{ID_FS_UUID}', 'uuid-1'))
+        with mock.patch.object(shell.sys, 'argv', argv):
+            shell.main()
+
+        _get_config.assert_called_once_with(shell.DEFAULT_CONF_FILE,
+                                            shell.DEFAULT_CONFIG_CACHE)
+        self.assertEqual(['uuid-1'], _hotplug.call_args.args[0].uuid)
+
+    @mock.patch('builtins.print')
+    @mock.patch.object(shell, 'status')
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_show_status_uses_fresh_cache(self, _persistence, _status,
+                                          _print):
+        _status.read_cache.return_value = ['uuid-1']
+        _status.format_table.return_value = 'table'
+
+        args = mock.MagicMock()
+        args.max_age = 60
+        args.format = 'table'
+
+        shell.show_status(args, self.config)
+
+        _persistence.assert_not_called()
+        _status.local_index.assert_called_once_with(['uuid-1'],
+                                                    headers.HEADER_DIR)
+        _print.assert_called_once_with('table')
+
+    @mock.patch('builtins.print')
+    @mock.patch.object(shell, 'get_hostname', return_value='host')
+    @mock.patch.object(shell, 'status')
+    @mock.patch.object(shell, '_do_it_with_persistence')
+    def test_show_status_refreshes_cache(self, _persistence, _status,
+                                         _get_hostname, _print):
+        _status.read_cache.return_value = None
+        _status.local_index.return_value = [{'uuid': 'uuid-1'}]
+        _persistence.return_value = ['uuid-1']
+
+        args = mock.MagicMock()
+        args.max_age = 60
+        args.format = 'json'
+
+        shell.show_status(args, self.config)
+
+        _persistence.assert_called_once_with(
+            shell._list_vault_uuids, args, self.config
+        )
+        _status.write_cache.assert_called_once_with(args.cache, ['uuid-1'])
+        self.assertEqual(
+            {'hostname': 'host', 'devices': [{'uuid': 'uuid-1'}]},
+            json.loads(_print.call_args[0][0]),
+        )
+
+    @mock.patch.object(shell, 'socket')
+    @mock.patch.object(shell, 'platform')
+    def test_get_hostname_uses_configured_value(self, _platform, _socket):
+        self.assertEqual(
+            'configured-host',
+            shell.get_hostname(
+                self._hostname_config('configured-host')
+            ),
+        )
+
+        _platform.node.assert_not_called()
+        _socket.gethostname.assert_not_called()
+
+    @mock.patch.object(shell, 'socket')
+    @mock.patch.object(shell, 'platform')
+    def test_get_hostname_uses_platform_node(self, _platform, _socket):
+        _platform.node.return_value = 'node-host'
+
+        self.assertEqual(
+            'node-host',
+            shell.get_hostname(self._hostname_config()),
+        )
+
+        _socket.gethostname.assert_not_called()
+
+    @mock.patch.object(shell, 'socket')
+    @mock.patch.object(shell, 'platform')
+    def test_get_hostname_uses_socket_fallback(self, _platform, _socket):
+        _platform.node.return_value = ''
+        _socket.gethostname.return_value = 'socket-host'
+
+        self.assertEqual(
+            'socket-host',
+            shell.get_hostname(self._hostname_config()),
+        )
+
+        _socket.gethostname.assert_called_once_with()
+
+    @mock.patch.object(shell, 'socket')
+    @mock.patch.object(shell, 'platform')
+    def test_get_hostname_raises_when_socket_fails(self, _platform, _socket):
+        _platform.node.return_value = ''
+        _socket.gethostname.side_effect = OSError('no hostname')
+
+        with self.assertRaises(RuntimeError) as error:
+            shell.get_hostname(self._hostname_config())
+
+        self.assertIn(
+            'Unable to determine hostname',
+            str(error.exception),
+        )
+
+
+class TestHostLayout(base.TestCase):
+
+    def setUp(self):
+        super(TestHostLayout, self).setUp()
+        self.config = configparser.ConfigParser()
+        self.config.set('DEFAULT', 'hostname', 'host')
+        self.config.add_section('vault')
+        self.config.set('vault', 'backend', 'vaultlocker-test')
+        self.config.set('vault', 'kv_version', '2')
+        self.config.set('vault', 'layout', 'host')
+        self.store = mock.MagicMock()
+        self.store.read_version.return_value = (
+            {
+                'format': shell.HOST_DOCUMENT_FORMAT,
+                'keys': {'uuid-1': {'dmcrypt_key': 'key-1'}},
+            },
+            4,
+        )
+
+    def test_layout_requires_kv_v2(self):
+        self.config.set('vault', 'kv_version', '1')
+
+        with self.assertRaises(ValueError) as error:
+            shell._get_layout(self.config)
+
+        self.assertIn("requires kv_version '2'", str(error.exception))
+
+    def test_read_host_keys_single_read(self):
+        self.assertEqual(
+            {'uuid-1': 'key-1'},
+            shell._read_host_keys(self.store, self.config),
+        )
+        self.store.read_version.assert_called_once_with('host')
+        self.store.list.assert_not_called()
+        self.store.read.assert_not_called()
+
+    def test_read_key_record_missing(self):
+        self.assertRaises(
+            hvac.exceptions.InvalidPath,
+            shell._read_key_record,
+            self.store, 'uuid-2', self.config,
+        )
+
+    def test_store_key_records_check_and_set(self):
+        self.store.write.return_value = {'version': 5}
+
+        shell._store_key_records(
+            self.store,
+            {'uuid-2': {'dmcrypt_key': 'key-2'}},
+            self.config,
+        )
+
+        self.store.write.assert_called_once_with(
+            'host',
+            {
+                'format': shell.HOST_DOCUMENT_FORMAT,
+                'keys': {
+                    'uuid-1': {'dmcrypt_key': 'key-1'},
+                    'uuid-2': {'dmcrypt_key': 'key-2'},
+                },
+            },
+            cas=4,
+        )
+
+    def test_store_key_records_retries_cas_conflict(self):
+        self.store.write.side_effect = [
+            hvac.exceptions.InvalidRequest(
+                'check-and-set parameter did not match the current version'
+            ),
+            {'version': 3},
+        ]
+        self.store.read_version.side_effect = [
+            ({'format': 1, 'keys': {}}, 1),
+            ({'format': 1, 'keys': {'uuid-3': {'dmcrypt_key': 'key-3'}}}, 2),
+        ]
+
+        shell._store_key_records(
+            self.store,
+            {'uuid-2': {'dmcrypt_key': 'key-2'}},
+            self.config,
+        )
+
+        self.assertEqual(2, self.store.write.call_count)
+        self.store.write.assert_called_with(
+            'host',
+            {
+                'format': 1,
+                'keys': {
+                    'uuid-3': {'dmcrypt_key': 'key-3'},
+                    'uuid-2': {'dmcrypt_key': 'key-2'},
+                },
+            },
+            cas=2,
+        )
+
+    def test_store_key_records_create_only_rejects_existing(self):
+        self.assertRaises(
+            exceptions.VaultWriteError,
+            shell._store_key_records,
+            self.store,
+            {'uuid-1': {'dmcrypt_key': 'other-key'}},
+            self.config,
+            create_only=True,
+        )
+        self.store.write.assert_not_called()
+
+    def test_delete_key_record(self):
+        shell._delete_key_record(self.store, 'uuid-1', self.config)
+
+        self.store.write.assert_called_once_with(
+            'host',
+            {'format': shell.HOST_DOCUMENT_FORMAT, 'keys': {}},
+            cas=4,
+        )
+        self.store.delete.assert_not_called()
+
+    @mock.patch.object(shell, '_vault_store')
+    def test_migrate_layout(self, _vault_store):
+        store = _vault_store.return_value
+        store.list.return_value = ['uuid-2']
+        store.read.return_value = {'dmcrypt_key': 'key-2'}
+        store.read_version.return_value = ({'format': 1, 'keys': {}}, 0)
+        store.write.return_value = {'version': 1}
+
+        args = mock.MagicMock()
+        args.prune = True
+        args.workers = 2
+
+        shell._migrate_layout(args, mock.MagicMock(), self.config)
+
+        store.read.assert_called_once_with('host/uuid-2')
+        store.write.assert_called_once_with(
+            'host',
+            {'format': 1, 'keys': {'uuid-2': {'dmcrypt_key': 'key-2'}}},
+            cas=0,
+        )
+        store.delete.assert_called_once_with('host/uuid-2')
+
+    @mock.patch.object(shell, '_vault_store')
+    def test_migrate_layout_prune_device_layout(self, _vault_store):
+        self.config.set('vault', 'layout', 'device')
+        args = mock.MagicMock()
+        args.prune = True
+        args.workers = 2
+
+        self.assertRaises(ValueError, shell._migrate_layout, args,
+                          mock.MagicMock(), self.config)
+
+        _vault_store.return_value.write.assert_not_called()
+        _vault_store.return_value.delete.assert_not_called()
+
+
+class TestKVConfiguration(base.TestCase):
+
+    def _config(self, kv_version=None):
+        config = configparser.ConfigParser()
+        config.add_section('vault')
+        config.set('vault', 'backend', 'vaultlocker-test')
+
+        if kv_version is not None:
+            config.set('vault', 'kv_version', kv_version)
+
+        return config
+
+    def test_kv_version_defaults_to_one(self):
+        self.assertEqual(
+            '1',
+            shell._get_kv_version(self._config()),
+        )
+
+    def test_kv_version_one(self):
+        self.assertEqual(
+            '1',
+            shell._get_kv_version(self._config('1')),
+        )
+
+    def test_kv_version_two(self):
+        self.assertEqual(
+            '2',
+            shell._get_kv_version(self._config('2')),
+        )
 
     def test_kv_version_rejects_other_number(self):
         with self.assertRaises(ValueError) as error:
@@ -416,6 +2134,103 @@ class TestKVConfiguration(base.TestCase):
             str(error.exception),
         )
 
+    def test_key_wrapping_defaults_to_none(self):
+        self.assertEqual('none', shell._get_key_wrapping(self._config()))
+
+    def test_key_wrapping_rejects_unknown_mode(self):
+        config = self._config()
+        config.set('vault', 'key_wrapping', 'aes')
+
+        with self.assertRaises(ValueError) as error:
+            shell._get_key_wrapping(config)
+
+        self.assertIn("must be 'none' or 'transit'", str(error.exception))
+
+    @mock.patch.object(shell, 'get_hostname')
+    def test_transit_wrapper_defaults(self, _get_hostname):
+        _get_hostname.return_value = 'test-host'
+        client = mock.MagicMock()
+
+        wrapper = shell._transit_wrapper(client, self._config())
+
+        self.assertIs(client, wrapper.client)
+        self.assertEqual('transit', wrapper.mount_point)
+        self.assertEqual('vaultlocker-test-host', wrapper.key_name)
+
+    def test_key_size_default(self):
+        self.assertEqual(4096, shell._get_key_size(self._config()))
+
+    def test_key_size_configured(self):
+        config = self._config()
+        config.set('DEFAULT', 'key_size', '2048')
+
+        self.assertEqual(2048, shell._get_key_size(config))
+
+    def test_key_size_rejects_invalid(self):
+        for value in ('100', '1001', 'large'):
+            config = self._config()
+            config.set('DEFAULT', 'key_size', value)
+
+            self.assertRaises(ValueError, shell._get_key_size, config)
+
+    @mock.patch.object(shell.dmcrypt, 'generate_keys')
+    def test_generate_keys_local(self, _generate_keys):
+        config = self._config()
+        config.set('DEFAULT', 'key_size', '1024')
+
+        shell._generate_keys(3, mock.MagicMock(), config)
+
+        _generate_keys.assert_called_once_with(3, 1024)
+
+    @mock.patch.object(shell.keysource, 'KeySource')
+    def test_generate_keys_hwrng(self, _key_source):
+        config = self._config()
+        config.set('DEFAULT', 'key_source', 'hwrng')
+        config.set('DEFAULT', 'key_device', '/dev/tpmrng')
+        client = mock.MagicMock()
+
+        result = shell._generate_keys(3, client, config)
+
+        _key_source.get_source.assert_called_once_with(
+            'hwrng', client, 4096, device='/dev/tpmrng',
+        )
+        source = _key_source.get_source.return_value
+        source.generate_many.assert_called_once_with(3)
+        self.assertIs(source.generate_many.return_value, result)
+
+    @mock.patch.object(shell, 'get_hostname')
+    def test_store_device_record_v2_uses_write_version(self, _get_hostname):
+        _get_hostname.return_value = 'test-host'
+        store = mock.MagicMock()
+        store.write.return_value = {'version': 1}
+
+        shell._store_device_record(
+            store, 'test-uuid', {'dmcrypt_key': 'key'},
+            self._config('2'), create_only=True,
+        )
+
+        store.write.assert_called_once_with(
+            'test-host/test-uuid', {'dmcrypt_key': 'key'}, cas=0,
+        )
+        store.read.assert_not_called()
+
+    @mock.patch.object(shell, 'get_hostname')
+    def test_store_device_record_v1_reads_back(self, _get_hostname):
+        _get_hostname.return_value = 'test-host'
+        store = mock.MagicMock()
+        store.write.return_value = {}
+        store.read.return_value = {'dmcrypt_key': 'key'}
+
+        shell._store_device_record(
+            store, 'test-uuid', {'dmcrypt_key': 'key'},
+            self._config('1'), create_only=True,
+        )
+
+        store.write.assert_called_once_with(
+            'test-host/test-uuid', {'dmcrypt_key': 'key'},
+        )
+        store.read.assert_called_once_with('test-host/test-uuid')
+
     @mock.patch.object(shell, 'get_hostname')
     def test_secret_path_is_relative_to_mount(self, _get_hostname):
         _get_hostname.return_value = 'test-host'
@@ -424,3 +2239,68 @@ class TestKVConfiguration(base.TestCase):
             'test-host/test-uuid',
             shell._vault_secret_path('test-uuid', self._config()),
         )
+
+
+class TestGetConfig(base.TestCase):
+
+    _config = """
+[vault]
+url = https://vaultlocker.test.com
+backend = secret
+approle = 85e4c349-7547-4ad5-9172-d82a45d87b3e
+secret_id = 9428ad25-7b4a-442f-8f20-f23be0575146
+"""
+
+    def setUp(self):
+        super(TestGetConfig, self).setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = os.path.join(self.root.name, 'vaultlocker.conf')
+
+    def _write(self, extra=''):
+        with open(self.path, 'w') as config_file:
+            config_file.write(self._config + extra)
+
+    @mock.patch.object(shell.platform, 'node', return_value='node-1')
+    def test_resolves_values(self, _node):
+        self._write()
+
+        config = shell.get_config(self.path)
+
+        self.assertEqual('node-1', config.get('DEFAULT', 'hostname'))
+        self.assertEqual('1', config.get('vault', 'kv_version'))
+        self.assertEqual('node-1', shell.get_hostname(config))
+        _node.assert_called_once_with()
+
+    def test_reports_all_errors(self):
+        self._write('kv_version = 3\nmax_in_flight = none\n'
+                    '[DEFAULT]\nhostname = host\nkey_size = 7\n')
+
+        with self.assertRaises(exceptions.ConfigError) as error:
+            shell.get_config(self.path)
+
+        self.assertEqual(3, len(error.exception.errors))
+        self.assertIn("kv_version '3'", str(error.exception))
+        self.assertIn("key_size '7'", str(error.exception))
+        self.assertIn("max_in_flight 'none'", str(error.exception))
+
+    def test_reports_missing_options(self):
+        with open(self.path, 'w') as config_file:
+            config_file.write('[DEFAULT]\nhostname = host\n[vault]\n')
+
+        with self.assertRaises(exceptions.ConfigError) as error:
+            shell.get_config(self.path)
+
+        self.assertEqual(3, len(error.exception.errors))
+        self.assertIn("requires option 'approle'", str(error.exception))
+
+    @mock.patch.object(shell, '_validate_config', return_value=[])
+    def test_cache(self, _validate_config):
+        self._write('[DEFAULT]\nhostname = host\n')
+        cache_path = os.path.join(self.root.name, 'config.json')
+
+        config = shell.get_config(self.path, cache_path)
+        cached = shell.get_config(self.path, cache_path)
+
+        self.assertEqual(config, cached)
+        _validate_config.assert_called_once_with(mock.ANY)
@@ -0,0 +1,72 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import contextlib
+import threading
+import time
+from typing import Iterator, TextIO
+
+
+class Timings:
+    """Thread-safe accumulator of named durations."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: dict[str, list[float]] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record one duration.
+
+        :param name: name of the timed operation
+        :param seconds: duration in seconds
+        """
+        with self._lock:
+            stats = self._stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    @contextlib.contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """Context manager recording the duration of its body."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return count, total and max seconds of each operation."""
+        with self._lock:
+            return {
+                name: {'count': count, 'total': total, 'max': longest}
+                for name, (count, total, longest) in self._stats.items()
+            }
+
+    def report(self, stream: TextIO) -> None:
+        """Write a table of the recorded durations.
+
+        :param stream: file to write the table to
+        """
+        stream.write('{:<24} {:>8} {:>10} {:>10}\n'.format(
+            'OPERATION', 'COUNT', 'TOTAL(s)', 'MAX(s)'))
+        for name, stats in sorted(self.summary().items()):
+            stream.write('{:<24} {:>8} {:>10.3f} {:>10.3f}\n'.format(
+                name, stats['count'], stats['total'], stats['max']))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+# process-wide registry reported by ``vaultlocker --timings``
+TIMINGS = Timings()
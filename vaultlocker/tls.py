@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import functools
+import ssl
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests import adapters
+
+from vaultlocker import timing
+
+
+class TimedSSLSocket(ssl.SSLSocket):
+    """SSL socket recording handshake times and keeping its TLS session.
+
+    Full and resumed handshakes are recorded separately.  The session is
+    handed back to the context after the handshake and again on close,
+    as TLS 1.3 session tickets only arrive after the handshake.
+    """
+
+    def do_handshake(self, block: bool = False) -> None:
+        start = time.monotonic()
+        super().do_handshake(block)
+        self.context.timings.record(
+            'tls.resumed' if self.session_reused else 'tls.handshake',
+            time.monotonic() - start,
+        )
+        self.context.save_session(self)
+
+    def close(self) -> None:
+        if not self._closed:
+            self.context.save_session(self)
+        super().close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client context resuming TLS sessions across its connections."""
+
+    sslsocket_class = TimedSSLSocket
+
+    def __new__(cls, timings: Optional[timing.Timings] = None):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, timings: Optional[timing.Timings] = None) -> None:
+        self.timings = timings if timings is not None else timing.TIMINGS
+        self._sessions: dict[Optional[str], ssl.SSLSession] = {}
+        self._sessions_lock = threading.Lock()
+
+    def save_session(self, sock: ssl.SSLSocket) -> None:
+        """Keep the session of a socket for later connections."""
+        try:
+            session = sock.session
+        except (OSError, ValueError):
+            return
+        if session is None:
+            return
+        with self._sessions_lock:
+            # a TLS 1.3 session without a ticket cannot be resumed
+            if (session.has_ticket or
+                    sock.server_hostname not in self._sessions):
+                self._sessions[sock.server_hostname] = session
+
+    def wrap_socket(self, sock, server_side=False, *args, **kwargs):
+        if kwargs.get('session') is None and not server_side:
+            with self._sessions_lock:
+                kwargs['session'] = self._sessions.get(
+                    kwargs.get('server_hostname'))
+        return super().wrap_socket(sock, server_side, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def client_context(
+    ca_bundle: Optional[str] = None,
+    client_cert: Optional[str] = None,
+    client_key: Optional[str] = None,
+) -> ResumingSSLContext:
+    """Return the process-wide TLS context for a set of certificates.
+
+    Only the given CA bundle is loaded; the system store is used when
+    no bundle is configured.
+
+    :param ca_bundle: CA bundle verifying the Vault server
+    :param client_cert: client certificate for mutual TLS
+    :param client_key: key of the client certificate
+    :returns: ResumingSSLContext
+    """
+    context = ResumingSSLContext()
+    if ca_bundle:
+        context.load_verify_locations(cafile=ca_bundle)
+    else:
+        context.load_default_certs()
+    if client_cert:
+        context.load_cert_chain(client_cert, client_key)
+    return context
+
+
+class ContextAdapter(adapters.HTTPAdapter):
+    """Transport adapter using a fixed, preloaded SSLContext.
+
+    Certificate options of individual requests are ignored, so urllib3
+    never loads CA or certificate files into the context again.
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs) -> None:
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        conn.cert_reqs = 'CERT_REQUIRED'
+
+    def build_connection_pool_key_attributes(self, request, verify,
+                                             cert=None):
+        host_params, _ = super().build_connection_pool_key_attributes(
+            request, True)
+        return host_params, {'cert_reqs': 'CERT_REQUIRED'}
+
+
+def session(context: ssl.SSLContext) -> requests.Session:
+    """Return a requests session sending HTTPS requests through a context.
+
+    :param context: preloaded SSLContext
+    :returns: requests.Session
+    """
+    http = requests.Session()
+    http.mount('https://', ContextAdapter(context))
+    return http
@@ -0,0 +1,188 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Optional OpenTelemetry tracing.
+
+Without the opentelemetry-sdk package, or until configure() is called,
+spans are no-ops. Vault requests always carry a W3C ``traceparent``
+header so that Vault audit log entries of one vaultlocker run can be
+correlated even when no spans are exported.
+"""
+
+import contextlib
+import functools
+import inspect
+import logging
+import secrets
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    from opentelemetry import propagate
+    from opentelemetry import trace
+    from opentelemetry.sdk import resources
+    from opentelemetry.sdk import trace as sdk_trace
+    from opentelemetry.sdk.trace import export
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'vaultlocker'
+TRACEPARENT = 'traceparent'
+EXPORTER_OTLP = 'otlp'
+EXPORTER_FILE = 'file'
+EXPORTERS = (EXPORTER_OTLP, EXPORTER_FILE)
+
+# correlation ID of this process when no spans are recorded
+_TRACE_ID = secrets.token_hex(16)
+
+_provider = None
+_tracer = None
+
+
+def available() -> bool:
+    """Return whether the OpenTelemetry SDK is installed."""
+    return trace is not None
+
+
+def _span_exporter(exporter: str, target: Optional[str]):
+    if exporter == EXPORTER_FILE:
+        if not target:
+            raise ValueError('The file trace exporter needs a path')
+        stream = open(target, 'a')
+        return export.ConsoleSpanExporter(
+            out=stream,
+            formatter=lambda span: span.to_json(indent=None) + '\n',
+        )
+    try:
+        from opentelemetry.exporter.otlp.proto.http import trace_exporter
+    except ImportError:
+        raise ValueError('The otlp trace exporter requires the '
+                         'opentelemetry-exporter-otlp-proto-http package')
+    if target:
+        return trace_exporter.OTLPSpanExporter(endpoint=target)
+    # the endpoint defaults to OTEL_EXPORTER_OTLP_* or a local collector
+    return trace_exporter.OTLPSpanExporter()
+
+
+def configure(exporter: str, target: Optional[str] = None,
+              attributes: Optional[dict[str, Any]] = None) -> None:
+    """Export the spans of this process.
+
+    :param exporter: 'otlp' to send spans to a collector, or 'file' to
+                     append them as JSON lines to a file
+    :param target: collector endpoint URL or file path
+    :param attributes: resource attributes, e.g. the host name
+    :raises ValueError: if the exporter is unknown or not installed
+    """
+    global _provider, _tracer
+    if exporter not in EXPORTERS:
+        raise ValueError("Invalid trace exporter '{}'; must be one of "
+                         "{}".format(exporter, ', '.join(EXPORTERS)))
+    if not available():
+        raise ValueError('Tracing requires the opentelemetry-sdk package')
+    resource = resources.Resource.create(
+        dict(attributes or {}, **{'service.name': SERVICE_NAME}))
+    provider = sdk_trace.TracerProvider(resource=resource)
+    provider.add_span_processor(
+        export.BatchSpanProcessor(_span_exporter(exporter, target)))
+    _provider = provider
+    _tracer = provider.get_tracer(__name__)
+
+
+def shutdown() -> None:
+    """Flush the spans of this process and stop exporting."""
+    global _provider, _tracer
+    if _provider is not None:
+        _provider.shutdown()
+    _provider = _tracer = None
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Context manager recording a span, if tracing is configured.
+
+    Exceptions are recorded on the span and re-raised.
+
+    :param name: span name, e.g. 'vault.request'
+    :param attributes: span attributes; None values are left out
+    :returns: the span, or None
+    """
+    if _tracer is None:
+        yield None
+        return
+    attributes = {key: value for key, value in attributes.items()
+                  if value is not None}
+    with _tracer.start_as_current_span(name, attributes=attributes) as cur:
+        yield cur
+
+
+def traced(name: str, *arguments: str) -> Callable:
+    """Decorator recording each call of a function as a span.
+
+    :param name: span name
+    :param arguments: names of parameters to record as span attributes;
+                      never name a parameter holding a key
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def _attributes(args, kwargs):
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            return {
+                argument: str(bound[argument])
+                for argument in arguments if bound.get(argument) is not None
+            }
+
+        if inspect.iscoroutinefunction(func):
+            # the span must cover the awaited body, not the coroutine
+            # object creation
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await func(*args, **kwargs)
+                with span(name, **_attributes(args, kwargs)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(name, **_attributes(args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def headers() -> dict[str, str]:
+    """Return the trace context headers for an outgoing request.
+
+    :returns: dict with a W3C traceparent header
+    """
+    if _tracer is not None:
+        carrier: dict[str, str] = {}
+        propagate.inject(carrier)
+        if carrier:
+            return carrier
+    return {
+        TRACEPARENT: '00-{}-{}-01'.format(_TRACE_ID, secrets.token_hex(8)),
+    }
+
+
+def trace_id() -> str:
+    """Return the trace ID correlating the requests of this process."""
+    if _tracer is not None:
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            return trace.format_trace_id(context.trace_id)
+    return _TRACE_ID
@@ -11,13 +11,27 @@
 # under the License.
 
 import abc
-from typing import Any
+from typing import Any, Optional
 
 import hvac
 
+from vaultlocker import ratelimit
+from vaultlocker import tracing
+
 KV_VERSION_1 = '1'
 KV_VERSION_2 = '2'
 
+LAYOUT_DEVICE = 'device'
+LAYOUT_HOST = 'host'
+
+KEY_WRAPPING_NONE = 'none'
+KEY_WRAPPING_TRANSIT = 'transit'
+
+AUTH_APPROLE = 'approle'
+AUTH_CERT = 'cert'
+AUTH_TOKEN_FILE = 'token_file'
+AUTH_JWT = 'jwt'
+
 
 class KVStoreBase(abc.ABC):
     """Base class for accessing a Vault KV secrets engine."""
@@ -27,11 +41,18 @@ class KVStoreBase(abc.ABC):
         self.mount_point = mount_point
 
     @abc.abstractmethod
-    def write(self, path: str, secret: dict[str, Any]) -> None:
+    def write(
+        self, path: str, secret: dict[str, Any], cas: Optional[int] = None
+    ) -> dict[str, Any]:
         """Write a secret.
 
         :param path: path to the secret relative to the mount point
         :param secret: dictionary containing the secret data
+        :param cas: only write if the current version of the secret
+            matches; ``0`` only writes if the secret does not exist yet.
+            Only supported by KV version 2.
+        :return: metadata of the written version, e.g. ``version`` and
+            ``created_time``; empty for unversioned engines
         """
 
     @abc.abstractmethod
@@ -49,17 +70,37 @@ class KVStoreBase(abc.ABC):
         :param path: path to the secret relative to the mount point
         """
 
+    @abc.abstractmethod
+    def list(self, path: str) -> list[str]:
+        """Return the key names stored below a path.
+
+        Sub-paths are suffixed with ``/``.
+
+        :param path: path to list relative to the mount point
+        :return: list of key names
+        """
+
 
 class KVStoreV1(KVStoreBase):
     """Access a Vault KV version 1 secrets engine."""
 
-    def write(self, path: str, secret: dict[str, Any]) -> None:
+    @tracing.traced('vault.kv.write', 'path')
+    def write(
+        self, path: str, secret: dict[str, Any], cas: Optional[int] = None
+    ) -> dict[str, Any]:
+        if cas is not None:
+            raise ValueError(
+                'check-and-set writes require kv_version {}'.format(
+                    KV_VERSION_2)
+            )
         self.client.secrets.kv.v1.create_or_update_secret(
             path=path,
             secret=secret,
             mount_point=self.mount_point,
         )
+        return {}
 
+    @tracing.traced('vault.kv.read', 'path')
     def read(self, path: str) -> dict[str, Any]:
         response = self.client.secrets.kv.v1.read_secret(
             path=path,
@@ -67,36 +108,73 @@ class KVStoreV1(KVStoreBase):
         )
         return response['data']
 
+    @tracing.traced('vault.kv.delete', 'path')
     def delete(self, path: str) -> None:
         self.client.secrets.kv.v1.delete_secret(
             path=path,
             mount_point=self.mount_point,
         )
 
+    @tracing.traced('vault.kv.list', 'path')
+    def list(self, path: str) -> list[str]:
+        response = self.client.secrets.kv.v1.list_secrets(
+            path=path,
+            mount_point=self.mount_point,
+        )
+        return response['data']['keys']
+
 
 class KVStoreV2(KVStoreBase):
     """Access a Vault KV version 2 secrets engine."""
 
-    def write(self, path: str, secret: dict[str, Any]) -> None:
-        self.client.secrets.kv.v2.create_or_update_secret(
+    @tracing.traced('vault.kv.write', 'path')
+    def write(
+        self, path: str, secret: dict[str, Any], cas: Optional[int] = None
+    ) -> dict[str, Any]:
+        options = {} if cas is None else {'cas': cas}
+        response = self.client.secrets.kv.v2.create_or_update_secret(
             path=path,
             secret=secret,
             mount_point=self.mount_point,
+            **options,
         )
+        return response['data']
 
+    @tracing.traced('vault.kv.read', 'path')
     def read(self, path: str) -> dict[str, Any]:
+        return self.read_version(path)[0]
+
+    @tracing.traced('vault.kv.read_version', 'path')
+    def read_version(self, path: str) -> tuple[dict[str, Any], int]:
+        """Return an unwrapped secret dictionary and its version.
+
+        :param path: path to the secret relative to the mount point
+        :return: tuple of the secret data and its version number
+        """
         response = self.client.secrets.kv.v2.read_secret_version(
             path=path,
             mount_point=self.mount_point,
         )
-        return response['data']['data']
+        return (
+            response['data']['data'],
+            response['data']['metadata']['version'],
+        )
 
+    @tracing.traced('vault.kv.delete', 'path')
     def delete(self, path: str) -> None:
         self.client.secrets.kv.v2.delete_metadata_and_all_versions(
             path=path,
             mount_point=self.mount_point,
         )
 
+    @tracing.traced('vault.kv.list', 'path')
+    def list(self, path: str) -> list[str]:
+        response = self.client.secrets.kv.v2.list_secrets(
+            path=path,
+            mount_point=self.mount_point,
+        )
+        return response['data']['keys']
+
 
 class KVStore:
     """Factory for KV store implementations."""
@@ -124,3 +202,247 @@ class KVStore:
                 "Unsupported kv_version '{}'".format(kv_version)
             )
         return store_class(client, mount_point)
+
+
+class AuthBase(abc.ABC):
+    """Base class for Vault authentication methods."""
+
+    @abc.abstractmethod
+    def login(self, client: hvac.Client) -> None:
+        """Authenticate a client, setting its token.
+
+        :param client: hvac.Client to authenticate
+        """
+
+
+class AppRoleAuth(AuthBase):
+    """Log in with an AppRole role_id and secret_id."""
+
+    def __init__(
+        self, role_id: str, secret_id: str, mount_point: Optional[str] = None
+    ) -> None:
+        self.role_id = role_id
+        self.secret_id = secret_id
+        self.mount_point = mount_point
+
+    def login(self, client: hvac.Client) -> None:
+        options = {}
+        if self.mount_point:
+            options['mount_point'] = self.mount_point
+        client.auth.approle.login(
+            role_id=self.role_id,
+            secret_id=self.secret_id,
+            **options
+        )
+
+
+class CertAuth(AuthBase):
+    """Log in with the TLS client certificate of the connection.
+
+    The certificate is presented by the client's transport, so with a
+    preloaded TLS context the login and the secret reads that follow
+    share one connection.
+    """
+
+    def __init__(
+        self, name: Optional[str] = None, mount_point: str = 'cert'
+    ) -> None:
+        self.name = name
+        self.mount_point = mount_point
+
+    def login(self, client: hvac.Client) -> None:
+        payload = {'name': self.name} if self.name else {}
+        client.adapter.login(
+            '/v1/auth/{}/login'.format(self.mount_point), json=payload,
+        )
+
+
+class TokenFileAuth(AuthBase):
+    """Use a token maintained in a file, e.g. by a Vault agent sink.
+
+    No login request is made.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def login(self, client: hvac.Client) -> None:
+        with open(self.path) as token_file:
+            token = token_file.read().strip()
+        if not token:
+            raise ValueError('Empty Vault token file {}'.format(self.path))
+        client.token = token
+
+
+class JWTAuth(AuthBase):
+    """Log in with a JWT, e.g. an OIDC identity token, read from a file."""
+
+    def __init__(
+        self, role: str, path: str, mount_point: str = 'jwt'
+    ) -> None:
+        self.role = role
+        self.path = path
+        self.mount_point = mount_point
+
+    def login(self, client: hvac.Client) -> None:
+        with open(self.path) as jwt_file:
+            jwt = jwt_file.read().strip()
+        client.auth.jwt.jwt_login(
+            role=self.role, jwt=jwt, path=self.mount_point,
+        )
+
+
+class Auth:
+    """Factory for Vault authentication methods."""
+
+    _registry = {
+        AUTH_APPROLE: AppRoleAuth,
+        AUTH_CERT: CertAuth,
+        AUTH_TOKEN_FILE: TokenFileAuth,
+        AUTH_JWT: JWTAuth,
+    }
+
+    @classmethod
+    def methods(cls) -> list[str]:
+        """Return the names of the supported authentication methods."""
+        return list(cls._registry)
+
+    @classmethod
+    def get_auth(cls, method: str, **options) -> AuthBase:
+        """Return an authentication method.
+
+        :param method: name of the authentication method
+        :param options: method specific options
+        :returns: AuthBase: configured authentication method.
+        :raises ValueError: if method is not a supported value.
+        """
+        auth_class = cls._registry.get(method)
+        if auth_class is None:
+            raise ValueError(
+                "Unsupported auth_method '{}'".format(method)
+            )
+        return auth_class(**options)
+
+
+class TracedAdapter(hvac.adapters.JSONAdapter):
+    """JSON adapter recording Vault requests as trace spans.
+
+    Every request carries a W3C ``traceparent`` header, which Vault can
+    be told to record in its audit log.
+    """
+
+    def request(self, method, url, headers=None, *args, **kwargs):
+        attributes = {'http.method': method, 'url.path': url}
+        with tracing.span('vault.request', **attributes):
+            headers = dict(headers or {}, **tracing.headers())
+            return super().request(method, url, headers, *args, **kwargs)
+
+
+class GovernedAdapter(TracedAdapter):
+    """JSON adapter passing every request through a :class:`Governor`.
+
+    Logins, KV store calls and any other Vault API use go through the
+    adapter of a client, so this bounds all traffic of a process.
+    """
+
+    def __init__(
+        self, *args, governor: Optional[ratelimit.Governor] = None, **kwargs
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.governor = governor
+
+    def request(self, *args, **kwargs):
+        if self.governor is None:
+            return super().request(*args, **kwargs)
+        with self.governor.request():
+            return super().request(*args, **kwargs)
+
+
+def is_cas_conflict(error: hvac.exceptions.VaultError) -> bool:
+    """Return whether a write failed on a check-and-set version mismatch.
+
+    :param error: exception raised by a KV version 2 write
+    :returns: bool
+    """
+    return (
+        isinstance(error, hvac.exceptions.InvalidRequest) and
+        'check-and-set' in str(error)
+    )
+
+
+class TransitKeyWrapper:
+    """Wrap dm-crypt keys using a Vault transit engine key.
+
+    Only the transit ciphertext is stored in the KV secrets engine; the
+    key encryption key never leaves Vault.  Keys are wrapped and
+    unwrapped in batches so that any number of keys costs a single
+    request.
+    """
+
+    def __init__(
+        self, client: hvac.Client, mount_point: str, key_name: str
+    ) -> None:
+        self.client = client
+        self.mount_point = mount_point
+        self.key_name = key_name
+
+    def wrap(self, keys: list[str]) -> list[str]:
+        """Return transit ciphertexts for base64 encoded keys.
+
+        :param keys: list of base64 encoded dm-crypt keys
+        :returns: list of ciphertexts in the same order
+        """
+        response = self.client.secrets.transit.encrypt_data(
+            name=self.key_name,
+            batch_input=[{'plaintext': key} for key in keys],
+            mount_point=self.mount_point,
+        )
+        return self._batch_results(response, 'ciphertext')
+
+    def unwrap(self, ciphertexts: list[str]) -> list[str]:
+        """Return the base64 encoded keys held by transit ciphertexts.
+
+        :param ciphertexts: list of ciphertexts returned by :meth:`wrap`
+        :returns: list of dm-crypt keys in the same order
+        """
+        response = self.client.secrets.transit.decrypt_data(
+            name=self.key_name,
+            batch_input=[{'ciphertext': text} for text in ciphertexts],
+            mount_point=self.mount_point,
+        )
+        return self._batch_results(response, 'plaintext')
+
+    @staticmethod
+    def _batch_results(response: dict[str, Any], field: str) -> list[str]:
+        results = response['data']['batch_results']
+        for result in results:
+            if result.get('error'):
+                raise hvac.exceptions.InvalidRequest(result['error'])
+        return [result[field] for result in results]
+
+
+def wrap(client: hvac.Client, payload: dict[str, Any], ttl: str) -> str:
+    """Response-wrap a payload in a single-use Vault token.
+
+    :param client: Authenticated hvac.Client.
+    :param payload: JSON serialisable dictionary to wrap.
+    :param ttl: TTL of the wrapping token, e.g. ``'1h'``.
+    :returns: str: the wrapping token.
+    """
+    response = client.adapter.post(
+        '/v1/sys/wrapping/wrap',
+        json=payload,
+        headers={'X-Vault-Wrap-TTL': ttl},
+    )
+    return response['wrap_info']['token']
+
+
+def unwrap(client: hvac.Client, token: str) -> dict[str, Any]:
+    """Return the payload held by a wrapping token.
+
+    :param client: Authenticated hvac.Client.
+    :param token: Wrapping token returned by :func:`wrap`.
+    :returns: dict: the unwrapped payload.
+    """
+    response = client.sys.unwrap(token=token)
+    return response['data']